@@ -0,0 +1,384 @@
+# benchmarks/hot_paths.py
+"""
+熱路徑微基準測試 (Micro-benchmarks)
+
+以固定亂數種子產生 creditcard schema 的小型合成資料，離線 (不需 MLflow / Postgres) 量測：
+
+- predict_fraud.<模型>：API 單筆預測 (api.main.predict_transaction) 每筆的耗時，各模型皆走精簡服務格式
+- predict_batch.<模型>：API 批次推論 (predict_proba_with) 1000 筆的每筆耗時
+- scaler.*：舊模型路徑的 StandardScaler 與精簡格式 vectorize 內建 scaler
+- db_load.read_time_range.*：db_load 分批解析 CSV (完整檔案與時間區間)
+- transform_data.load_data：從特徵表載入、加入速度特徵並分割 (以 SQLite 取代 Postgres)
+- fit.<模型配置>：各模型配置在固定樣本上的訓練時間
+- keras.*：TensorFlow DNN 以 model.predict 與編譯推論路徑 (models.keras_serving) 的單筆與批次延遲
+
+結果以 commit 為鍵存成 benchmarks/results/<commit>.json；compare 模式比較兩次結果的中位數，
+任一項目變慢超過門檻 (預設 20%) 時以非零狀態結束，可直接放進 CI。
+
+用法 (於專案根目錄執行):
+    python benchmarks/hot_paths.py run [--filter predict_fraud] [--rows 20000]
+    python benchmarks/hot_paths.py compare <base commit 或 JSON> [<head commit 或 JSON>] [--threshold 0.2]
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+BENCHMARK_RESULTS_DIR = os.getenv('BENCHMARK_RESULTS_DIR', os.path.join(os.path.dirname(__file__), 'results'))
+BENCHMARK_ROWS = int(os.getenv('BENCHMARK_ROWS', '20000'))
+BENCHMARK_SEED = 42
+# 中位數變慢超過此比例視為退化
+REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', '0.2'))
+# 差距小於此值 (ms) 時視為量測雜訊，不判定退化
+REGRESSION_MIN_DELTA_MS = float(os.getenv('BENCHMARK_MIN_DELTA_MS', '0.005'))
+SINGLE_ROW_CALLS = 500
+BATCH_ROWS = 1000
+FIT_REPEAT = 3
+
+
+# --- 資料 ---
+def make_creditcard_sample(rows=BENCHMARK_ROWS, seed=BENCHMARK_SEED):
+    """產生與 creditcard.csv 相同欄位 (Time, V1..V28, Amount, Class) 的合成資料，約 2% 為詐欺。"""
+    rng = np.random.default_rng(seed)
+    label = (rng.random(rows) < 0.02).astype(int)
+    v = rng.standard_normal((rows, 28))
+    # 詐欺交易在部分 PCA 特徵上偏移，讓模型有可學的訊號 (訓練時間才接近真實資料)
+    v[label == 1, :10] -= rng.uniform(1, 3, 10)
+    df = pd.DataFrame(v, columns=[f'V{i}' for i in range(1, 29)])
+    df.insert(0, 'Time', np.floor(np.cumsum(rng.exponential(0.5, rows))))
+    df['Amount'] = np.round(rng.lognormal(3, 1.5, rows), 2)
+    df['Class'] = label
+    return df
+
+
+def feature_frame(df):
+    """轉成 feature_transactions 的欄位 (小寫)。"""
+    features = df.copy()
+    features.columns = [c.lower() for c in features.columns]
+    return features
+
+
+# --- 量測 ---
+def measure(fn, repeat, warmup=1, rows=1):
+    """執行 fn warmup + repeat 次，回傳每次耗時的統計 (ms) 與每筆耗時 (µs)。"""
+    for _ in range(warmup):
+        fn()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1000
+    median = float(np.median(times))
+    return {
+        "median_ms": median,
+        "p90_ms": float(np.percentile(times, 90)),
+        "min_ms": float(times.min()),
+        "repeat": repeat,
+        "rows": rows,
+        "per_row_us": median / rows * 1000,
+    }
+
+
+def cycle_calls(fn, items):
+    """回傳每次以下一個 item 呼叫 fn 的無參數函式 (單筆預測輪流使用不同交易)。"""
+    state = {"i": 0}
+
+    def call():
+        fn(items[state["i"] % len(items)])
+        state["i"] += 1
+    return call
+
+
+# --- 基準項目 ---
+def fit_models(X, y):
+    """以固定樣本訓練每個可在本機訓練的模型配置，回傳 ({model_type: 模型}, {基準名稱: 結果})。"""
+    from etl.model_configs import MODEL_CONFIGS, resolve_model_class
+
+    models, results = {}, {}
+    for config in MODEL_CONFIGS:
+        if config.get("type") == "tensorflow":
+            continue  # 由 tensorflow_flavor 另外處理
+        try:
+            model_class = resolve_model_class(config)
+        except ImportError as e:
+            print(f"⚠️  略過 {config['name']}: {e}")
+            continue
+
+        def fit(model_class=model_class, config=config):
+            models[config["tags"]["model_type"]] = model_class(**config["params"]).fit(X, y)
+        results[f"fit.{config['name']}"] = measure(fit, FIT_REPEAT, warmup=0, rows=len(X))
+    return models, results
+
+
+def tensorflow_flavor(X, y):
+    """建立並短暫訓練 TensorFlow DNN；環境沒有 TensorFlow 或模型模組時回傳 None。"""
+    try:
+        from models.tensorflow_model import build_fraud_detection_model
+    except ImportError as e:
+        print(f"⚠️  略過 TensorFlow 模型: {e}")
+        return None
+    model = build_fraud_detection_model(input_dim=X.shape[1])
+    model.fit(X.values, y.values, epochs=1, batch_size=256, verbose=0)
+    return model
+
+
+def bench_serving(models, X, records):
+    """各模型匯出精簡服務格式後，量測 API 單筆與批次預測。"""
+    from api.load_test import load_offline_serving, use_model
+    from models.serving_artifact import export_serving_artifact, load_serving_artifact, UnsupportedModelError
+
+    serving = load_offline_serving()
+    results = {}
+    for name, model in models.items():
+        export_dir = tempfile.mkdtemp(prefix="bench_artifact_")
+        try:
+            export_serving_artifact(model, export_dir, feature_order=list(X.columns), model_type=name)
+        except UnsupportedModelError as e:
+            print(f"⚠️  {name} 無法匯出精簡服務格式，略過推論基準: {e}")
+            continue
+        compact_model = load_serving_artifact(export_dir, run_id=f"bench-{name}")
+        use_model(serving, compact_model)
+        results[f"predict_fraud.{name}"] = measure(
+            cycle_calls(lambda record: serving.predict_transaction([record]), records), SINGLE_ROW_CALLS, warmup=20
+        )
+        batch = records[:BATCH_ROWS]
+        results[f"predict_batch.{name}"] = measure(
+            lambda: serving.predict_proba_with(serving.model, batch), 30, rows=len(batch)
+        )
+    return results
+
+
+def bench_keras(model, X):
+    """比較 Keras model.predict 與固定簽章編譯路徑的單筆與批次延遲。"""
+    from models.keras_serving import CompiledKerasModel
+
+    compiled = CompiledKerasModel(model)
+    values = X.to_numpy(dtype=np.float32)
+    rows = [values[i][None, :] for i in range(SINGLE_ROW_CALLS)]
+    batch = values[:BATCH_ROWS]
+    keras_predict = lambda x: model.predict(x, verbose=0)
+    return {
+        # model.predict 單筆需要數十毫秒，次數減少以控制總時間
+        "keras.model_predict.row": measure(cycle_calls(keras_predict, rows), 50, warmup=3),
+        "keras.model_predict.batch": measure(lambda: keras_predict(batch), 10, rows=len(batch)),
+        "keras.compiled.row": measure(cycle_calls(compiled.predict_proba, rows), SINGLE_ROW_CALLS, warmup=20),
+        "keras.compiled.batch": measure(lambda: compiled.predict_proba(batch), 30, rows=len(batch)),
+    }
+
+
+def bench_scalers(X, records):
+    from sklearn.preprocessing import StandardScaler
+    from models.serving_artifact import CompactModel
+
+    scaler = StandardScaler().fit(X[['amount', 'time']].values)
+    single = X[['amount', 'time']].values[:1]
+    batch = X[['amount', 'time']].values[:BATCH_ROWS]
+    # 只用來量測 vectorize (含 scaler) 的精簡模型，不需要模型參數
+    manifest = {
+        "kind": "linear", "model_type": "bench", "feature_order": list(X.columns), "threshold": 0.5,
+        "scaler": {"columns": ['amount', 'time'], "mean": list(scaler.mean_), "scale": list(scaler.scale_)},
+    }
+    compact = CompactModel(manifest, {})
+    return {
+        "scaler.standard_scaler.row": measure(lambda: scaler.transform(single), SINGLE_ROW_CALLS, warmup=20),
+        "scaler.standard_scaler.batch": measure(lambda: scaler.transform(batch), 100, rows=len(batch)),
+        "scaler.compact_vectorize.row": measure(
+            cycle_calls(lambda record: compact.vectorize([record]), records), SINGLE_ROW_CALLS, warmup=20
+        ),
+        "scaler.compact_vectorize.batch": measure(
+            lambda: compact.vectorize(records[:BATCH_ROWS]), 30, rows=BATCH_ROWS
+        ),
+    }
+
+
+def bench_csv_parse(raw):
+    from etl.db_load import read_time_range
+
+    csv_path = os.path.join(tempfile.mkdtemp(prefix="bench_csv_"), "creditcard.csv")
+    raw.to_csv(csv_path, index=False)
+    t_lo, t_hi = raw['Time'].quantile([0.4, 0.5])
+    return {
+        "db_load.read_time_range.full": measure(
+            lambda: read_time_range(csv_path, -np.inf, np.inf), 5, rows=len(raw)
+        ),
+        "db_load.read_time_range.slice": measure(
+            lambda: read_time_range(csv_path, t_lo, t_hi), 5, rows=len(raw)
+        ),
+    }
+
+
+def bench_load_data(features):
+    from sqlalchemy import create_engine
+    from etl.transform_data import FEATURE_VIEW_NAME, load_data
+
+    # 以記憶體內 SQLite 的同名資料表取代 Postgres 視圖，量測 read_sql + 速度特徵 + 分割
+    engine = create_engine("sqlite://")
+    features.to_sql(FEATURE_VIEW_NAME, engine, index=False)
+    return {"transform_data.load_data": measure(lambda: load_data(engine), 5, rows=len(features))}
+
+
+BENCHMARK_GROUPS = ["fit", "predict_fraud", "predict_batch", "keras", "scaler", "db_load", "transform_data"]
+
+
+def run_suite(rows=BENCHMARK_ROWS, name_filter=None):
+    """執行所有 (或名稱包含 name_filter 的) 基準項目，回傳 {名稱: 結果}。"""
+    # 過濾字串對應到某些群組 (例如 predict_fraud.XGBoost → predict_fraud) 時只執行這些群組，否則全部執行後再過濾
+    groups = [g for g in BENCHMARK_GROUPS if name_filter and (g in name_filter or name_filter in g)]
+    selected = lambda *names: not groups or any(g in groups for g in names)
+    raw = make_creditcard_sample(rows)
+    features = feature_frame(raw)
+    X, y = features.drop(columns='class'), features['class']
+    records = X.to_dict('records')
+
+    results = {}
+    if selected("fit", "predict_fraud", "predict_batch", "keras"):
+        models, fit_results = fit_models(X, y)
+        results.update(fit_results)
+        tf_model = tensorflow_flavor(X, y)
+        if tf_model is not None:
+            models["TensorFlow"] = tf_model
+            if selected("keras"):
+                results.update(bench_keras(tf_model, X))
+        if selected("predict_fraud", "predict_batch"):
+            results.update(bench_serving(models, X, records))
+    if selected("scaler"):
+        results.update(bench_scalers(X, records))
+    if selected("db_load"):
+        results.update(bench_csv_parse(raw))
+    if selected("transform_data"):
+        results.update(bench_load_data(features))
+    if name_filter:
+        results = {name: result for name, result in results.items() if name_filter in name}
+    return results
+
+
+# --- 結果儲存與比較 ---
+def current_commit():
+    """回傳目前 HEAD 的短 hash；工作目錄有未提交的修改時加上 -dirty。"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short=12", "HEAD"], text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True,
+                                        stderr=subprocess.DEVNULL).strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def results_path(key):
+    """commit 或 JSON 路徑 → 結果檔路徑。"""
+    return key if key.endswith('.json') else os.path.join(BENCHMARK_RESULTS_DIR, f"{key}.json")
+
+
+def save_results(benchmarks, commit, rows):
+    os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+    report = {"commit": commit, "timestamp": time.time(), "rows": rows, "machine": machine_info(),
+              "benchmarks": benchmarks}
+    path = results_path(commit)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def load_results(key):
+    with open(results_path(key)) as f:
+        return json.load(f)
+
+
+def compare_results(base, head, threshold=REGRESSION_THRESHOLD, min_delta_ms=REGRESSION_MIN_DELTA_MS):
+    """逐項比較中位數，回傳 (列表, 退化項目名稱)；列表每列為 (名稱, base ms, head ms, 變化比例, 狀態)。"""
+    rows, regressions = [], []
+    names = sorted(set(base["benchmarks"]) | set(head["benchmarks"]))
+    for name in names:
+        before, after = base["benchmarks"].get(name), head["benchmarks"].get(name)
+        if before is None or after is None:
+            rows.append((name, before and before["median_ms"], after and after["median_ms"], None,
+                         "new" if before is None else "missing"))
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        if change > threshold and after["median_ms"] - before["median_ms"] > min_delta_ms:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((name, before["median_ms"], after["median_ms"], change, status))
+    return rows, regressions
+
+
+def print_results(benchmarks):
+    print(f"\n{'benchmark':<44}{'median ms':>12}{'p90 ms':>12}{'µs/row':>12}")
+    for name, result in sorted(benchmarks.items()):
+        print(f"{name:<44}{result['median_ms']:>12.4f}{result['p90_ms']:>12.4f}{result['per_row_us']:>12.3f}")
+
+
+def print_comparison(rows, base, head, threshold):
+    print(f"\n比較 {base['commit']} → {head['commit']} (門檻 +{threshold:.0%})")
+    if base.get("machine") != head.get("machine"):
+        print("⚠️  兩次結果來自不同的機器或套件版本，差異可能不只來自程式碼")
+    print(f"{'benchmark':<44}{'base ms':>12}{'head ms':>12}{'change':>10}  status")
+    for name, before, after, change, status in rows:
+        fmt = lambda value: f"{value:>12.4f}" if value is not None else f"{'-':>12}"
+        change_text = f"{change:>+10.1%}" if change is not None else f"{'-':>10}"
+        print(f"{name:<44}{fmt(before)}{fmt(after)}{change_text}  {status}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="熱路徑微基準測試與退化比較")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="執行基準測試並以目前 commit 儲存結果")
+    run_parser.add_argument("--filter", help="只執行名稱包含此字串的項目 (例如 predict_fraud)")
+    run_parser.add_argument("--rows", type=int, default=BENCHMARK_ROWS, help="合成資料筆數")
+    run_parser.add_argument("--commit", help="結果的鍵 (預設為目前 HEAD)")
+    compare_parser = sub.add_parser("compare", help="比較兩次結果，有退化時以狀態碼 1 結束")
+    compare_parser.add_argument("base", help="基準 commit 或結果 JSON 路徑")
+    compare_parser.add_argument("head", nargs="?", help="比較對象 (預設為目前 HEAD，沒有結果時先執行)")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="允許的變慢比例")
+    compare_parser.add_argument("--rows", type=int, default=BENCHMARK_ROWS, help="需要先執行時的合成資料筆數")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        commit = args.commit or current_commit()
+        benchmarks = run_suite(args.rows, args.filter)
+        print_results(benchmarks)
+        print(f"\n✅ 結果已寫入 {save_results(benchmarks, commit, args.rows)}")
+        return
+
+    base = load_results(args.base)
+    head_key = args.head or current_commit()
+    if not os.path.exists(results_path(head_key)):
+        print(f"找不到 {head_key} 的結果，先執行基準測試...")
+        save_results(run_suite(args.rows), head_key, args.rows)
+    head = load_results(head_key)
+    rows, regressions = compare_results(base, head, args.threshold)
+    print_comparison(rows, base, head, args.threshold)
+    if regressions:
+        print(f"\n🔥 {len(regressions)} 項退化超過 {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+    print("\n✅ 沒有超過門檻的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+詐欺偵測回填 DAG
+手動觸發，對指定時間範圍重載原始交易並重新評分，用於修正資料或評分邏輯後重算歷史區間
+
+作者: Fraud Detection Team
+
+觸發參數 (Trigger DAG w/ config)：
+- time_start / time_end: 回填範圍 (time 欄位，秒，左閉右開)
+- partition_seconds: 分區寬度，預設一天
+- model_run_id: 重算評分使用的模型 run，留空則使用最新的 selected_for_serving
+- reload_raw / rescore: 是否重載原始交易 / 重算評分
+
+分兩個映射任務執行：reload_partition 先重載所有分區，全部完成後 rescore_partition 才開始評分
+(速度特徵的參考流會讀到前一個分區，重載與評分交錯時邊界附近的評分結果不固定)。
+每個階段同時執行的分區數由 BACKFILL_PARALLELISM 限制。
+"""
+
+from datetime import datetime
+from airflow import DAG
+from airflow.models.param import Param
+from airflow.providers.standard.operators.python import PythonOperator
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+import sys
+import os
+
+# === 環境自適應設定 (與 fraud_detection_dag 相同) ===
+dag_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(dag_dir)
+
+IS_DOCKER = os.path.exists('/opt/airflow')
+
+if IS_DOCKER:
+    SRC_PATH = '/opt/airflow/src'
+    PROJECT_ROOT = '/opt/airflow'
+    MLFLOW_URI = 'http://mlflow_server:5000'
+else:
+    SRC_PATH = os.path.join(project_root, 'src')
+    PROJECT_ROOT = project_root
+    MLFLOW_URI = os.getenv('AIRFLOW_MLFLOW_URI', 'http://127.0.0.1:5000')
+
+sys.path.append(SRC_PATH)
+
+# 同時執行的分區數上限
+BACKFILL_PARALLELISM = int(os.getenv('BACKFILL_PARALLELISM', '4'))
+
+default_args = {
+    'owner': 'fraud-detection-team',
+    'depends_on_past': False,
+    'start_date': datetime(2025, 9, 30),
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 1,
+}
+
+dag = DAG(
+    'fraud_detection_backfill',
+    default_args=default_args,
+    description='詐欺偵測歷史區間分區平行回填',
+    schedule=None,  # 只能手動觸發
+    catchup=False,
+    tags=['fraud-detection', 'etl', 'backfill'],
+    params={
+        'time_start': Param(0, type='number', description='回填起始 time (秒，含)'),
+        'time_end': Param(172800, type='number', description='回填結束 time (秒，不含)'),
+        'partition_seconds': Param(86400, type='number', minimum=1, description='分區寬度 (秒)'),
+        'model_run_id': Param('', type='string', description='模型 run，留空使用最新的服務模型'),
+        'reload_raw': Param(True, type='boolean', description='重載原始交易'),
+        'rescore': Param(True, type='boolean', description='重算評分'),
+    },
+)
+
+def get_fraud_db_uri():
+    """從 Airflow Connection 'postgres_fraud_db' 取得 SQLAlchemy 連線字串"""
+    uri = PostgresHook(postgres_conn_id='postgres_fraud_db').get_uri()
+    # 部分 provider 版本回傳 postgres:// 前綴，SQLAlchemy 只接受 postgresql://
+    return uri.replace('postgres://', 'postgresql://', 1)
+
+# 任務 1: 規劃分區 (模型在這裡決定一次，所有分區使用同一個模型)
+def plan_backfill(params):
+    """依觸發參數切分回填分區"""
+    from etl.backfill import plan_backfill_partitions
+    from etl.batch_scoring import find_serving_run_id
+
+    partitions = plan_backfill_partitions(
+        float(params['time_start']), float(params['time_end']), float(params['partition_seconds'])
+    )
+    model_run_id = None
+    if params['rescore']:
+        model_run_id = params['model_run_id'] or find_serving_run_id(MLFLOW_URI)
+
+    print(f"📋 回填 {len(partitions)} 個分區，模型 {model_run_id}，最多 {BACKFILL_PARALLELISM} 個同時執行")
+    return [
+        {
+            **partition,
+            "model_run_id": model_run_id,
+            "reload_raw": bool(params['reload_raw']),
+            "rescore": bool(params['rescore']),
+        }
+        for partition in partitions
+    ]
+
+def run_partition_phase(time_start, time_end, model_run_id, reload_raw, rescore):
+    """以指定階段 (重載或評分) 執行單一分區的回填"""
+    from etl.backfill import backfill_partition
+
+    result = backfill_partition(
+        time_start, time_end,
+        model_run_id=model_run_id,
+        database_url=get_fraud_db_uri(),
+        tracking_uri=MLFLOW_URI,
+        data_path=os.path.join(PROJECT_ROOT, 'data', 'creditcard.csv'),
+        reload_raw=reload_raw,
+        rescore=rescore,
+    )
+    print(f"✅ 分區 [{time_start:.0f}, {time_end:.0f}) 完成: {result}")
+    return {key: result[key] for key in ("reloaded_rows", "scored_rows")}
+
+# 任務 2: 重載單一分區的原始交易
+def reload_partition(time_start, time_end, model_run_id, reload_raw, rescore):
+    """重載單一時間分區 (reload_raw=False 時不做事)"""
+    if not reload_raw:
+        print("⏭️  未要求重載原始交易，跳過")
+        return {"reloaded_rows": 0, "scored_rows": 0}
+    return run_partition_phase(time_start, time_end, model_run_id, reload_raw=True, rescore=False)
+
+# 任務 3: 重新評分單一分區 (所有分區重載完成後才執行)
+def rescore_partition(time_start, time_end, model_run_id, reload_raw, rescore):
+    """重新評分單一時間分區 (rescore=False 時不做事)"""
+    if not rescore:
+        print("⏭️  未要求重算評分，跳過")
+        return {"reloaded_rows": 0, "scored_rows": 0}
+    return run_partition_phase(time_start, time_end, model_run_id, reload_raw=False, rescore=True)
+
+plan_task = PythonOperator(
+    task_id='plan_backfill_partitions',
+    python_callable=plan_backfill,
+    dag=dag,
+)
+
+reload_task = PythonOperator.partial(
+    task_id='reload_partition',
+    python_callable=reload_partition,
+    max_active_tis_per_dagrun=BACKFILL_PARALLELISM,
+    dag=dag,
+).expand(op_kwargs=plan_task.output)
+
+rescore_task = PythonOperator.partial(
+    task_id='rescore_partition',
+    python_callable=rescore_partition,
+    max_active_tis_per_dagrun=BACKFILL_PARALLELISM,
+    dag=dag,
+).expand(op_kwargs=plan_task.output)
+
+# 映射任務之間的依賴會等上游所有分區完成，評分不會與任何分區的重載交錯
+plan_task >> reload_task >> rescore_task
+
+plan_task.doc_md = """
+依觸發參數將回填範圍切成固定寬度的分區，並決定重算評分使用的模型
+"""
+
+reload_task.doc_md = """
+每個分區在自己的資料庫交易中重載 raw_transactions 的該時間範圍；範圍外的資料不受影響
+"""
+
+rescore_task.doc_md = """
+所有分區重載完成後，刪除並重算 transaction_scores 中同一模型、同一時間範圍的評分
+"""
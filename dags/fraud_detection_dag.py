@@ -90,12 +90,27 @@ def check_database_connection():
         print("請確認 Airflow Connection 'postgres_fraud_db' 已正確配置")
         raise
 
-# 任務 2: 載入新數據 (使用 BashOperator)
-# 移除 Python 函式，改用 BashOperator 執行 db_load.py 腳本
+# 資料庫連線一律取自 Airflow Connection，不在指令中寫死帳號密碼
+def get_fraud_db_uri():
+    """從 Airflow Connection 'postgres_fraud_db' 取得 SQLAlchemy 連線字串"""
+    uri = PostgresHook(postgres_conn_id='postgres_fraud_db').get_uri()
+    # 部分 provider 版本回傳 postgres:// 前綴，SQLAlchemy 只接受 postgresql://
+    return uri.replace('postgres://', 'postgresql://', 1)
+
+# 任務 2: 載入新數據 (在任務行程內直接呼叫，不再另外啟動 Python 子行程)
+def load_new_data(data_path, run_id):
+    """呼叫 db_load.load_raw_data 將 CSV 載入 raw_transactions"""
+    from etl.db_load import load_raw_data
+
+    rows = load_raw_data(database_url=get_fraud_db_uri(), data_path=data_path, pipeline_run_id=run_id)
+    print(f"✅ 已載入 {rows} 筆交易資料")
+    return rows
 
 # 任務 3: 創建特徵視圖 
-def create_feature_view():
-    """創建或更新 feature_transactions 視圖"""
+def create_feature_view(run_id):
+    """創建或更新 feature_transactions 視圖 (耗時與筆數記錄到 pipeline_runs)"""
+    from etl.telemetry import record_task
+
     postgres_hook = PostgresHook(postgres_conn_id='postgres_fraud_db')
     
     # 特徵視圖 SQL
@@ -117,32 +132,85 @@ def create_feature_view():
     """
     
     try:
-        print("🔧 創建/更新 feature_transactions 視圖...")
-        
-        # 先刪除現有視圖以避免衝突
-        drop_view_sql = "DROP VIEW IF EXISTS feature_transactions CASCADE;"
-        postgres_hook.run(drop_view_sql)
-        print("已刪除現有視圖")
-        
-        # 創建新視圖
-        postgres_hook.run(create_view_sql)
-        
-        # 驗證視圖創建成功
-        count_query = "SELECT COUNT(*) FROM feature_transactions"
-        result = postgres_hook.get_first(count_query)
-        
-        print(f"✅ feature_transactions 視圖創建成功，包含 {result[0]} 筆記錄")
-        return True
+        with record_task("create_feature_view", get_fraud_db_uri(), run_id) as telemetry:
+            print("🔧 創建/更新 feature_transactions 視圖...")
+            
+            # 先刪除現有視圖以避免衝突
+            drop_view_sql = "DROP VIEW IF EXISTS feature_transactions CASCADE;"
+            postgres_hook.run(drop_view_sql)
+            print("已刪除現有視圖")
+            
+            # 創建新視圖
+            postgres_hook.run(create_view_sql)
+            
+            # 驗證視圖創建成功 (COUNT 會掃描整個 raw_transactions，以其大小作為讀取量)
+            count_query = "SELECT COUNT(*), pg_total_relation_size('raw_transactions') FROM feature_transactions"
+            result = postgres_hook.get_first(count_query)
+            telemetry["rows_processed"] = result[0]
+            telemetry["bytes_read"] = result[1]
+            
+            print(f"✅ feature_transactions 視圖創建成功，包含 {result[0]} 筆記錄")
+            return True
         
     except Exception as e:
         print(f"❌ 特徵視圖創建失敗: {e}")
         raise
 
-# 任務 4: 執行模型訓練 (使用 BashOperator)
-# 移除 Python 函式，改用 BashOperator 執行腳本
+# 任務 4: 執行模型訓練 (動態映射：每個模型配置一個任務，可並行並各自重試)
+def list_model_configs():
+    """列出所有模型配置名稱，作為動態任務映射的輸入"""
+    # 只讀取配置模組，不載入任何機器學習框架
+    from etl.model_configs import get_model_config_names
+
+    names = get_model_config_names()
+    print(f"📋 將並行訓練 {len(names)} 個模型: {names}")
+    return [{"name": name} for name in names]
+
+def train_model(name, run_id):
+    """訓練單一模型配置；run_id 為 Airflow DAG run ID，用來標記同一次管道執行的 MLflow run"""
+    # 延遲載入：只有實際訓練的模型框架會被 import (例如 LogisticRegression 任務不載入 TensorFlow)
+    from etl.transform_data import run_single_model
+
+    summary = run_single_model(
+        name,
+        pipeline_run_id=run_id,
+        database_url=get_fraud_db_uri(),
+        tracking_uri=MLFLOW_URI,
+    )
+    return summary.get("run_id")
+
+# 任務 5: 從本次所有成功的訓練 run 中選出服務模型
+def select_best_model(run_id):
+    """依延遲 SLO 與 F1 從本次管道執行的訓練結果中選出服務模型"""
+    from etl.transform_data import select_serving_model
+
+    selected = select_serving_model(pipeline_run_id=run_id, tracking_uri=MLFLOW_URI)
+    return selected["run_id"]
+
+# 任務 6: 以選出的服務模型批次評分 (依 time 切分區間，映射任務平行評分)
+def plan_scoring_partitions(ti):
+    """規劃評分區間，每個區間都帶上 select_best_model 選出的模型 run，確保所有區間使用同一個模型"""
+    from etl.batch_scoring import plan_scoring_partitions as plan
+
+    model_run_id = ti.xcom_pull(task_ids='select_best_model')
+    partitions = plan(database_url=get_fraud_db_uri())
+    print(f"📋 將以模型 {model_run_id} 平行評分 {len(partitions)} 個時間區間")
+    return [{**partition, "model_run_id": model_run_id} for partition in partitions]
+
+def score_transactions(time_start, time_end, model_run_id):
+    """為單一時間區間評分並寫入 transaction_scores (可從水位續跑)"""
+    from etl.batch_scoring import run_batch_scoring
+
+    return run_batch_scoring(
+        time_start=time_start,
+        time_end=time_end,
+        model_run_id=model_run_id,
+        database_url=get_fraud_db_uri(),
+        tracking_uri=MLFLOW_URI,
+    )
 
 
-# 任務 6: 清理暫存檔案
+# 任務 7: 清理暫存檔案
 cleanup_task = BashOperator(
     task_id='cleanup_temp_files',
     bash_command='echo "🧹 清理暫存檔案..." && find /tmp -name "*fraud*" -type f -delete 2>/dev/null || true',
@@ -156,17 +224,10 @@ db_check_task = PythonOperator(
     dag=dag,
 )
 
-data_load_task = BashOperator(
+data_load_task = PythonOperator(
     task_id='load_new_data',
-    bash_command=f"""
-    cd {SRC_PATH} && \
-    export DB_HOST={DB_HOST} && \
-    export DB_NAME=fraud_db && \
-    export DB_USER=user && \
-    export DB_PASSWORD=password && \
-    export DATA_PATH={PROJECT_ROOT}/data/creditcard.csv && \
-    python -m etl.db_load
-    """,
+    python_callable=load_new_data,
+    op_kwargs={'data_path': os.path.join(PROJECT_ROOT, 'data', 'creditcard.csv')},
     dag=dag,
 )
 
@@ -176,23 +237,42 @@ create_feature_view_task = PythonOperator(
     dag=dag,
 )
 
-model_training_task = BashOperator(
+list_models_task = PythonOperator(
+    task_id='list_model_configs',
+    python_callable=list_model_configs,
+    dag=dag,
+)
+
+# 每個模型配置一個映射任務，可在不同 worker 上並行執行並各自重試
+model_training_task = PythonOperator.partial(
     task_id='perform_model_training',
-    bash_command=f"""
-    cd {PROJECT_ROOT} && \
-    export DB_HOST={DB_HOST} && \
-    export DB_NAME=fraud_db && \
-    export DB_USER=user && \
-    export DB_PASSWORD=password && \
-    export MLFLOW_TRACKING_URI={MLFLOW_URI} && \
-    python -m src.etl.transform_data || true
-    echo "✅ 模型訓練任務完成"
-    """,
+    python_callable=train_model,
+    dag=dag,
+).expand(op_kwargs=list_models_task.output)
+
+# trigger_rule='all_done'：單一模型失敗不會阻擋其他模型的結果被部署，失敗的映射任務仍會在 UI 上顯示
+select_model_task = PythonOperator(
+    task_id='select_best_model',
+    python_callable=select_best_model,
+    trigger_rule='all_done',
     dag=dag,
 )
 
+plan_scoring_task = PythonOperator(
+    task_id='plan_scoring_partitions',
+    python_callable=plan_scoring_partitions,
+    dag=dag,
+)
+
+score_task = PythonOperator.partial(
+    task_id='score_transactions',
+    python_callable=score_transactions,
+    dag=dag,
+).expand(op_kwargs=plan_scoring_task.output)
+
 # 修正後的任務依賴關係 - 簡化版本，跳過容易失敗的驗證步驟
-db_check_task >> data_load_task >> create_feature_view_task >> model_training_task >> cleanup_task
+db_check_task >> data_load_task >> create_feature_view_task >> list_models_task >> model_training_task >> select_model_task \
+    >> plan_scoring_task >> score_task >> cleanup_task
 
 # 添加任務文檔
 db_check_task.doc_md = """
@@ -201,7 +281,7 @@ db_check_task.doc_md = """
 """
 
 data_load_task.doc_md = """
-執行資料載入腳本 (db_load.py)
+呼叫 db_load.load_raw_data (連線資訊取自 Connection 'postgres_fraud_db')
 重新載入信用卡交易數據並創建基礎 raw_transactions 表
 """
 
@@ -210,11 +290,28 @@ create_feature_view_task.doc_md = """
 這個視圖是模型訓練的核心數據來源，包含所有必要的特徵
 """
 
+list_models_task.doc_md = """
+列出 etl/model_configs.py 中的所有模型配置，作為訓練任務動態映射的輸入
+"""
+
 model_training_task.doc_md = """
-執行機器學習模型訓練腳本 (transform_data.py)
-使用 feature_transactions 視圖訓練多個模型並將最佳模型記錄到 MLflow
+呼叫 transform_data.run_single_model 訓練單一模型配置
+每個模型配置是一個獨立的映射任務，可在不同 worker 上並行執行，失敗與重試也各自獨立
+"""
+
+select_model_task.doc_md = """
+讀取本次管道執行 (DAG run_id) 的 MLflow 訓練結果，
+依延遲 SLO 與 F1 選出服務模型並標記 selected_for_serving
+"""
+
+plan_scoring_task.doc_md = """
+依 raw_transactions 的 time 範圍切分評分區間 (數量由 SCORING_PARTITIONS 設定)
 """
 
+score_task.doc_md = """
+載入服務模型一次，以大批次向量化評分並用 COPY 寫入 transaction_scores (含 run_id 與門檻)
+依 transaction_id 水位續跑，重試時不會重複評分
+"""
 
 cleanup_task.doc_md = """
 清理執行過程中產生的暫存檔案
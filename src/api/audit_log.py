@@ -0,0 +1,322 @@
+# src/api/audit_log.py
+"""
+預測稽核紀錄 (Write-behind Audit Log)
+
+每筆評分過的交易 (輸入特徵、機率、決策、門檻、模型 run_id、評分時間) 都要寫入 Postgres 的
+prediction_audit，但不能在請求路徑上同步 INSERT：
+
+- 請求路徑只把 (輸入, 機率, 門檻, run_id, 時間) 放進記憶體緩衝區 (一次 append，與筆數無關)
+- 背景執行緒湊滿 AUDIT_BATCH_SIZE 筆或每 AUDIT_FLUSH_SECONDS 秒，以 COPY 批次寫入，
+  連線取自 SQLAlchemy 連線池 (pool_pre_ping 自動替換斷掉的連線)
+- 緩衝區上限 AUDIT_MAX_BUFFER 筆；資料庫變慢或斷線造成緩衝區滿時依 AUDIT_OVERFLOW 處理：
+  spill = 新資料寫成 CSV 檔到 AUDIT_SPILL_DIR，資料庫恢復後由背景執行緒補寫並刪除；drop = 丟棄並計數。
+  spill 是在請求路徑上同步寫檔，緩衝區滿的期間 /predict 延遲會退化為磁碟寫入延遲
+- 多個 worker / replica 共用 spill 目錄時，補寫前先以原子 rename 認領檔案 (*.<host>-<pid>.claimed)，
+  同一個檔案只會被一個行程寫入；行程在 COPY 途中當掉時認領檔會留在目錄中，需人工確認後改回原名
+- 寫入失敗的批次放回緩衝區前端，以指數退避重試
+- 關閉時 (FastAPI shutdown) 在 AUDIT_SHUTDOWN_SECONDS 內寫完緩衝區，寫不完的部分落地到 spill 目錄
+"""
+import io
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from api.serving_metrics import ServingMetrics
+
+AUDIT_TABLE = 'prediction_audit'
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '2000'))
+AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '1'))
+AUDIT_MAX_BUFFER = int(os.getenv('AUDIT_MAX_BUFFER', '100000'))
+AUDIT_OVERFLOW = os.getenv('AUDIT_OVERFLOW', 'spill')  # spill | drop
+AUDIT_SPILL_DIR = os.getenv('AUDIT_SPILL_DIR', '/tmp/prediction_audit_spill')
+AUDIT_SHUTDOWN_SECONDS = float(os.getenv('AUDIT_SHUTDOWN_SECONDS', '10'))
+AUDIT_MAX_BACKOFF_SECONDS = 30.0
+
+# 與 API 的 Transaction schema 相同的輸入欄位 (速度特徵可由 time/amount 重算，不另外保存)
+TRANSACTION_FIELDS = ['time', 'amount'] + [f'v{i}' for i in range(1, 29)]
+AUDIT_COLUMNS = ["scored_at", "endpoint", "run_id", "fraud_probability", "is_fraud", "threshold"] + TRANSACTION_FIELDS
+
+CREATE_AUDIT_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (
+    id BIGSERIAL PRIMARY KEY,
+    scored_at TIMESTAMPTZ NOT NULL,
+    endpoint TEXT NOT NULL,
+    run_id TEXT,
+    fraud_probability DOUBLE PRECISION NOT NULL,
+    is_fraud SMALLINT NOT NULL,
+    threshold DOUBLE PRECISION NOT NULL,
+    {', '.join(f'{name} DOUBLE PRECISION' for name in TRANSACTION_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS idx_{AUDIT_TABLE}_scored_at ON {AUDIT_TABLE} (scored_at);
+"""
+
+
+class AuditLogSink:
+    """執行緒安全的 write-behind 稽核紀錄；log() 只入列，寫入由背景執行緒負責。"""
+
+    def __init__(self, database_url, batch_size=AUDIT_BATCH_SIZE, flush_seconds=AUDIT_FLUSH_SECONDS,
+                 max_buffer=AUDIT_MAX_BUFFER, overflow=AUDIT_OVERFLOW, spill_dir=AUDIT_SPILL_DIR):
+        from sqlalchemy import create_engine
+        if overflow not in ("spill", "drop"):
+            raise ValueError(f"AUDIT_OVERFLOW 必須是 spill 或 drop，收到 {overflow}")
+        # 只有一個背景寫入執行緒，連線池保留一條連線即可
+        self.engine = create_engine(database_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        # 每個元素是一次請求：(records, 機率陣列, 門檻, run_id, endpoint, 評分時間)
+        self._buffer = deque()
+        self._buffered_rows = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._table_ready = False
+        self._healthy = True
+        self._spill_seq = 0
+        self.flush_latency = ServingMetrics()
+        self.counts = {
+            "enqueued_rows": 0, "flushed_rows": 0, "dropped_rows": 0,
+            "spilled_rows": 0, "replayed_rows": 0, "flush_errors": 0,
+        }
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    # --- 請求路徑 ---
+    def log(self, records, proba, threshold, run_id, endpoint):
+        """把一次請求的評分結果放入緩衝區；緩衝區已滿時依 overflow 設定落地或丟棄。"""
+        chunk = (records, proba, threshold, run_id, endpoint, time.time())
+        with self._cond:
+            if self._buffered_rows + len(records) <= self.max_buffer:
+                self._buffer.append(chunk)
+                self._buffered_rows += len(records)
+                self.counts["enqueued_rows"] += len(records)
+                if self._buffered_rows >= self.batch_size:
+                    self._cond.notify()
+                return
+        # 緩衝區已滿代表資料庫跟不上或無法連線，這時才在請求路徑上寫檔
+        self._overflow([chunk])
+
+    # --- 背景寫入 ---
+    def _run(self):
+        backoff = self.flush_seconds
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or self._buffered_rows >= self.batch_size,
+                                    timeout=self.flush_seconds)
+                stopping = self._stopping
+                chunks = self._take(self.batch_size)
+
+            if chunks and not self._flush(chunks):
+                with self._cond:
+                    stopping = self._stopping
+                if stopping:
+                    # 關閉期間寫入失敗：close() 可能已等待逾時並處理完緩衝區，這批由本執行緒直接落地
+                    self._overflow(chunks)
+                    return  # 緩衝區剩下的由 close() 落地
+                self._requeue(chunks)
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopping, timeout=backoff)
+                backoff = min(backoff * 2, AUDIT_MAX_BACKOFF_SECONDS)
+                continue
+
+            backoff = self.flush_seconds
+            if not chunks:
+                # 緩衝區清空後才補寫落地檔，讓即時資料優先
+                self._replay_spill_files()
+                if stopping:
+                    return
+
+    def _take(self, max_rows):
+        """取出最多約 max_rows 筆 (至少一個請求) 的緩衝資料；呼叫端需持有鎖。"""
+        chunks, rows = [], 0
+        while self._buffer and rows < max_rows:
+            chunk = self._buffer.popleft()
+            chunks.append(chunk)
+            rows += len(chunk[0])
+        self._buffered_rows -= rows
+        return chunks
+
+    def _overflow(self, chunks):
+        """無法寫入資料庫的批次依 overflow 設定落地或丟棄。"""
+        if self.overflow == "spill":
+            self._spill(chunks)
+        else:
+            with self._cond:
+                self.counts["dropped_rows"] += sum(len(chunk[0]) for chunk in chunks)
+
+    def _requeue(self, chunks):
+        with self._cond:
+            self._buffer.extendleft(reversed(chunks))
+            self._buffered_rows += sum(len(chunk[0]) for chunk in chunks)
+
+    def _to_csv(self, chunks):
+        # 單筆請求佔多數：一次建立整批的 DataFrame，每個請求的共同欄位以 np.repeat 展開
+        lengths = [len(chunk[0]) for chunk in chunks]
+        frame = pd.DataFrame([record for chunk in chunks for record in chunk[0]], columns=TRANSACTION_FIELDS)
+        proba = np.concatenate([np.asarray(chunk[1], dtype=float) for chunk in chunks])
+        threshold = np.repeat([chunk[2] for chunk in chunks], lengths)
+        frame.insert(0, "threshold", threshold)
+        frame.insert(0, "is_fraud", (proba > threshold).astype(int))
+        frame.insert(0, "fraud_probability", proba)
+        frame.insert(0, "run_id", np.repeat([chunk[3] for chunk in chunks], lengths))
+        frame.insert(0, "endpoint", np.repeat([chunk[4] for chunk in chunks], lengths))
+        frame.insert(0, "scored_at", pd.to_datetime(np.repeat([chunk[5] for chunk in chunks], lengths), unit='s', utc=True))
+        buffer = io.StringIO()
+        frame.to_csv(buffer, index=False, header=False)
+        return buffer.getvalue()
+
+    def _copy(self, csv_file):
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                if not self._table_ready:
+                    cursor.execute(CREATE_AUDIT_TABLE_SQL)
+                cursor.copy_expert(
+                    f"COPY {AUDIT_TABLE} ({', '.join(AUDIT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", csv_file
+                )
+            connection.commit()
+            self._table_ready = True
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _flush(self, chunks):
+        """以一次 COPY 寫入多個請求的資料，回傳是否成功。"""
+        rows = sum(len(chunk[0]) for chunk in chunks)
+        start = time.perf_counter()
+        try:
+            self._copy(io.StringIO(self._to_csv(chunks)))
+        except Exception as e:
+            self.flush_latency.record(time.perf_counter() - start, error=True, rows=rows)
+            self._record_error(e)
+            return False
+        self.flush_latency.record(time.perf_counter() - start, rows=rows)
+        with self._cond:
+            self.counts["flushed_rows"] += rows
+        self._record_recovery()
+        return True
+
+    def _record_error(self, error):
+        with self._cond:
+            self.counts["flush_errors"] += 1
+            self.last_error = str(error)
+        # 只在狀態改變時印出，資料庫斷線期間不會每次重試都刷一次 log
+        if self._healthy:
+            self._healthy = False
+            print(f"⚠️  稽核紀錄寫入失敗，將退避重試: {error}")
+
+    def _record_recovery(self):
+        if not self._healthy:
+            self._healthy = True
+            print("✅ 稽核紀錄寫入已恢復")
+
+    # --- 落地檔 ---
+    def _spill(self, chunks):
+        rows = sum(len(chunk[0]) for chunk in chunks)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with self._cond:
+                self._spill_seq += 1
+                name = f"audit-{time.time_ns()}-{self._spill_seq:06d}.csv"
+            path = os.path.join(self.spill_dir, name)
+            # 先寫暫存檔再改名，補寫時不會讀到寫到一半的檔案
+            with open(path + ".tmp", "w") as f:
+                f.write(self._to_csv(chunks))
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"🔥 稽核紀錄落地失敗，丟棄 {rows} 筆: {e}")
+            with self._cond:
+                self.counts["dropped_rows"] += rows
+            return
+        with self._cond:
+            self.counts["spilled_rows"] += rows
+
+    def _spill_files(self):
+        if not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(f for f in os.listdir(self.spill_dir) if f.startswith("audit-") and f.endswith(".csv"))
+
+    def _claim_spill_file(self, path):
+        """以 os.rename 把落地檔改成本行程專屬的名稱；其他 worker / replica 已先取走時回傳 None。"""
+        claimed = f"{path}.{socket.gethostname()}-{os.getpid()}.claimed"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        return claimed
+
+    def _replay_spill_files(self):
+        for name in self._spill_files():
+            path = os.path.join(self.spill_dir, name)
+            # 多個 worker 共用 spill 目錄：rename 是原子操作，只有一個行程會取得檔案，避免重複寫入
+            claimed = self._claim_spill_file(path)
+            if claimed is None:
+                continue
+            start = time.perf_counter()
+            try:
+                with open(claimed) as f:
+                    rows = sum(1 for _ in f)
+                    f.seek(0)
+                    self._copy(f)
+            except Exception as e:
+                # COPY 失敗不會寫入任何一筆，改回原名讓之後 (或其他 worker) 重試
+                os.replace(claimed, path)
+                self._record_error(e)
+                return
+            self.flush_latency.record(time.perf_counter() - start, rows=rows)
+            os.remove(claimed)
+            with self._cond:
+                self.counts["replayed_rows"] += rows
+            self._record_recovery()
+
+    # --- 關閉與指標 ---
+    def close(self, timeout=AUDIT_SHUTDOWN_SECONDS):
+        """停止接收並在 timeout 秒內寫完緩衝區；寫不完的資料落地到 spill 目錄 (drop 模式則丟棄)。
+
+        逾時當下仍在寫入的批次若之後失敗，由背景執行緒自行落地。
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            chunks = self._take(self._buffered_rows)
+        if chunks:
+            rows = sum(len(chunk[0]) for chunk in chunks)
+            if self.overflow == "spill":
+                print(f"⚠️  關閉時仍有 {rows} 筆稽核紀錄未寫入，落地到 {self.spill_dir}")
+            else:
+                print(f"⚠️  關閉時丟棄 {rows} 筆未寫入的稽核紀錄")
+            self._overflow(chunks)
+        self.engine.dispose()
+
+    def snapshot(self):
+        """回傳緩衝區深度、累計寫入/落地/丟棄筆數與最近視窗內的寫入延遲。"""
+        with self._cond:
+            counts = dict(self.counts)
+            depth_rows, depth_requests = self._buffered_rows, len(self._buffer)
+            last_error = self.last_error
+        flush = self.flush_latency.snapshot()
+        return {
+            "queue_depth_rows": depth_rows,
+            "queue_depth_requests": depth_requests,
+            "max_buffer_rows": self.max_buffer,
+            "overflow_policy": self.overflow,
+            **counts,
+            "spill_files": len(self._spill_files()),
+            "healthy": self._healthy,
+            "last_error": last_error,
+            "flush_batches": flush["requests_total"],
+            "flush_latency_p50_ms": flush["latency_p50_ms"],
+            "flush_latency_p95_ms": flush["latency_p95_ms"],
+            "flush_latency_p99_ms": flush["latency_p99_ms"],
+        }
@@ -0,0 +1,361 @@
+# src/api/load_test.py
+"""
+評分 API 壓力測試 (Load Test)
+
+以 data/creditcard.csv 的交易 (或相同 schema 的合成資料) 重播到 /predict 或 /predict/batch，
+回報吞吐量與完整的延遲分佈：
+
+- closed 模式：--concurrency 個 worker 各自送出請求，收到回應後立刻送下一個 (量測最大容量)
+- open 模式：依 --rate (req/s) 的 Poisson 到達排程送出，最多 --concurrency 個同時進行；
+  延遲從「排定送出時間」起算，服務跟不上時排隊時間會計入延遲 (避免 coordinated omission)
+- --batch-size 設定 /predict/batch 每次請求的筆數 (payload 大小)
+- --in-process：在本程序內以 uvicorn 啟動 api.main，並以本地資料訓練的 LogisticRegression
+  精簡模型取代服務模型，不需要 MLflow 或 Postgres (壓測端與服務共用 GIL，數字會比獨立部署低)
+
+重播時 time 會在每輪加上資料的時間跨度，速度特徵的時間仍然遞增。
+
+用法 (於專案根目錄執行):
+    python src/api/load_test.py --in-process --duration 20 --concurrency 8
+    python src/api/load_test.py --url http://localhost:8000 --endpoint batch --batch-size 500 --mode open --rate 20
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+LOAD_TEST_CSV = os.getenv('LOAD_TEST_CSV', 'data/creditcard.csv')
+LOAD_TEST_SYNTHETIC_ROWS = 50_000
+# 延遲直方圖的分箱上界 (ms)，1-2-5 級距
+HISTOGRAM_BOUNDS_MS = [m * 10 ** e for e in range(-1, 5) for m in (1, 2, 5)]
+REPORT_PERCENTILES = (50, 90, 95, 99, 99.9)
+
+# 與 API 的 Transaction schema 相同的輸入欄位
+TRANSACTION_FIELDS = ['time', 'amount'] + [f'v{i}' for i in range(1, 29)]
+ENDPOINT_PATHS = {"predict": "/predict", "batch": "/predict/batch"}
+
+
+# --- 測試資料 ---
+def load_rows(csv_path=LOAD_TEST_CSV, synthetic_rows=LOAD_TEST_SYNTHETIC_ROWS, seed=42):
+    """讀取交易 CSV (欄位不分大小寫)，不存在或格式不符時產生相同 schema 的合成資料；回傳依 time 排序的 DataFrame。"""
+    df = None
+    if csv_path and os.path.exists(csv_path):
+        try:
+            df = pd.read_csv(csv_path)
+            df.columns = [c.lower() for c in df.columns]
+            missing = set(TRANSACTION_FIELDS) - set(df.columns)
+            if missing:
+                print(f"⚠️  {csv_path} 缺少欄位 {sorted(missing)[:5]}，改用合成資料")
+                df = None
+        except Exception as e:
+            print(f"⚠️  無法讀取 {csv_path}，改用合成資料: {e}")
+            df = None
+
+    if df is None:
+        rng = np.random.default_rng(seed)
+        df = pd.DataFrame(rng.standard_normal((synthetic_rows, 28)), columns=[f'v{i}' for i in range(1, 29)])
+        df.insert(0, 'amount', np.round(rng.lognormal(3, 1.5, synthetic_rows), 2))
+        df.insert(0, 'time', np.floor(np.cumsum(rng.exponential(0.5, synthetic_rows))))
+        # 合成標籤只供本地模型訓練使用：v14 偏低且金額偏高的交易標為詐欺
+        df['class'] = ((df['v14'] < -1.5) & (df['amount'] > 50)).astype(int)
+    return df.sort_values('time', kind='stable').reset_index(drop=True)
+
+
+class RowFeeder:
+    """執行緒安全地循環提供交易 (dict 列表)，每輪的 time 加上資料的時間跨度。"""
+
+    def __init__(self, df):
+        self._records = df[TRANSACTION_FIELDS].to_dict('records')
+        self._span = float(df['time'].max() - df['time'].min()) + 1.0
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        with self._lock:
+            start = self._position
+            self._position += n
+        rows = []
+        for i in range(start, start + n):
+            cycle, index = divmod(i, len(self._records))
+            record = self._records[index]
+            rows.append({**record, 'time': record['time'] + cycle * self._span} if cycle else record)
+        return rows
+
+
+# --- 程序內 API ---
+def train_stand_in_model(df):
+    """以本地資料訓練 LogisticRegression 並經精簡服務格式匯出再載入，與正式服務走相同推論路徑。"""
+    from sklearn.linear_model import LogisticRegression
+    from models.serving_artifact import export_serving_artifact, load_serving_artifact
+
+    label = df['class'] if 'class' in df.columns else (df['v14'] < -1.5).astype(int)
+    model = LogisticRegression(max_iter=1000, class_weight='balanced')
+    model.fit(df[TRANSACTION_FIELDS], label)
+    export_dir = tempfile.mkdtemp(prefix="load_test_model_")
+    export_serving_artifact(model, export_dir, feature_order=TRANSACTION_FIELDS, model_type="LogisticRegression")
+    return load_serving_artifact(export_dir, run_id="load-test-stand-in", mmap=False)
+
+
+def load_offline_serving():
+    """不連 MLflow/Postgres 地 import api.main 並回傳模組，呼叫端再以 use_model 換上本地模型。"""
+    # 在 import api.main 之前設定：空的本地 tracking 目錄讓模型載入直接失敗回退，並關閉需要外部服務的功能
+    os.environ['MLFLOW_TRACKING_URI'] = 'file://' + tempfile.mkdtemp(prefix="load_test_mlruns_")
+    os.environ['AUDIT_LOG'] = '0'
+    os.environ['SHADOW_MODE'] = '0'
+    os.environ['DRIFT_MONITORING'] = '0'
+    from api import main as serving
+    return serving
+
+
+def use_model(serving, compact_model):
+    """將 api.main 的服務模型換成指定的精簡模型 (不使用速度特徵)。"""
+    serving.model = compact_model
+    serving.MODEL_INFO.update(run_id=compact_model.run_id, model_type=compact_model.model_type, serving_path="compact")
+    serving.velocity_state = None
+
+
+def start_in_process_api(df):
+    """在背景執行緒啟動 api.main (不連 MLflow/Postgres)，回傳 (base_url, 停止函式)。"""
+    import uvicorn
+
+    serving = load_offline_serving()
+    use_model(serving, train_stand_in_model(df))
+    print(f"✅ 程序內 API 使用本地訓練的 {serving.model.model_type} 精簡模型")
+
+    # port=0 由系統指定可用埠號 (預先綁定 socket 再傳入的方式不會設定 TCP_NODELAY，keep-alive 請求會多 40ms)
+    server = uvicorn.Server(uvicorn.Config(serving.app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("程序內 API 啟動失敗")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+    return f"http://127.0.0.1:{port}", stop
+
+
+def wait_until_ready(base_url, timeout=120):
+    """等待 API 的 /ready 回傳 200 (暖機完成)；沒有 /ready 的舊版 API 直接開始。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get(base_url.rstrip('/') + "/ready", timeout=5)
+            if response.status_code in (200, 404):
+                return
+            # 503 可能來自 proxy / 負載平衡器，本文不一定是 JSON
+            detail = response.json().get("detail")
+            if isinstance(detail, dict) and detail.get("status") == "failed":
+                raise RuntimeError(f"API 暖機失敗: {detail.get('error')}")
+        except (requests.RequestException, ValueError, AttributeError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API 在 {timeout} 秒內沒有就緒")
+
+
+# --- 壓力測試 ---
+class LoadGenerator:
+    """對單一端點送出請求並記錄每次的延遲、筆數與是否失敗。"""
+
+    def __init__(self, base_url, endpoint, feeder, batch_size=1, timeout=30):
+        self.url = base_url.rstrip('/') + ENDPOINT_PATHS[endpoint]
+        self.endpoint = endpoint
+        self.feeder = feeder
+        self.batch_size = batch_size if endpoint == "batch" else 1
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (延遲秒數, 服務時間秒數, 是否失敗)
+        self.samples = []
+        self.errors = {}
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, scheduled=None, record=True):
+        """送出一次請求；scheduled 為 open 模式的排定送出時間 (延遲自該時間起算)。"""
+        rows = self.feeder.take(self.batch_size)
+        payload = rows[0] if self.endpoint == "predict" else {"transactions": rows}
+        start = time.perf_counter()
+        error = None
+        try:
+            response = self._session().post(self.url, json=payload, timeout=self.timeout)
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+            elif "error" in response.json():
+                error = "prediction error"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        end = time.perf_counter()
+        if not record:
+            return
+        with self._lock:
+            self.samples.append((end - (scheduled if scheduled is not None else start), end - start, error is not None))
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def run_closed(self, concurrency, duration=None, max_requests=None):
+        """closed loop：每個 worker 收到回應後立即送下一個請求。"""
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [max_requests]
+        lock = threading.Lock()
+
+        def worker():
+            while deadline is None or time.perf_counter() < deadline:
+                if max_requests is not None:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.send()
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+
+    def run_open(self, rate, concurrency, duration=None, max_requests=None, seed=0):
+        """open loop：依 Poisson 到達排程送出請求，同時進行的請求最多 concurrency 個 (其餘排隊)。"""
+        rng = np.random.default_rng(seed)
+        start = time.perf_counter()
+        scheduled = start
+        sent = 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+            while (max_requests is None or sent < max_requests) and (duration is None or scheduled - start < duration):
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, scheduled)
+                sent += 1
+                scheduled += rng.exponential(1.0 / rate)
+
+
+def latency_histogram(latencies_ms, bounds_ms=HISTOGRAM_BOUNDS_MS):
+    """回傳各分箱 (上界 ms) 的筆數與累積百分比；最後一箱為超過最大上界的請求。"""
+    counts = np.bincount(np.searchsorted(bounds_ms, latencies_ms, side='left'), minlength=len(bounds_ms) + 1)
+    cumulative = np.cumsum(counts) / max(len(latencies_ms), 1) * 100
+    return [
+        {"le_ms": bound, "count": int(count), "cumulative_pct": float(pct)}
+        for bound, count, pct in zip(list(bounds_ms) + [None], counts, cumulative)
+        if count or bound is not None
+    ]
+
+
+def build_report(generator, wall_seconds, config):
+    samples = np.array(generator.samples, dtype=float).reshape(-1, 3)
+    latencies_ms, service_ms, failed = samples[:, 0] * 1000, samples[:, 1] * 1000, samples[:, 2].astype(bool)
+    requests_total = len(samples)
+    report = {
+        "config": config,
+        "requests": requests_total,
+        "rows": requests_total * generator.batch_size,
+        "errors": int(failed.sum()),
+        "error_types": generator.errors,
+        "wall_seconds": wall_seconds,
+        "throughput_rps": requests_total / wall_seconds,
+        "rows_per_second": requests_total * generator.batch_size / wall_seconds,
+        "latency_ms": {},
+        "service_time_ms": {},
+        "histogram": latency_histogram(latencies_ms),
+    }
+    if requests_total:
+        for key, values in (("latency_ms", latencies_ms), ("service_time_ms", service_ms)):
+            report[key] = {f"p{p:g}": float(np.percentile(values, p)) for p in REPORT_PERCENTILES}
+            report[key].update(mean=float(values.mean()), max=float(values.max()))
+    return report
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"\n📊 {config['endpoint']} ({config['mode']} loop, concurrency={config['concurrency']}, "
+          f"batch_size={config['batch_size']}" + (f", rate={config['rate']}/s" if config['mode'] == 'open' else "") + ")")
+    print(f"   請求: {report['requests']} ({report['errors']} 失敗)  筆數: {report['rows']}  "
+          f"耗時: {report['wall_seconds']:.1f}s")
+    print(f"   吞吐量: {report['throughput_rps']:,.1f} req/s, {report['rows_per_second']:,.0f} rows/s")
+    if report["error_types"]:
+        print(f"   失敗類型: {report['error_types']}")
+    if not report["requests"]:
+        return
+    latency = report["latency_ms"]
+    print("   延遲 (ms): " + "  ".join(f"{key}={value:.2f}" for key, value in latency.items()))
+    if config['mode'] == 'open':
+        service = report["service_time_ms"]
+        print("   服務時間 (ms，不含排隊): " + "  ".join(f"{key}={value:.2f}" for key, value in service.items()))
+    print("   延遲分佈:")
+    peak = max(bucket["count"] for bucket in report["histogram"]) or 1
+    for bucket in report["histogram"]:
+        if not bucket["count"] and bucket["cumulative_pct"] in (0.0, 100.0):
+            continue
+        label = f"<= {bucket['le_ms']:g} ms" if bucket["le_ms"] is not None else f"> {HISTOGRAM_BOUNDS_MS[-1]:g} ms"
+        bar = "█" * int(round(40 * bucket["count"] / peak))
+        print(f"   {label:>12} {bucket['count']:>8} {bucket['cumulative_pct']:>7.2f}% {bar}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="評分 API 壓力測試 (吞吐量與延遲分佈)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default=os.getenv('LOAD_TEST_URL', 'http://localhost:8000'), help="API 位址")
+    target.add_argument("--in-process", action="store_true", help="在本程序啟動 API 並使用本地訓練的替代模型")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINT_PATHS), default="predict")
+    parser.add_argument("--batch-size", type=int, default=100, help="batch 端點每次請求的筆數")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--rate", type=float, default=100.0, help="open 模式的平均到達率 (req/s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時進行的請求上限")
+    parser.add_argument("--duration", type=float, default=30.0, help="測試秒數 (與 --requests 先到者為準)")
+    parser.add_argument("--requests", type=int, help="總請求數")
+    parser.add_argument("--warmup", type=int, default=20, help="不計入結果的暖機請求數")
+    parser.add_argument("--csv", default=LOAD_TEST_CSV, help="重播的交易 CSV；不存在時使用合成資料")
+    parser.add_argument("--output", help="將結果 (含完整直方圖) 寫成 JSON")
+    args = parser.parse_args()
+
+    df = load_rows(args.csv)
+    print(f"載入 {len(df)} 筆交易作為請求資料")
+    stop = None
+    base_url = args.url
+    if args.in_process:
+        base_url, stop = start_in_process_api(df)
+
+    try:
+        wait_until_ready(base_url)
+        generator = LoadGenerator(base_url, args.endpoint, RowFeeder(df), batch_size=args.batch_size)
+        for _ in range(args.warmup):
+            generator.send(record=False)
+
+        start = time.perf_counter()
+        if args.mode == "closed":
+            generator.run_closed(args.concurrency, duration=args.duration, max_requests=args.requests)
+        else:
+            generator.run_open(args.rate, args.concurrency, duration=args.duration, max_requests=args.requests)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        if stop is not None:
+            stop()
+
+    config = {
+        "target": "in-process" if args.in_process else base_url, "endpoint": args.endpoint, "mode": args.mode,
+        "concurrency": args.concurrency, "batch_size": generator.batch_size,
+        "rate": args.rate if args.mode == "open" else None,
+    }
+    report = build_report(generator, wall_seconds, config)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 # src/api/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel, Field
 import joblib
 import pandas as pd
@@ -9,11 +9,62 @@ import mlflow
 import mlflow.sklearn
 import mlflow.pyfunc  # 新增：支援通用模型載入
 import mlflow.tensorflow  # 新增：支援 TensorFlow 模型載入
+import time
+import sys
+import json
+from types import SimpleNamespace
+
+# 導入訓練時共用的精簡服務格式
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from models.serving_artifact import load_serving_artifact, CompactModel
+from api.serving_metrics import ServingMetrics
+from api.shadow import ShadowScorer
+from api.audit_log import AuditLogSink
+from api.model_cache import ModelArtifactCache
+from api.warmup import ServingWarmup
+from models.velocity_features import OnlineVelocityFeatures, parse_velocity_windows
+from models.drift import DriftMonitor, load_reference_profile
+from models.keras_serving import CompiledKerasModel, configure_threads
 
 # --- 設定MLflow和本地路徑 ---
 MLFLOW_TRACKING_URI = os.getenv('MLFLOW_TRACKING_URI', 'http://localhost:5000')
 MODEL_PATH = 'src/models/baseline_model.pkl'  # 本地備份路徑
 SCALER_PATH = 'src/models/scaler.pkl'          # 本地備份路徑
+# 訓練時的特徵順序 (transform_data 記錄在 run 的根目錄)，完整 MLflow 模型依此組成輸入
+FEATURE_ORDER_ARTIFACT = 'feature_order.json'
+
+# 精簡服務格式 (transform_data 匯出到 run 的 serving/ 目錄)，設為 0 則一律載入完整 MLflow 模型
+USE_SERVING_ARTIFACT = os.getenv('USE_SERVING_ARTIFACT', '1') == '1'
+# MLflow 無法連線時不要在啟動階段重試數分鐘：少量重試後改用本地快取的 last known good 模型
+os.environ.setdefault('MLFLOW_HTTP_REQUEST_MAX_RETRIES', '2')
+os.environ.setdefault('MLFLOW_HTTP_REQUEST_TIMEOUT', '10')
+# /predict/batch 單次請求的筆數上限
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '5000'))
+
+# Shadow 模式：以 challenger 在背景評分抽樣的請求，只記錄比較結果，不影響回應
+SHADOW_MODE = os.getenv('SHADOW_MODE', '0') == '1'
+# 指定 challenger run；未指定時使用 F1 排名中第一個不是 champion 的 run
+SHADOW_RUN_ID = os.getenv('SHADOW_RUN_ID')
+# 輸入漂移監控：與服務模型 run 的 drift/ 參考分佈比較 (舊 run 沒有參考分佈時自動停用)
+DRIFT_MONITORING = os.getenv('DRIFT_MONITORING', '1') == '1'
+# 稽核紀錄：每筆評分結果以 write-behind 批次寫入 Postgres 的 prediction_audit
+AUDIT_LOG = os.getenv('AUDIT_LOG', '1') == '1'
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'fraud_db')
+DB_USER = os.getenv('DB_USER', 'user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_PORT = '5432'
+DATABASE_URL = os.getenv('DATABASE_URL', f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+
+# /predict 的即時事件落後線上狀態目前時間超過此秒數時不更新狀態 (回應標記 velocity_stale)
+VELOCITY_MAX_LATENESS_SECONDS = float(os.getenv('VELOCITY_MAX_LATENESS_SECONDS', '300'))
+
+# Keras 模型以固定簽章的 tf.function 推論 (避免 model.predict 每次呼叫的資料管線開銷)，設為 0 則使用 model.predict
+KERAS_COMPILED_SERVING = os.getenv('KERAS_COMPILED_SERVING', '1') == '1'
+
+# 目前服務中的模型資訊 (/metrics 回報，Dashboard 用來標示模型切換)
+MODEL_INFO = {"run_id": None, "model_type": None, "serving_path": None}
+SHADOW_INFO = {"run_id": None, "model_type": None, "serving_path": None}
 
 # --- 1. 定義資料結構 (Schema) ---
 # 這個結構必須對應模型訓練時的輸入特徵 (除了 Time/Amount，它們被替換了)
@@ -54,9 +105,121 @@ class Transaction(BaseModel):
 
 # 為了讓範例運作，我們假設 Transaction 已經包含所有 V 特徵。
 
+class TransactionBatch(BaseModel):
+    transactions: list[Transaction]
+
 # --- 2. 載入模型與 Scaler ---
+# 下載過的模型 artifact 依內容 hash 存在本地 (MODEL_CACHE_DIR)，重啟時驗證後直接使用
+model_cache = ModelArtifactCache()
+
+def load_compact_model(run_id):
+    """從本地快取 (沒有時下載) 以 memory-map 載入 run 的精簡服務格式；不存在或載入失敗時回傳 None。"""
+    try:
+        local_path = model_cache.fetch(run_id, "serving")
+        start = time.perf_counter()
+        compact_model = load_serving_artifact(local_path, run_id=run_id)
+        print(f"精簡服務格式載入耗時 {(time.perf_counter() - start) * 1000:.1f} ms")
+        return compact_model
+    except Exception as e:
+        print(f"Run {run_id} 沒有可用的精簡服務格式，改用 MLflow 模型: {e}")
+        return None
+
+
+def load_feature_order(run_id):
+    """從本地快取 (沒有時下載) 讀取 run 訓練時的特徵順序；舊 run 沒有記錄時回傳 None (使用舊的輸入格式)。"""
+    try:
+        local_dir = model_cache.fetch(run_id, FEATURE_ORDER_ARTIFACT)
+        with open(os.path.join(local_dir, FEATURE_ORDER_ARTIFACT)) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Run {run_id} 沒有記錄特徵順序，使用舊的輸入格式 (V1-V28 + 標準化 Amount/Time): {e}")
+        return None
+
+
+def load_run_model(run, info, label="最佳模型"):
+    """載入指定 run 的模型 (優先使用精簡服務格式)，並將 run_id、模型類型與載入方式寫入 info；失敗時拋出例外。"""
+    # 獲取模型信息
+    f1_score = run.data.metrics.get('f1_score', 'N/A')
+    model_name = run.data.tags.get('model_type', 'Unknown')
+    
+    # ✅ 優先使用精簡服務格式：不需反序列化完整模型，特徵順序與門檻皆由訓練端決定
+    if USE_SERVING_ARTIFACT and run.data.tags.get('serving_artifact_version'):
+        compact_model = load_compact_model(run.info.run_id)
+        if compact_model is not None:
+            info.update(run_id=run.info.run_id, model_type=model_name, serving_path="compact")
+            print(f"成功從 MLflow 載入{label} (精簡服務格式)！")
+            print(f"  模型類型: {model_name}")
+            print(f"  F1 Score: {f1_score}")
+            print(f"  Run ID: {run.info.run_id}")
+            return compact_model
+    
+    # 完整 MLflow 模型同樣經過本地快取，各 flavor 直接從快取目錄載入
+    model_uri = model_cache.fetch(run.info.run_id, "model")
+    feature_order = load_feature_order(run.info.run_id)
+
+    # ✅ 智能模型載入：根據模型類型選擇正確的載入方法
+    try:
+        if model_name in ['LogisticRegression']:
+            model = mlflow.sklearn.load_model(model_uri)
+        elif model_name in ['TensorFlow', 'TensorFlow_DNN']:
+            # Keras 3.0+ 使用 mlflow.keras 或 pyfunc
+            # 執行緒數必須在 TensorFlow runtime 初始化 (載入模型) 之前設定
+            configure_threads()
+            try:
+                # 以 from-import 載入，避免 mlflow 在函式內被視為區域變數
+                from mlflow import keras as mlflow_keras
+                model = mlflow_keras.load_model(model_uri)
+            except:
+                model = mlflow.pyfunc.load_model(model_uri)
+        else:  # XGBoost, LightGBM 等使用通用載入
+            model = mlflow.pyfunc.load_model(model_uri)
+        
+        serving_path = "mlflow"
+        if KERAS_COMPILED_SERVING and hasattr(model, 'layers'):
+            model = CompiledKerasModel(model)
+            serving_path = "keras_compiled"
+        if feature_order is not None:
+            # 與 CompactModel 相同以 feature_order 屬性提供特徵順序，predict_proba_with 與速度特徵都依此判斷
+            model.feature_order = feature_order
+        info.update(run_id=run.info.run_id, model_type=model_name, serving_path=serving_path)
+        print(f"成功從 MLflow 載入{label}！")
+        print(f"  模型類型: {model_name}")
+        print(f"  F1 Score: {f1_score}")
+        print(f"  Run ID: {run.info.run_id}")
+        return model
+        
+    except Exception as load_error:
+        print(f"使用 {model_name} 載入方法失敗: {load_error}")
+        # 嘗試備用載入方法
+        try:
+            model = mlflow.pyfunc.load_model(model_uri)
+            if feature_order is not None:
+                model.feature_order = feature_order
+            info.update(run_id=run.info.run_id, model_type=model_name, serving_path="pyfunc")
+            print(f"使用通用方法成功載入模型: {model_name}")
+            return model
+        except Exception as fallback_error:
+            print(f"通用載入方法也失敗: {fallback_error}")
+            raise fallback_error
+
+
+def load_known_good_model():
+    """MLflow 無法連線時，從本地快取載入上次成功服務的模型；沒有紀錄或快取不完整時回傳 None。"""
+    known_good = model_cache.known_good()
+    if not known_good:
+        return None
+    run = SimpleNamespace(
+        info=SimpleNamespace(run_id=known_good["run_id"]),
+        data=SimpleNamespace(tags=known_good["tags"], metrics=known_good["metrics"])
+    )
+    try:
+        return load_run_model(run, MODEL_INFO, label=" last known good 模型 (本地快取)")
+    except Exception as e:
+        print(f"本地快取中的 last known good 模型無法載入: {e}")
+        return None
+
 def load_model_from_mlflow():
-    """嘗試從MLflow載入最新模型，失敗則使用本地檔案"""
+    """嘗試從MLflow載入最新模型，MLflow 無法連線時使用本地快取的 last known good 模型，最後才使用本地檔案"""
     try:
         print(f"設定 MLflow Tracking URI: {MLFLOW_TRACKING_URI}")
         mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
@@ -66,95 +229,351 @@ def load_model_from_mlflow():
         experiment = client.get_experiment_by_name("Fraud Detection Baseline")
         
         if experiment:
-            # 獲取所有runs並按F1分數排序，選擇最佳模型
+            # 優先使用訓練流程依延遲 SLO 選出的服務模型 (最新一次訓練的 selected_for_serving)
             runs = client.search_runs(
                 experiment_ids=[experiment.experiment_id],
-                order_by=["metrics.f1_score DESC"],
-                max_results=10
+                filter_string="tags.selected_for_serving = 'true'",
+                order_by=["attributes.start_time DESC"],
+                max_results=1
             )
+            if not runs:
+                # 舊的訓練紀錄沒有選擇標記：獲取所有runs並按F1分數排序，選擇最佳模型
+                runs = client.search_runs(
+                    experiment_ids=[experiment.experiment_id],
+                    order_by=["metrics.f1_score DESC"],
+                    max_results=1
+                )
             
             if runs:
-                best_run = runs[0]  # F1分數最高的模型
-                model_uri = f"runs:/{best_run.info.run_id}/model"
-                
-                # 獲取模型信息
-                f1_score = best_run.data.metrics.get('f1_score', 'N/A')
-                model_name = best_run.data.tags.get('model_type', 'Unknown')
-                
-                # ✅ 智能模型載入：根據模型類型選擇正確的載入方法
-                try:
-                    if model_name in ['LogisticRegression']:
-                        model = mlflow.sklearn.load_model(model_uri)
-                    elif model_name in ['TensorFlow', 'TensorFlow_DNN']:
-                        # Keras 3.0+ 使用 mlflow.keras 或 pyfunc
-                        try:
-                            import mlflow.keras
-                            model = mlflow.keras.load_model(model_uri)
-                        except:
-                            model = mlflow.pyfunc.load_model(model_uri)
-                    else:  # XGBoost, LightGBM 等使用通用載入
-                        model = mlflow.pyfunc.load_model(model_uri)
-                    
-                    print(f"成功從 MLflow 載入最佳模型！")
-                    print(f"  模型類型: {model_name}")
-                    print(f"  F1 Score: {f1_score}")
-                    print(f"  Run ID: {best_run.info.run_id}")
-                    return model
-                    
-                except Exception as load_error:
-                    print(f"使用 {model_name} 載入方法失敗: {load_error}")
-                    # 嘗試備用載入方法
-                    try:
-                        model = mlflow.pyfunc.load_model(model_uri)
-                        print(f"使用通用方法成功載入模型: {model_name}")
-                        return model
-                    except Exception as fallback_error:
-                        print(f"通用載入方法也失敗: {fallback_error}")
-                        raise fallback_error
+                # 服務模型 (或F1分數最高的模型)
+                model = load_run_model(runs[0], MODEL_INFO)
+                model_cache.mark_known_good(runs[0].info.run_id, runs[0].data.tags, runs[0].data.metrics)
+                return model
         
         print("MLflow 中沒有找到模型，嘗試載入本地檔案...")
         
     except Exception as e:
         print(f"從 MLflow 載入模型失敗: {e}")
+        model = load_known_good_model()
+        if model is not None:
+            return model
         print("嘗試載入本地檔案...")
     
     # 回退到本地檔案
     try:
         model = joblib.load(MODEL_PATH)
+        MODEL_INFO.update(run_id=None, model_type=type(model).__name__, serving_path="local")
         print("成功載入本地模型檔案！")
         return model
     except Exception as e:
         print(f"載入本地模型失敗: {e}")
         return None
 
+def load_challenger_model(champion_run_id):
+    """載入 shadow 模式的 challenger 模型；找不到或載入失敗時回傳 None (只停用 shadow，不影響服務)。"""
+    try:
+        client = mlflow.tracking.MlflowClient()
+        if SHADOW_RUN_ID:
+            run = client.get_run(SHADOW_RUN_ID)
+        else:
+            experiment = client.get_experiment_by_name("Fraud Detection Baseline")
+            runs = client.search_runs(
+                experiment_ids=[experiment.experiment_id],
+                filter_string="attributes.status = 'FINISHED'",
+                order_by=["metrics.f1_score DESC"],
+                max_results=10
+            )
+            run = next((r for r in runs if r.info.run_id != champion_run_id and 'f1_score' in r.data.metrics), None)
+        if run is None:
+            print("找不到 challenger 模型，停用 shadow 模式")
+            return None
+        return load_run_model(run, SHADOW_INFO, label="challenger 模型")
+    except Exception as e:
+        print(f"載入 challenger 模型失敗，停用 shadow 模式: {e}")
+        return None
+
+def load_drift_monitor(run_id):
+    """從本地快取 (沒有時下載) 載入服務模型 run 的漂移參考分佈並建立監控器；不存在或載入失敗時回傳 None (只停用漂移監控)。"""
+    try:
+        local_path = model_cache.fetch(run_id, "drift")
+        drift_monitor = DriftMonitor(load_reference_profile(local_path), run_id=run_id)
+        print(f"啟用輸入漂移監控 ({len(drift_monitor.features)} 個特徵，每 {drift_monitor.window_seconds:.0f} 秒結算)")
+        return drift_monitor
+    except Exception as e:
+        print(f"Run {run_id} 沒有可用的漂移參考分佈，停用漂移監控: {e}")
+        return None
+
 # 載入模型和scaler
 model = load_model_from_mlflow()
+challenger_model = load_challenger_model(MODEL_INFO["run_id"]) if SHADOW_MODE and model is not None else None
+drift_monitor = load_drift_monitor(MODEL_INFO["run_id"]) if DRIFT_MONITORING and MODEL_INFO["run_id"] else None
+
+# 模型以速度特徵訓練時，維護線上時間窗狀態 (啟動時為空，前 N 秒的特徵會偏低)；
+# 涵蓋 champion 與 challenger 需要的所有視窗，兩者使用同一份特徵。
+# 只有 /predict 的即時單筆事件會推進這份共用狀態；批次與離線評分各自使用獨立狀態 (new_velocity_state)
+velocity_windows = tuple(sorted({
+    w for m in (model, challenger_model) for w in parse_velocity_windows(getattr(m, 'feature_order', None) or [])
+}))
+velocity_state = (OnlineVelocityFeatures(velocity_windows, max_lateness=VELOCITY_MAX_LATENESS_SECONDS)
+                  if velocity_windows else None)
+# 暖機用的獨立狀態：合成交易不能混進線上的速度特徵
+warmup_velocity_state = OnlineVelocityFeatures(velocity_windows) if velocity_windows else None
+if velocity_state is not None:
+    print(f"啟用線上速度特徵 (視窗 {', '.join(f'{w}s' for w in velocity_windows)})")
 
-try:
-    scaler = joblib.load(SCALER_PATH)
-    print("Scaler 載入成功！")
-except Exception as e:
-    print(f"載入 Scaler 失敗: {e}")
-    scaler = None
+def load_scaler():
+    """載入舊模型路徑的 scaler 並存一份到本地快取；本地檔案不存在時改用快取中驗證過的版本。"""
+    try:
+        scaler = joblib.load(SCALER_PATH)
+        print("Scaler 載入成功！")
+    except Exception as e:
+        cached_dir = model_cache.get("local", "scaler")
+        if cached_dir is None:
+            print(f"載入 Scaler 失敗: {e}")
+            return None
+        print(f"本地 Scaler 無法載入 ({e})，改用快取中的 Scaler")
+        return joblib.load(os.path.join(cached_dir, os.path.basename(SCALER_PATH)))
+    try:
+        model_cache.put_file("local", "scaler", SCALER_PATH)
+    except OSError as e:
+        print(f"⚠️  Scaler 無法寫入本地快取: {e}")
+    return scaler
+
+scaler = load_scaler()
 
 # --- 3. 初始化 FastAPI App ---
 app = FastAPI(title="Fraud Detection API")
+serving_metrics = ServingMetrics()
+shadow_scorer = None
+if challenger_model is not None:
+    shadow_scorer = ShadowScorer(lambda records: predict_proba_with(challenger_model, records), SHADOW_INFO)
+    print(f"啟用 shadow 模式：challenger {SHADOW_INFO['run_id']}，抽樣率 {shadow_scorer.sample_rate}")
+# 連線在背景執行緒第一次寫入時才建立，資料庫未就緒不影響 API 啟動 (期間資料留在緩衝區)
+audit_sink = AuditLogSink(DATABASE_URL) if AUDIT_LOG else None
+
+def warmup_score(records):
+    """暖機推論：與 /predict 相同的推論路徑，但不更新線上狀態、服務指標、稽核紀錄與漂移監控。"""
+    if not model_ready(model):
+        raise RuntimeError("Model not loaded")
+    if velocity_state is not None:
+        records = enrich_records(records, warmup_velocity_state)
+    return predict_proba_with(model, records)
+
+serving_warmup = ServingWarmup(warmup_score)
+
+@app.on_event("startup")
+def start_warmup():
+    """服務開始接受連線後在背景暖機，完成前 /ready 回傳 503。"""
+    serving_warmup.start()
+
+@app.on_event("shutdown")
+def flush_audit_log():
+    """關閉前寫完稽核紀錄緩衝區 (逾時則落地到 spill 目錄)。"""
+    if audit_sink is not None:
+        audit_sink.close()
 
 @app.get("/")
 def home():
     return {"message": "Fraud Detection API is running. Go to /docs for Swagger UI."}
 
+@app.get("/ready")
+def readiness():
+    """Readiness probe：模型載入且暖機完成才回傳 200，否則回傳 503 與目前的暖機狀態。"""
+    if not serving_warmup.ready:
+        raise HTTPException(status_code=503, detail=serving_warmup.snapshot())
+    return {"status": "ready", "model": MODEL_INFO, "warmup": serving_warmup.snapshot()}
+
+@app.get("/metrics")
+def get_serving_metrics():
+    """回傳最近時間視窗內的吞吐量、延遲百分位數、錯誤率與目前服務中的模型。"""
+    velocity = None
+    if velocity_state is not None:
+        velocity = {"events_total": velocity_state.events_total, "late_events": velocity_state.late_events,
+                    "stale_events": velocity_state.stale_events}
+    shadow = shadow_scorer.snapshot() if shadow_scorer is not None else None
+    drift = None
+    if drift_monitor is not None:
+        last_window = drift_monitor.snapshot()["last_window"]
+        if last_window is not None:
+            drift = {key: last_window[key] for key in ("ended_at", "rows", "max_psi", "max_ks", "drifted_features")}
+    audit = audit_sink.snapshot() if audit_sink is not None else None
+    return {**serving_metrics.snapshot(), "model": MODEL_INFO, "velocity_features": velocity, "shadow": shadow,
+            "drift": drift, "audit_log": audit, "model_cache": model_cache.snapshot(),
+            "warmup": serving_warmup.snapshot()}
+
+@app.get("/shadow")
+def get_shadow_stats():
+    """回傳 champion/challenger 的決策一致率、機率差異與各自延遲 (未啟用 shadow 模式時回傳 404)。"""
+    if shadow_scorer is None:
+        raise HTTPException(status_code=404, detail="Shadow 模式未啟用 (SHADOW_MODE=1 並需有 challenger 模型)")
+    return {"champion": MODEL_INFO, **shadow_scorer.snapshot()}
+
+@app.get("/drift")
+def get_drift_stats():
+    """回傳各特徵相對訓練參考分佈的 PSI/KS 漂移分數 (最近一個完整視窗與啟動以來累計)。"""
+    if drift_monitor is None:
+        raise HTTPException(status_code=404, detail="漂移監控未啟用 (服務模型沒有 drift 參考分佈或 DRIFT_MONITORING=0)")
+    return drift_monitor.snapshot()
+
+def schedule_shadow(background_tasks, records, proba, threshold, latency_seconds):
+    """抽中時於回應送出後把同一份輸入交給 challenger 評分。"""
+    if shadow_scorer is not None and proba is not None and shadow_scorer.should_sample():
+        background_tasks.add_task(shadow_scorer.submit, records, proba, threshold, latency_seconds)
+
+def log_audit(records, proba, threshold, endpoint):
+    """把評分結果放入稽核紀錄緩衝區 (只入列，不等待寫入)。"""
+    if audit_sink is not None and proba is not None:
+        audit_sink.log(records, proba, threshold, MODEL_INFO["run_id"], endpoint)
+
+def schedule_drift_update(background_tasks, records):
+    """於回應送出後把輸入累計到漂移直方圖，不計入請求延遲。"""
+    if drift_monitor is not None:
+        background_tasks.add_task(drift_monitor.update, records)
+
 @app.post("/predict")
-def predict_fraud(transaction: Transaction):
+def predict_fraud(transaction: Transaction, background_tasks: BackgroundTasks):
     """
     接收單筆交易資料，回傳是否為詐欺的預測 (0/1) 與機率。
     """
-    if model is None or scaler is None:
-        return {"error": "Model not loaded. Please check logs and run ETL script."}
-        
-    # 1. 將 Pydantic 資料結構轉換為 DataFrame (方便使用 Scaler)
-    data = transaction.model_dump()
-    df = pd.DataFrame([data])
+    start = time.perf_counter()
+    records = [transaction.model_dump()]
+    result, proba, threshold, records = predict_transaction(records)
+    # 預測失敗時仍回傳 200 與 error 欄位，以回傳內容判斷是否失敗
+    latency = time.perf_counter() - start
+    serving_metrics.record(latency, error="error" in result)
+    serving_warmup.record_request(latency)
+    log_audit(records, proba, threshold, "predict")
+    schedule_shadow(background_tasks, records, proba, threshold, latency)
+    schedule_drift_update(background_tasks, records)
+    return result
+
+def predict_transaction(records):
+    """單筆交易預測的實作 (由 predict_fraud 量測延遲)，回傳 (回應, 機率, 門檻, 加上速度特徵的輸入)。"""
+    if not model_ready(model):
+        return {"error": "Model not loaded. Please check logs and run ETL script."}, None, None, records
+
+    try:
+        stale = velocity_state is not None and velocity_state.is_stale(records[0]['time'])
+        records = enrich_records(records, velocity_state)
+        proba, threshold = predict_proba_with(model, records)
+        response = {
+            "is_fraud": int(proba[0] > threshold),
+            "fraud_probability": float(proba[0]),
+            "message": "Transaction analyzed successfully."
+        }
+        if stale:
+            # 事件遠早於線上狀態的目前時間 (歷史資料或時鐘錯誤)：未更新狀態，速度特徵沿用目前時間的值
+            response["velocity_stale"] = True
+        return response, proba, threshold, records
+    except Exception as pred_error:
+        print(f"預測過程中發生錯誤: {pred_error}")
+        return {
+            "error": f"Prediction failed: {str(pred_error)}",
+            "message": "Please check model compatibility and try again."
+        }, None, None, records
+
+@app.post("/predict/batch")
+def predict_fraud_batch(batch: TransactionBatch, background_tasks: BackgroundTasks):
+    """
+    接收多筆交易 (最多 MAX_BATCH_SIZE 筆)，以單次向量化推論回傳每筆的預測與機率 (依輸入順序的欄位陣列)。
+    """
+    if len(batch.transactions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"每批最多 {MAX_BATCH_SIZE} 筆，收到 {len(batch.transactions)} 筆")
+
+    start = time.perf_counter()
+    records, proba, threshold = [t.model_dump() for t in batch.transactions], None, None
+    if not model_ready(model):
+        result = {"error": "Model not loaded. Please check logs and run ETL script."}
+    else:
+        try:
+            # 批次可能是歷史資料 (Dashboard 上傳、壓力測試重播)，以獨立狀態計算，不推進 /predict 的線上狀態
+            records = enrich_records(records, new_velocity_state())
+            proba, threshold = predict_proba_with(model, records)
+            result = {
+                "is_fraud": (proba > threshold).astype(int).tolist(),
+                "fraud_probability": proba.astype(float).tolist(),
+                "model_run_id": MODEL_INFO["run_id"],
+                "message": f"{len(proba)} transactions analyzed successfully."
+            }
+        except Exception as pred_error:
+            print(f"批次預測過程中發生錯誤: {pred_error}")
+            result = {
+                "error": f"Prediction failed: {str(pred_error)}",
+                "message": "Please check model compatibility and try again."
+            }
+    latency = time.perf_counter() - start
+    serving_metrics.record(latency, error="error" in result, rows=len(batch.transactions))
+    serving_warmup.record_request(latency)
+    log_audit(records, proba, threshold, "predict_batch")
+    schedule_shadow(background_tasks, records, proba, threshold, latency)
+    schedule_drift_update(background_tasks, records)
+    return result
+
+def new_velocity_state():
+    """建立與線上狀態相同視窗的獨立速度特徵狀態 (模型未使用速度特徵時回傳 None)。"""
+    return OnlineVelocityFeatures(velocity_windows) if velocity_state is not None else None
+
+def enrich_records(records, state):
+    """依請求中的順序更新 state 並補上與訓練相同定義的速度特徵 (state 為 None 時原樣回傳)。"""
+    if state is None:
+        return records
+    return state.enrich(records)
+
+def model_ready(model):
+    """模型是否可以推論：舊輸入格式 (沒有 feature_order) 的模型還需要 scaler。"""
+    return model is not None and (getattr(model, 'feature_order', None) is not None or scaler is not None)
+
+def predict_proba_records(records, state=None):
+    """對多筆交易 (dict 列表) 以服務模型向量化推論，回傳 (詐欺機率陣列, 決策門檻)；失敗時拋出例外。
+
+    速度特徵以 state 計算 (例如串流評分器跨微批次保留的狀態)；未指定時只以這批交易計算，不影響 /predict 的線上狀態。
+    """
+    return predict_proba_with(model, enrich_records(records, state or new_velocity_state()))
+
+def predict_proba_with(model, records):
+    """以指定模型 (champion 或 challenger) 推論已補上速度特徵的交易，不更新線上狀態。"""
+    if isinstance(model, CompactModel):
+        # 精簡服務格式：依訓練時的特徵順序組成輸入向量，scaler 與門檻都來自 manifest
+        return model.predict_proba(model.vectorize(records)), model.threshold
+
+    feature_order = getattr(model, 'feature_order', None)
+    if feature_order is not None:
+        # 訓練時記錄了特徵順序 (feature_order.json)：依序取原始欄位與速度特徵，訓練端不使用 scaler
+        df = pd.DataFrame(records)[feature_order]
+    else:
+        df = legacy_model_input(records)
+
+    # 4. 進行預測
+    # ✅ 智能預測：根據模型類型使用不同方法
+    if isinstance(model, CompiledKerasModel):
+        # Keras 編譯推論路徑：float32 輸入，直接回傳詐欺機率
+        proba = model.predict_proba(df.values)
+    elif hasattr(model, 'predict_proba'):
+        # sklearn/XGBoost/LightGBM 直接載入的模型
+        proba = model.predict_proba(df.values)[:, 1]
+    elif hasattr(model, 'predict') and hasattr(model, 'layers'):
+        # TensorFlow/Keras 模型 (檢查是否有 layers 屬性)
+        proba = model.predict(df.values).flatten()
+    else:
+        # MLflow pyfunc 載入的模型
+        prediction_df = model.predict(df)
+        if isinstance(prediction_df, pd.DataFrame) and len(prediction_df.columns) > 1:
+            # 多列輸出，取第二列 (詐欺機率)
+            proba = prediction_df.iloc[:, 1].values
+        else:
+            # 單列輸出，可能是機率或類別
+            pred_values = prediction_df.values if isinstance(prediction_df, pd.DataFrame) else prediction_df
+            if pred_values.max() <= 1.0 and pred_values.min() >= 0.0:
+                proba = pred_values  # 看起來是機率
+            else:
+                proba = np.full(len(df), 0.5)  # 回退預設值
+
+    return np.asarray(proba, dtype=float).ravel(), 0.5
+
+def legacy_model_input(records):
+    """舊模型 (本地 baseline_model.pkl 與沒有記錄特徵順序的 run) 的輸入：V1-V28 加上以 scaler 標準化的 Amount/Time。"""
+    # 1. 將 Pydantic 資料結構轉換為 DataFrame (方便使用 Scaler)；舊模型只使用原始欄位，略過速度特徵
+    df = pd.DataFrame(records)[list(Transaction.model_fields)]
     
     # 2. 應用與訓練時相同的特徵工程：標準化 Time 和 Amount
     # 提取 Time 和 Amount，然後進行標準化
@@ -191,42 +610,5 @@ def predict_fraud(transaction: Transaction):
     # **重要**：確保 df 的欄位順序與訓練模型時的 X_train **完全一致**！
     # 如果不一致，預測結果會錯誤。
     # 建議儲存特徵列表並載入：feature_list = joblib.load('feature_list.pkl')
-    
-    # 4. 進行預測
-    try:
-        # ✅ 智能預測：根據模型類型使用不同方法
-        if hasattr(model, 'predict_proba'):
-            # sklearn/XGBoost/LightGBM 直接載入的模型
-            proba = model.predict_proba(df.values)[:, 1]
-        elif hasattr(model, 'predict') and hasattr(model, 'layers'):
-            # TensorFlow/Keras 模型 (檢查是否有 layers 屬性)
-            proba = model.predict(df.values).flatten()
-        else:
-            # MLflow pyfunc 載入的模型
-            prediction_df = model.predict(df)
-            if isinstance(prediction_df, pd.DataFrame) and len(prediction_df.columns) > 1:
-                # 多列輸出，取第二列 (詐欺機率)
-                proba = prediction_df.iloc[:, 1].values
-            else:
-                # 單列輸出，可能是機率或類別
-                pred_values = prediction_df.values if isinstance(prediction_df, pd.DataFrame) else prediction_df
-                if pred_values.max() <= 1.0 and pred_values.min() >= 0.0:
-                    proba = pred_values  # 看起來是機率
-                else:
-                    proba = [0.5]  # 回退預設值
-        
-        # 預測類別
-        prediction = (proba > 0.5).astype(int) if isinstance(proba, (list, tuple)) == False else [int(p > 0.5) for p in proba]
-        
-        return {
-            "is_fraud": int(prediction[0]),
-            "fraud_probability": float(proba[0]),
-            "message": "Transaction analyzed successfully."
-        }
-        
-    except Exception as pred_error:
-        print(f"預測過程中發生錯誤: {pred_error}")
-        return {
-            "error": f"Prediction failed: {str(pred_error)}",
-            "message": "Please check model compatibility and try again."
-        }
\ No newline at end of file
+    return df
+
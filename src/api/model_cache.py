@@ -0,0 +1,201 @@
+# src/api/model_cache.py
+"""
+模型 artifact 本地快取 (content-addressed)
+
+API 啟動時不必每次都從 MLflow 下載模型：
+
+- 每個 (run_id, artifact 路徑) 下載一次後，依內容的 SHA-256 存到 MODEL_CACHE_DIR/artifacts/<tree hash>/，
+  index.json 記錄 run_id/路徑 → tree hash 與各檔案的 hash；內容相同的 artifact 只存一份
+- 命中時先重新計算檔案 hash 驗證完整性，不符 (檔案損毀或被改動) 就刪除並重新下載
+- MLflow run 的 artifact 不會再變動，命中時完全不連 MLflow
+- 成功載入的服務模型記為 last known good (run_id、tags、metrics)，MLflow 無法連線時以快取中的該模型服務
+- 總大小超過 MODEL_CACHE_MAX_MB 時依最後使用時間 (LRU) 淘汰，last known good 與剛取得的 artifact 不淘汰
+
+多個 API 行程共用同一個目錄時，index 以「寫暫存檔再改名」更新，最差情況只是重新下載。
+預設的 /tmp/model_cache 在容器重建時會消失 (last known good 也跟著消失)；docker-compose 的 fraud_api
+把 MODEL_CACHE_DIR 指到具名 volume model_cache，部署時請保留這個掛載。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', '/tmp/model_cache')
+MODEL_CACHE_MAX_MB = float(os.getenv('MODEL_CACHE_MAX_MB', '2048'))
+INDEX_FILE = 'index.json'
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_tree(root):
+    """回傳 ({相對路徑: sha256}, tree hash, 總位元組數)；tree hash 由排序後的 (路徑, hash) 計算。"""
+    files, size = {}, 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            files[os.path.relpath(path, root)] = _file_sha256(path)
+            size += os.path.getsize(path)
+    tree = hashlib.sha256("".join(f"{p}\0{h}\n" for p, h in sorted(files.items())).encode()).hexdigest()
+    return files, tree, size
+
+
+class ModelArtifactCache:
+    """以內容 hash 定址的 MLflow artifact 快取 (執行緒安全)。"""
+
+    def __init__(self, root=MODEL_CACHE_DIR, max_mb=MODEL_CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._artifacts_dir = os.path.join(root, 'artifacts')
+        self._lock = threading.Lock()
+        os.makedirs(self._artifacts_dir, exist_ok=True)
+        self.stats = {"hits": 0, "misses": 0, "corrupted": 0, "evicted": 0}
+
+    # --- index ---
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.root, INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"entries": {}, "trees": {}, "known_good": None}
+
+    def _write_index(self, index):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.index-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+
+    def _tree_path(self, tree):
+        return os.path.join(self._artifacts_dir, tree)
+
+    def _verify(self, tree, meta):
+        path = self._tree_path(tree)
+        if not os.path.isdir(path):
+            return False
+        files, actual_tree, _ = _hash_tree(path)
+        return actual_tree == tree and files == meta["files"]
+
+    def _drop_tree(self, index, tree):
+        shutil.rmtree(self._tree_path(tree), ignore_errors=True)
+        index["trees"].pop(tree, None)
+        for key in [k for k, v in index["entries"].items() if v == tree]:
+            del index["entries"][key]
+
+    # --- 查詢與下載 ---
+    def get(self, run_id, artifact_path):
+        """回傳已快取且通過驗證的 artifact 目錄；不存在或驗證失敗時回傳 None (不連 MLflow)。"""
+        key = f"{run_id}/{artifact_path}"
+        with self._lock:
+            index = self._read_index()
+            tree = index["entries"].get(key)
+            if tree is None or tree not in index["trees"]:
+                return None
+            if not self._verify(tree, index["trees"][tree]):
+                print(f"⚠️  快取的 {key} 驗證失敗 (檔案損毀或被修改)，刪除後重新下載")
+                self.stats["corrupted"] += 1
+                self._drop_tree(index, tree)
+                self._write_index(index)
+                return None
+            index["trees"][tree]["last_used"] = time.time()
+            self._write_index(index)
+            self.stats["hits"] += 1
+            return self._tree_path(tree)
+
+    def fetch(self, run_id, artifact_path):
+        """回傳 artifact 的本地目錄：優先使用快取，沒有時從 MLflow 下載並放入快取。"""
+        path = self.get(run_id, artifact_path)
+        if path is not None:
+            return path
+
+        import mlflow
+        staging = tempfile.mkdtemp(dir=self.root, prefix='.download-')
+        try:
+            local_path = mlflow.artifacts.download_artifacts(run_id=run_id, artifact_path=artifact_path,
+                                                             dst_path=staging)
+            self.stats["misses"] += 1
+            return self._store(run_id, artifact_path, local_path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def put_file(self, run_id, artifact_path, file_path):
+        """將本地檔案 (例如 scaler) 以 run_id/artifact_path 存入快取，回傳快取中的目錄。"""
+        staging = tempfile.mkdtemp(dir=self.root, prefix='.put-')
+        try:
+            shutil.copy2(file_path, staging)
+            return self._store(run_id, artifact_path, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _store(self, run_id, artifact_path, local_path):
+        if os.path.isfile(local_path):
+            # 單一檔案的 artifact：放進目錄後以相同方式定址
+            wrapper = tempfile.mkdtemp(dir=self.root, prefix='.file-')
+            shutil.move(local_path, wrapper)
+            local_path = wrapper
+        files, tree, size = _hash_tree(local_path)
+        key = f"{run_id}/{artifact_path}"
+        with self._lock:
+            index = self._read_index()
+            target = self._tree_path(tree)
+            if os.path.isdir(target) and tree in index["trees"] and self._verify(tree, index["trees"][tree]):
+                shutil.rmtree(local_path, ignore_errors=True)  # 內容相同的 artifact 已存在
+            else:
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.move(local_path, target)
+            index["trees"][tree] = {"files": files, "size": size, "last_used": time.time()}
+            index["entries"][key] = tree
+            self._evict(index, keep={tree})
+            self._write_index(index)
+        return target
+
+    def _evict(self, index, keep):
+        """總大小超過上限時依 last_used 由舊到新淘汰；呼叫端需持有鎖。"""
+        protected = set(keep)
+        known_good = index.get("known_good")
+        if known_good:
+            prefix = f"{known_good['run_id']}/"
+            protected.update(tree for key, tree in index["entries"].items() if key.startswith(prefix))
+        total = sum(meta["size"] for meta in index["trees"].values())
+        for tree, meta in sorted(index["trees"].items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if tree in protected:
+                continue
+            total -= meta["size"]
+            self._drop_tree(index, tree)
+            self.stats["evicted"] += 1
+
+    # --- last known good ---
+    def mark_known_good(self, run_id, tags, metrics):
+        """記錄目前成功服務的模型 (MLflow 無法連線時使用)，該 run 的 artifact 不會被淘汰。"""
+        with self._lock:
+            index = self._read_index()
+            index["known_good"] = {
+                "run_id": run_id, "tags": dict(tags), "metrics": dict(metrics), "marked_at": time.time(),
+            }
+            self._write_index(index)
+
+    def known_good(self):
+        """回傳 last known good 的 run 資訊 (run_id、tags、metrics)，沒有紀錄時回傳 None。"""
+        with self._lock:
+            return self._read_index().get("known_good")
+
+    def snapshot(self):
+        with self._lock:
+            index = self._read_index()
+        return {
+            **self.stats,
+            "artifacts": len(index["trees"]),
+            "size_mb": sum(meta["size"] for meta in index["trees"].values()) / 1024 / 1024,
+            "max_mb": self.max_bytes / 1024 / 1024,
+            "known_good_run_id": (index.get("known_good") or {}).get("run_id"),
+        }
@@ -0,0 +1,71 @@
+# src/api/serving_metrics.py
+"""
+API 服務效能指標
+
+記錄每次預測的延遲與是否失敗，以滑動時間視窗計算吞吐量、p50/p95/p99 延遲與錯誤率，
+由 /metrics 提供給 Dashboard 輪詢。只保留最近 MAX_SAMPLES 筆，記憶體用量固定。
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+METRICS_WINDOW_SECONDS = float(os.getenv('METRICS_WINDOW_SECONDS', '60'))
+METRICS_MAX_SAMPLES = int(os.getenv('METRICS_MAX_SAMPLES', '50000'))
+
+
+class ServingMetrics:
+    """執行緒安全的預測延遲紀錄器。"""
+
+    def __init__(self, window_seconds=METRICS_WINDOW_SECONDS, max_samples=METRICS_MAX_SAMPLES):
+        self.window_seconds = window_seconds
+        self.started_at = time.time()
+        self.requests_total = 0
+        self.errors_total = 0
+        self.rows_total = 0
+        # (完成時間, 延遲秒數, 是否失敗, 筆數)
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, latency_seconds, error=False, rows=1):
+        """記錄一次預測請求 (批次請求以 rows 記錄筆數)。"""
+        with self._lock:
+            self._samples.append((time.time(), latency_seconds, error, rows))
+            self.requests_total += 1
+            self.rows_total += rows
+            self.errors_total += int(error)
+
+    def snapshot(self):
+        """回傳累計計數與最近 window_seconds 秒內的吞吐量、延遲百分位數與錯誤率。"""
+        now = time.time()
+        with self._lock:
+            samples = list(self._samples)
+            totals = {
+                "requests_total": self.requests_total,
+                "errors_total": self.errors_total,
+                "rows_total": self.rows_total,
+            }
+
+        recent = [s for s in samples if s[0] >= now - self.window_seconds]
+        # 剛啟動時視窗不足 window_seconds，以實際經過時間計算吞吐量
+        elapsed = min(self.window_seconds, max(now - self.started_at, 1e-9))
+        snapshot = {
+            "timestamp": now,
+            "uptime_seconds": now - self.started_at,
+            "window_seconds": self.window_seconds,
+            **totals,
+            "window_requests": len(recent),
+            "throughput_rps": len(recent) / elapsed,
+            "rows_per_second": sum(s[3] for s in recent) / elapsed,
+            "error_rate": (sum(s[2] for s in recent) / len(recent)) if recent else 0.0,
+            "latency_p50_ms": None,
+            "latency_p95_ms": None,
+            "latency_p99_ms": None,
+        }
+        if recent:
+            latencies_ms = np.array([s[1] for s in recent]) * 1000
+            p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+            snapshot.update({"latency_p50_ms": float(p50), "latency_p95_ms": float(p95), "latency_p99_ms": float(p99)})
+        return snapshot
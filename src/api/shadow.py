@@ -0,0 +1,111 @@
+# src/api/shadow.py
+"""
+Champion / Challenger Shadow 評分
+
+API 回應 champion 的預測後，依 SHADOW_SAMPLE_RATE 抽樣部分請求，在背景執行緒池用 challenger 重新評分，
+記錄兩個模型的決策一致率、機率差異與各自的延遲，不影響回應內容與 champion 延遲：
+
+- 抽樣與送出都在回應送出後進行 (FastAPI BackgroundTasks)，請求路徑上只多一次亂數判斷
+- 同時進行中的 shadow 評分有上限 (SHADOW_MAX_PENDING)，滿了就直接丟棄該次抽樣並計數，
+  challenger 變慢時不會累積工作或拖累 champion
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from api.serving_metrics import ServingMetrics
+
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', '0.1'))
+SHADOW_WORKERS = int(os.getenv('SHADOW_WORKERS', '1'))
+SHADOW_MAX_PENDING = int(os.getenv('SHADOW_MAX_PENDING', '8'))
+
+
+class ShadowScorer:
+    """以背景執行緒池執行 challenger 評分並累計與 champion 的比較結果。
+
+    predict_fn(records) 回傳 (機率陣列, 門檻)，records 為 champion 評分時使用的同一份輸入。
+    """
+
+    def __init__(self, predict_fn, model_info, sample_rate=SHADOW_SAMPLE_RATE, workers=SHADOW_WORKERS,
+                 max_pending=SHADOW_MAX_PENDING):
+        self.predict_fn = predict_fn
+        self.model_info = model_info
+        self.sample_rate = sample_rate
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shadow")
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # 同一批抽樣請求上兩個模型的延遲 (champion 延遲在請求路徑上量測後傳入)
+        self.champion_latency = ServingMetrics()
+        self.challenger_latency = ServingMetrics()
+        self.counts = {
+            "sampled_requests": 0, "dropped_requests": 0, "errors": 0, "rows": 0,
+            "agree": 0, "champion_only_fraud": 0, "challenger_only_fraud": 0, "both_fraud": 0,
+        }
+        self._abs_diff_sum = 0.0
+
+    def should_sample(self):
+        return random.random() < self.sample_rate
+
+    def submit(self, records, champion_proba, champion_threshold, champion_latency_seconds):
+        """送出一次 shadow 評分；進行中的工作已達上限時丟棄並回傳 False。"""
+        if not self._pending.acquire(blocking=False):
+            with self._lock:
+                self.counts["dropped_requests"] += 1
+            return False
+        try:
+            self._executor.submit(self._score, records, np.asarray(champion_proba), champion_threshold,
+                                  champion_latency_seconds)
+        except Exception:
+            self._pending.release()
+            raise
+        return True
+
+    def _score(self, records, champion_proba, champion_threshold, champion_latency_seconds):
+        try:
+            start = time.perf_counter()
+            try:
+                challenger_proba, challenger_threshold = self.predict_fn(records)
+            except Exception as e:
+                self.challenger_latency.record(time.perf_counter() - start, error=True, rows=len(records))
+                with self._lock:
+                    self.counts["errors"] += 1
+                print(f"⚠️  Challenger 評分失敗: {e}")
+                return
+            self.challenger_latency.record(time.perf_counter() - start, rows=len(records))
+            self.champion_latency.record(champion_latency_seconds, rows=len(records))
+
+            champion_fraud = champion_proba > champion_threshold
+            challenger_fraud = np.asarray(challenger_proba) > challenger_threshold
+            with self._lock:
+                self.counts["sampled_requests"] += 1
+                self.counts["rows"] += len(records)
+                self.counts["agree"] += int((champion_fraud == challenger_fraud).sum())
+                self.counts["both_fraud"] += int((champion_fraud & challenger_fraud).sum())
+                self.counts["champion_only_fraud"] += int((champion_fraud & ~challenger_fraud).sum())
+                self.counts["challenger_only_fraud"] += int((~champion_fraud & challenger_fraud).sum())
+                self._abs_diff_sum += float(np.abs(champion_proba - challenger_proba).sum())
+        finally:
+            self._pending.release()
+
+    def snapshot(self):
+        """回傳累計的一致率、機率差異與兩個模型在抽樣請求上的延遲。"""
+        with self._lock:
+            counts = dict(self.counts)
+            abs_diff_sum = self._abs_diff_sum
+        rows = counts["rows"]
+        champion = self.champion_latency.snapshot()
+        challenger = self.challenger_latency.snapshot()
+        latency_keys = ("latency_p50_ms", "latency_p95_ms", "latency_p99_ms")
+        return {
+            "challenger": self.model_info,
+            "sample_rate": self.sample_rate,
+            **counts,
+            "agreement_rate": counts["agree"] / rows if rows else None,
+            "mean_abs_probability_diff": abs_diff_sum / rows if rows else None,
+            "champion_latency": {key: champion[key] for key in latency_keys},
+            "challenger_latency": {key: challenger[key] for key in latency_keys},
+        }
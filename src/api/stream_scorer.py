@@ -0,0 +1,450 @@
+# src/api/stream_scorer.py
+"""
+事件流評分器 (Stream Scorer)
+
+正式環境的交易是推到佇列而不是呼叫 HTTP；這裡直接消費事件流，省去每筆事件一次 /predict 來回。
+模型載入與推論沿用 API (api.main) 的實作，服務模型、精簡格式、速度特徵狀態都與 API 一致。
+
+    來源 (source) ──▶ 事件佇列 ──▶ 微批次 + 評分 ──▶ 結果佇列 ──▶ 輸出 (sink)
+
+- 來源：NDJSON 檔案 tail、Unix socket (每行一筆 JSON)、程序內 asyncio.Queue (測試用)
+- 微批次：湊滿 STREAM_BATCH_SIZE 筆或第一筆等待超過 STREAM_BATCH_WAIT_MS 就送出評分
+- 背壓：兩個佇列都有上限，佇列滿時來源的 put 會等待 (socket 停止讀取、檔案停止讀行)，
+  下游變慢時記憶體用量不會無限增加
+- 延遲：每筆事件從來源收到到寫入 sink 完成的端到端延遲，定期印出 p50/p95/p99 與吞吐量；
+  事件帶 event_ts (epoch 秒) 時另計算從上游產生到寫入的延遲
+
+用法 (於專案根目錄執行，與 uvicorn 相同):
+    python src/api/stream_scorer.py --source tail:events.ndjson --sink ndjson:-
+    python src/api/stream_scorer.py --source unix:/tmp/fraud.sock --sink postgres
+"""
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from api.serving_metrics import ServingMetrics
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+STREAM_BATCH_WAIT_MS = float(os.getenv('STREAM_BATCH_WAIT_MS', '50'))
+# 事件佇列上限 (筆) 與結果佇列上限 (批)
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '10000'))
+STREAM_SINK_QUEUE_BATCHES = int(os.getenv('STREAM_SINK_QUEUE_BATCHES', '8'))
+STREAM_STATS_SECONDS = float(os.getenv('STREAM_STATS_SECONDS', '10'))
+FILE_TAIL_POLL_SECONDS = float(os.getenv('FILE_TAIL_POLL_SECONDS', '0.2'))
+
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'fraud_db')
+DB_USER = os.getenv('DB_USER', 'user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_PORT = '5432'
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+STREAM_SCORES_TABLE = 'stream_scores'
+
+# 與 API 的 Transaction schema 相同的輸入欄位
+TRANSACTION_FIELDS = ['time', 'amount'] + [f'v{i}' for i in range(1, 29)]
+RESULT_COLUMNS = ["event_id", "time", "amount", "fraud_probability", "is_fraud", "run_id", "threshold", "lag_ms"]
+
+CREATE_STREAM_SCORES_SQL = f"""
+CREATE TABLE IF NOT EXISTS {STREAM_SCORES_TABLE} (
+    id BIGSERIAL PRIMARY KEY,
+    event_id TEXT,
+    time DOUBLE PRECISION NOT NULL,
+    amount DOUBLE PRECISION,
+    fraud_probability DOUBLE PRECISION NOT NULL,
+    is_fraud SMALLINT NOT NULL,
+    run_id TEXT,
+    threshold DOUBLE PRECISION NOT NULL,
+    lag_ms DOUBLE PRECISION,
+    scored_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_{STREAM_SCORES_TABLE}_time ON {STREAM_SCORES_TABLE} (time);
+"""
+
+_END = object()  # 來源結束的哨兵
+
+
+# --- 來源 ---
+class QueueSource:
+    """程序內來源：從 asyncio.Queue 取事件，收到 None 表示結束 (測試或內嵌使用)。"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def run(self, emit):
+        while True:
+            event = await self.queue.get()
+            if event is None:
+                return
+            await emit(event)
+
+
+class FileTailSource:
+    """像 tail -f 一樣讀取 NDJSON 檔案新增的行；from_start=False 時從檔尾開始。
+
+    follow=False 時讀到檔尾即結束 (重播檔案)。
+    """
+
+    def __init__(self, path, from_start=True, follow=True, poll_seconds=FILE_TAIL_POLL_SECONDS):
+        self.path = path
+        self.from_start = from_start
+        self.follow = follow
+        self.poll_seconds = poll_seconds
+
+    async def run(self, emit):
+        with open(self.path, 'r') as f:
+            if not self.from_start:
+                f.seek(0, os.SEEK_END)
+            partial = ""
+            while True:
+                line = f.readline()
+                if not line:
+                    if not self.follow:
+                        # 重播時檔案最後一行可能沒有換行符號，讀到檔尾就不會再補上
+                        if partial.strip():
+                            await emit(partial)
+                        return
+                    await asyncio.sleep(self.poll_seconds)
+                    continue
+                # 寫入端可能還沒寫完整行，等換行符號出現再解析
+                if not line.endswith("\n"):
+                    partial += line
+                    continue
+                line, partial = partial + line, ""
+                if line.strip():
+                    await emit(line)
+
+
+class UnixSocketSource:
+    """監聽 Unix socket，每個連線送 NDJSON；佇列滿時停止讀取，背壓會傳回寫入端。"""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def run(self, emit):
+        async def handle(reader, writer):
+            try:
+                while line := await reader.readline():
+                    if line.strip():
+                        await emit(line)
+            except ConnectionError as e:
+                print(f"⚠️  Unix socket 連線中斷: {e}")
+            finally:
+                writer.close()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(handle, path=self.path)
+        print(f"👂 監聽 Unix socket {self.path}")
+        async with server:
+            await server.serve_forever()
+
+
+# --- 輸出 ---
+class NdjsonSink:
+    """將評分結果寫成 NDJSON (path 為 '-' 時寫到 stdout)。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = sys.stdout if path == '-' else open(path, 'a')
+
+    def write(self, results):
+        if len(results):
+            self._file.write(results.to_json(orient="records", lines=True, double_precision=15).rstrip("\n") + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class PostgresSink:
+    """以 COPY 將每個批次寫入 stream_scores (一個批次一個交易)。"""
+
+    def __init__(self, database_url=None):
+        from sqlalchemy import create_engine, text
+        self.engine = create_engine(database_url or DATABASE_URL)
+        with self.engine.begin() as connection:
+            connection.execute(text(CREATE_STREAM_SCORES_SQL))
+
+    def write(self, results):
+        buffer = io.StringIO()
+        results[RESULT_COLUMNS].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {STREAM_SCORES_TABLE} ({', '.join(RESULT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def close(self):
+        self.engine.dispose()
+
+
+def api_score_fn():
+    """回傳沿用 API 模型的評分函式 (第一次呼叫時才載入 api.main，與 uvicorn 啟動相同)。"""
+    from api import main as serving
+    if serving.model is None:
+        raise RuntimeError("API 模型載入失敗，無法評分")
+
+    # 串流的事件依序到達：速度特徵狀態跨微批次保留 (與 API 行程的 /predict 狀態互不相干)
+    velocity_state = serving.new_velocity_state()
+
+    def score(records):
+        proba, threshold = serving.predict_proba_records(records, velocity_state)
+        return proba, threshold, serving.MODEL_INFO["run_id"]
+    return score
+
+
+# --- 評分器 ---
+class StreamScorer:
+    """source → 有界事件佇列 → 微批次評分 → 有界結果佇列 → sink。
+
+    score_fn(records) 回傳 (機率陣列, 門檻, run_id)；預設沿用 API 的模型。
+    """
+
+    def __init__(self, source, sink, score_fn=None, batch_size=STREAM_BATCH_SIZE, batch_wait_ms=STREAM_BATCH_WAIT_MS,
+                 queue_size=STREAM_QUEUE_SIZE, sink_queue_batches=STREAM_SINK_QUEUE_BATCHES,
+                 stats_seconds=STREAM_STATS_SECONDS):
+        self.source = source
+        self.sink = sink
+        self.score_fn = score_fn or api_score_fn()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.stats_seconds = stats_seconds
+        self.events = asyncio.Queue(maxsize=queue_size)
+        self.results = asyncio.Queue(maxsize=sink_queue_batches)
+        # 端到端延遲 (來源收到 → sink 寫入完成) 與上游延遲 (event_ts → sink 寫入完成)
+        self.lag = ServingMetrics(window_seconds=stats_seconds)
+        self.upstream_lag = ServingMetrics(window_seconds=stats_seconds)
+        self.counters = {"received": 0, "invalid": 0, "scored": 0, "written": 0, "failed": 0,
+                         "batches": 0, "backpressure_waits": 0}
+        self._source_task = None
+
+    async def emit(self, event):
+        """來源呼叫：記錄收到時間後放入事件佇列；佇列滿時等待 (背壓)。
+
+        event 為 dict 或一行 NDJSON (str/bytes)；無法解析的行 (格式錯誤、寫到一半被截斷) 計入 invalid 後略過，
+        與 _score_batch 略過欄位錯誤的事件相同，不會中斷來源。
+        """
+        if isinstance(event, (str, bytes)):
+            try:
+                event = json.loads(event)
+            except json.JSONDecodeError as e:
+                self.counters["invalid"] += 1
+                print(f"⚠️  略過無法解析的 JSON 行: {e}", file=sys.stderr)
+                return
+        if self.events.full():
+            self.counters["backpressure_waits"] += 1
+        await self.events.put((time.time(), event))
+        self.counters["received"] += 1
+
+    async def _run_source(self):
+        try:
+            await self.source.run(self.emit)
+        finally:
+            await self.events.put(_END)
+
+    async def _next_batch(self):
+        """取出一個微批次；回傳 (批次, 是否已到來源結尾)。"""
+        item = await self.events.get()
+        if item is _END:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            # 佇列中已有的事件直接取出，不等待
+            try:
+                item = self.events.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.events.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is _END:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _score_batch(self, batch):
+        """驗證並評分一個批次 (在執行緒中執行，不阻塞事件迴圈)。"""
+        received_at, records, events = [], [], []
+        for ts, event in batch:
+            try:
+                records.append({name: float(event[name]) for name in TRANSACTION_FIELDS})
+            except (KeyError, TypeError, ValueError) as e:
+                self.counters["invalid"] += 1
+                print(f"⚠️  略過格式錯誤的事件: {e.__class__.__name__}: {str(e)[:200]}", file=sys.stderr)
+                continue
+            received_at.append(ts)
+            events.append(event)
+        if not records:
+            return None
+
+        proba, threshold, run_id = self.score_fn(records)
+        return pd.DataFrame({
+            "event_id": [event.get("event_id", event.get("transaction_id")) for event in events],
+            "time": [record["time"] for record in records],
+            "amount": [record["amount"] for record in records],
+            "fraud_probability": proba,
+            "is_fraud": (np.asarray(proba) > threshold).astype(int),
+            "run_id": run_id,
+            "threshold": threshold,
+            "_received_at": received_at,
+            "_event_ts": [event.get("event_ts") for event in events],
+        })
+
+    async def _run_scorer(self):
+        try:
+            while True:
+                batch, finished = await self._next_batch()
+                if batch:
+                    try:
+                        results = await asyncio.to_thread(self._score_batch, batch)
+                    except Exception as e:
+                        self.counters["failed"] += len(batch)
+                        print(f"🔥 批次評分失敗 ({len(batch)} 筆): {e}")
+                        results = None
+                    if results is not None:
+                        self.counters["scored"] += len(results)
+                        self.counters["batches"] += 1
+                        # 結果佇列滿 (sink 跟不上) 時在這裡等待，事件佇列隨之累積並對來源產生背壓
+                        await self.results.put(results)
+                if finished:
+                    return
+        finally:
+            await self.results.put(_END)
+
+    async def _run_sink(self):
+        while (results := await self.results.get()) is not _END:
+            now = time.time()
+            results["lag_ms"] = (now - results["_received_at"]) * 1000
+            try:
+                await asyncio.to_thread(self.sink.write, results.drop(columns=["_received_at", "_event_ts"]))
+            except Exception as e:
+                self.counters["failed"] += len(results)
+                print(f"🔥 寫入 sink 失敗 ({len(results)} 筆): {e}")
+                continue
+            written_at = time.time()
+            self.counters["written"] += len(results)
+            for received_at, event_ts in zip(results["_received_at"], results["_event_ts"]):
+                self.lag.record(written_at - received_at)
+                if event_ts is not None:
+                    self.upstream_lag.record(written_at - float(event_ts))
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_seconds)
+            self.print_stats()
+
+    def stats(self):
+        """目前的計數、佇列深度與延遲百分位數。"""
+        lag = self.lag.snapshot()
+        upstream = self.upstream_lag.snapshot()
+        return {
+            **self.counters,
+            "event_queue_depth": self.events.qsize(),
+            "result_queue_depth": self.results.qsize(),
+            "events_per_second": lag["throughput_rps"],
+            "lag_p50_ms": lag["latency_p50_ms"],
+            "lag_p95_ms": lag["latency_p95_ms"],
+            "lag_p99_ms": lag["latency_p99_ms"],
+            "upstream_lag_p99_ms": upstream["latency_p99_ms"],
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        print(f"📈 {s['events_per_second']:.0f} events/s | 已寫入 {s['written']} 筆 ({s['batches']} 批) | "
+              f"佇列 {s['event_queue_depth']}/{s['result_queue_depth']} | 背壓 {s['backpressure_waits']} 次 | "
+              f"延遲 p50={fmt(s['lag_p50_ms'])} p95={fmt(s['lag_p95_ms'])} p99={fmt(s['lag_p99_ms'])} ms | "
+              f"上游 p99={fmt(s['upstream_lag_p99_ms'])} ms | 無效 {s['invalid']} 失敗 {s['failed']}",
+              file=sys.stderr)  # 結果可能寫到 stdout，統計一律寫 stderr
+
+    def stop(self):
+        """停止讀取來源；佇列中已收到的事件仍會評分並寫入 sink 後 run() 才返回。"""
+        if self._source_task is not None:
+            self._source_task.cancel()
+
+    async def run(self):
+        """執行到來源結束或 stop()，確保已收到的事件都寫入 sink 後才返回。"""
+        reporter = asyncio.create_task(self._report_stats())
+        self._source_task = asyncio.create_task(self._run_source())
+        try:
+            await asyncio.gather(self._run_scorer(), self._run_sink())
+            await asyncio.gather(self._source_task, return_exceptions=True)
+            # 來源本身出錯 (檔案被刪除、socket 無法建立...) 時，已收到的事件寫完後拋出，讓行程以非零狀態結束；
+            # stop() 造成的取消則是正常結束
+            if not self._source_task.cancelled() and self._source_task.exception() is not None:
+                raise self._source_task.exception()
+        finally:
+            reporter.cancel()
+            self._source_task.cancel()
+            self.sink.close()
+            self.print_stats()
+        return self.stats()
+
+
+def build_source(spec):
+    kind, _, target = spec.partition(":")
+    if kind == "tail":
+        return FileTailSource(target, from_start=False)
+    if kind == "file":
+        return FileTailSource(target, from_start=True, follow=False)
+    if kind == "unix":
+        return UnixSocketSource(target)
+    raise ValueError(f"不支援的來源: {spec} (tail:PATH | file:PATH | unix:PATH)")
+
+
+def build_sink(spec):
+    kind, _, target = spec.partition(":")
+    if kind == "ndjson":
+        return NdjsonSink(target or "-")
+    if kind == "postgres":
+        return PostgresSink(target or None)
+    raise ValueError(f"不支援的輸出: {spec} (ndjson:PATH|- | postgres[:URL])")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="以 API 的服務模型對事件流做微批次評分")
+    parser.add_argument("--source", required=True,
+                        help="tail:PATH (追蹤新增行) | file:PATH (重播後結束) | unix:SOCKET_PATH")
+    parser.add_argument("--sink", default="ndjson:-", help="ndjson:PATH (- 為 stdout) | postgres[:URL]")
+    parser.add_argument("--batch-size", type=int, default=STREAM_BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=STREAM_BATCH_WAIT_MS)
+    parser.add_argument("--queue-size", type=int, default=STREAM_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    scorer = StreamScorer(
+        build_source(args.source), build_sink(args.sink),
+        batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms, queue_size=args.queue_size
+    )
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            # 停止讀取來源，已收到的事件寫完後結束
+            loop.add_signal_handler(sig, scorer.stop)
+        await scorer.run()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,15 @@
 import streamlit as st
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import base64
+import threading
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import time as time_module  # 避免與下方表單的 time 輸入欄位同名
 
 # --- 服務設定 ---
 import os
@@ -33,93 +40,367 @@ MLFLOW_EXP_NAME = "Fraud Detection Baseline" # 使用實驗名稱來查找 ID
 st.set_page_config(page_title="詐欺偵測儀表板", layout="wide")
 
 
+# --- MLflow 查詢設定 ---
+RUNS_PAGE_SIZE = int(os.getenv("MLFLOW_RUNS_PAGE_SIZE", "500"))
+RUNS_REFRESH_SECONDS = 60  # 增量更新間隔
+# 增量查詢往回重疊的時間 (毫秒)，涵蓋各機器時鐘誤差與同時開始的 run
+RUNS_OVERLAP_MS = 5 * 60 * 1000
+# 定期完整重新讀取，移除已刪除的 run
+RUNS_FULL_REFRESH_SECONDS = 30 * 60
+RUN_ID_FILTER_CHUNK = 100
+
+# --- API 服務效能監控設定 ---
+API_BASE_URL = API_URL.rsplit('/predict', 1)[0]
+API_METRICS_URL = os.getenv("API_METRICS_URL", f"{API_BASE_URL}/metrics")
+METRICS_POLL_SECONDS = int(os.getenv("METRICS_POLL_SECONDS", "5"))
+# 時間序列最多保留的點數 (預設 5 秒一點，約 1 小時)
+METRICS_HISTORY_POINTS = int(os.getenv("METRICS_HISTORY_POINTS", "720"))
+
+# --- 批次 CSV 評分設定 ---
+API_BATCH_URL = os.getenv("API_BATCH_URL", f"{API_BASE_URL}/predict/batch")
+BATCH_CHUNK_ROWS = int(os.getenv("BATCH_CHUNK_ROWS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RESULTS_DIR = os.getenv("BATCH_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "fraud_batch_results"))
+# 超過這個時間的結果檔視為已結束的 session 留下的，下一次批次評分開始時刪除
+BATCH_RESULTS_TTL_SECONDS = float(os.getenv("BATCH_RESULTS_TTL_SECONDS", "3600"))
+FEATURE_COLUMNS = ['time', 'amount'] + [f'v{i}' for i in range(1, 29)]
+
+
+# --- 核心函式 0: 共用連線池 ---
+@st.cache_resource
+def get_http_session():
+    """整個 Streamlit 行程共用的 requests.Session (keep-alive 連線池 + 暫時性錯誤重試)。"""
+    session = requests.Session()
+    # runs/search 雖是 POST 但不會改變狀態，允許重試
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 # --- 核心函式 1: 動態獲取實驗 ID ---
-@st.cache_data(ttl=60)  # 緩存 60 秒後自動更新
+@st.cache_data(ttl=3600)  # 實驗 ID 不會改變，快取一小時
+def _lookup_experiment_id(name):
+    response = get_http_session().get(
+        f"{MLFLOW_BASE_URI}mlflow/experiments/get-by-name",
+        params={"experiment_name": name},
+        timeout=5
+    )
+    response.raise_for_status()
+    return response.json()["experiment"]["experiment_id"]
+
+
 def get_experiment_id():
     """動態地從 MLflow 獲取實驗 ID。"""
     try:
-        response = requests.get(f"{MLFLOW_BASE_URI}mlflow/experiments/search?max_results=100", timeout=5)
-        response.raise_for_status()
-        experiments = response.json().get('experiments', [])
-        
-        for exp in experiments:
-            if exp['name'] == MLFLOW_EXP_NAME:
-                return exp['experiment_id']
-        
-        return None
+        return _lookup_experiment_id(MLFLOW_EXP_NAME)
     except Exception:
+        # 例外不會被快取：實驗尚未建立時，下次重新整理會再查詢
         return None
 
 
 # --- 核心函式 2: 從 MLflow 讀取數據 ---
-@st.cache_data(ttl=60)  # 緩存 60 秒後自動更新
+def search_runs_paged(experiment_id, filter_string=""):
+    """以 page token 分頁呼叫 runs/search，回傳所有符合條件的 run (JSON)。"""
+    session = get_http_session()
+    runs = []
+    page_token = None
+    while True:
+        payload = {
+            "experiment_ids": [experiment_id],
+            "filter": filter_string,
+            "max_results": RUNS_PAGE_SIZE,
+            "order_by": ["attributes.start_time DESC"]
+        }
+        if page_token:
+            payload["page_token"] = page_token
+        response = session.post(f"{MLFLOW_BASE_URI}mlflow/runs/search", json=payload, timeout=10)
+        response.raise_for_status()
+        body = response.json()
+        runs.extend(body.get("runs", []))
+        page_token = body.get("next_page_token")
+        if not page_token:
+            return runs
+
+
+def _key_values_to_columns(frame, kind):
+    """將 data.metrics/params/tags 的 [{key, value}] 欄位展開成寬表 (每個 key 一欄)。"""
+    column = f"data.{kind}"
+    if column not in frame:
+        return pd.DataFrame(index=frame.index)
+    exploded = frame[column].explode().dropna()
+    if exploded.empty:
+        return pd.DataFrame(index=frame.index)
+    pairs = pd.json_normalize(exploded.tolist())
+    pairs.index = exploded.index
+    wide = pairs.set_index("key", append=True)["value"].unstack()
+    wide.columns = [f"{kind}.{key}" for key in wide.columns]
+    return wide.reindex(frame.index)
+
+
+def runs_to_frame(runs):
+    """將 runs/search 的 JSON 轉成以 run_id 為索引的 DataFrame (欄位: metrics.* / params.* / tags.*)。"""
+    if not runs:
+        return pd.DataFrame(columns=["name", "start_time", "status"]).rename_axis("run_id")
+    frame = pd.json_normalize(runs, max_level=1)
+    frame.index = pd.Index(frame["info.run_id"], name="run_id")
+    info = pd.DataFrame({
+        "name": frame.get("info.run_name", pd.Series("N/A", index=frame.index)),
+        "start_time": pd.to_numeric(frame["info.start_time"]),
+        "status": frame["info.status"],
+    }, index=frame.index)
+    return pd.concat(
+        [info] + [_key_values_to_columns(frame, kind) for kind in ("metrics", "params", "tags")],
+        axis=1
+    )
+
+
+@st.cache_resource
+def get_runs_cache():
+    """行程層級的 run 快取 (所有使用者共用)，增量更新以避免每次重建整張表。"""
+    return {"lock": threading.Lock(), "experiments": {}}
+
+
+def _fetch_incremental(experiment_id, entry):
+    """只查詢上次看到的最新 start_time (減去重疊時間) 之後的 run，以及上次仍在執行中的 run。"""
+    cached = entry["frame"]
+    since = entry["max_start_time"] - RUNS_OVERLAP_MS
+    new = runs_to_frame(search_runs_paged(experiment_id, f"attributes.start_time >= {since}"))
+
+    # 仍在執行中的 run 之後才會寫入指標 (背景上傳)，需要重新讀取
+    unfinished = cached.index[cached["status"] == "RUNNING"].difference(new.index)
+    for i in range(0, len(unfinished), RUN_ID_FILTER_CHUNK):
+        run_ids = ", ".join(f"'{run_id}'" for run_id in unfinished[i:i + RUN_ID_FILTER_CHUNK])
+        refreshed = runs_to_frame(search_runs_paged(experiment_id, f"attributes.run_id IN ({run_ids})"))
+        new = pd.concat([new, refreshed])
+
+    return pd.concat([cached.drop(index=new.index, errors="ignore"), new])
+
+
+def get_runs_frame(experiment_id):
+    """回傳實驗的所有 run；RUNS_REFRESH_SECONDS 內直接使用快取，之後只增量查詢新的 run。"""
+    cache = get_runs_cache()
+    with cache["lock"]:
+        entry = cache["experiments"].get(experiment_id)
+        now = time_module.time()
+        if entry is not None and now - entry["fetched_at"] < RUNS_REFRESH_SECONDS:
+            return entry["frame"]
+
+        try:
+            if entry is None or now - entry["full_at"] > RUNS_FULL_REFRESH_SECONDS:
+                frame = runs_to_frame(search_runs_paged(experiment_id))
+                full_at = now
+            else:
+                frame = _fetch_incremental(experiment_id, entry)
+                full_at = entry["full_at"]
+        except Exception as e:
+            print(f"MLflow API 調用失敗: {e}")
+            # 查詢失敗時沿用上次的結果
+            return entry["frame"] if entry is not None else pd.DataFrame()
+
+        cache["experiments"][experiment_id] = {
+            "frame": frame,
+            "fetched_at": now,
+            "full_at": full_at,
+            "max_start_time": int(frame["start_time"].max()) if len(frame) else 0,
+        }
+        return frame
+
+
 def get_mlflow_runs(experiment_id):
-    """從 MLflow Tracking API 獲取所有實驗運行結果 (使用 runs/search)。"""
+    """從 MLflow Tracking API 獲取所有實驗運行結果，整理成模型比較表。"""
     
     if not experiment_id:
         return pd.DataFrame()
 
-    payload = {
-        "experiment_ids": [experiment_id],
-        "order_by": ["attributes.start_time DESC"]
-    }
+    runs = get_runs_frame(experiment_id)
+    if runs.empty:
+        return pd.DataFrame()
+
+    column = lambda key, default=None: runs[key] if key in runs else pd.Series(default, index=runs.index)
+    df = pd.DataFrame({
+        'name': runs['name'].fillna('N/A'),
+        'f1': column('metrics.f1_score'),
+        'precision': column('metrics.precision_score'),
+        'recall': column('metrics.recall_score'),
+        'auc': column('metrics.roc_auc_score'),
+        'class_weight': column('params.class_weight').fillna('-'),
+        'model_type': column('tags.model_type').fillna('Unknown'),
+    })
+    # 只過濾掉沒有 F1 分數的記錄，不管是否有模型文件
+    df = df.dropna(subset=['f1'])
+    if not df.empty:
+        df = df.sort_values(by='f1', ascending=False).reset_index(drop=True)
+        for metric in ('f1', 'precision', 'recall', 'auc'):
+            df[metric] = df[metric].map('{:.4f}'.format)
     
-    try:
-        full_url = f"{MLFLOW_BASE_URI}mlflow/runs/search"
-        response = requests.post(full_url, json=payload, timeout=5) 
-        response.raise_for_status() 
-
-        json_data = response.json()
-        if isinstance(json_data, dict) and 'runs' in json_data:
-            run_data = json_data['runs']
-        elif isinstance(json_data, list):
-            run_data = json_data
-        else:
-            return pd.DataFrame()
-        
-        # 解析數據並返回 DataFrame
-        records = []
-        for run in run_data:
-            # 解析metrics列表為字典
-            metrics_dict = {}
-            for metric in run.get('data', {}).get('metrics', []):
-                metrics_dict[metric['key']] = metric['value']
-            
-            # 解析params列表為字典
-            params_dict = {}
-            for param in run.get('data', {}).get('params', []):
-                params_dict[param['key']] = param['value']
-            
-            # 解析tags列表為字典
-            tags_dict = {}
-            for tag in run.get('data', {}).get('tags', []):
-                tags_dict[tag['key']] = tag['value']
-            
-            records.append({
-                'name': run.get('info', {}).get('run_name', 'N/A'),
-                'f1': metrics_dict.get('f1_score', None),
-                'precision': metrics_dict.get('precision_score', None),
-                'recall': metrics_dict.get('recall_score', None),
-                'auc': metrics_dict.get('roc_auc_score', None),
-                'class_weight': params_dict.get('class_weight', '-'),
-                'model_type': tags_dict.get('model_type', 'Unknown'),
+    return df
+
+
+# --- 核心函式 3: 輪詢 API 服務效能 ---
+@st.cache_resource
+def get_metrics_history():
+    """所有瀏覽者共用的 API 指標時間序列 (固定長度，最舊的點自動丟棄)。"""
+    return {"lock": threading.Lock(), "points": deque(maxlen=METRICS_HISTORY_POINTS)}
+
+
+def poll_serving_metrics():
+    """向 API /metrics 取樣一次並加入時間序列，回傳目前所有點；同一輪詢間隔內只查詢一次。"""
+    history = get_metrics_history()
+    with history["lock"]:
+        points = history["points"]
+        now = time_module.time()
+        if points and now - points[-1]["polled_at"] < METRICS_POLL_SECONDS:
+            return list(points)
+
+        point = {"polled_at": now, "time": pd.Timestamp(now, unit="s"), "available": False}
+        try:
+            response = get_http_session().get(API_METRICS_URL, timeout=3)
+            response.raise_for_status()
+            data = response.json()
+            model_info = data.get("model") or {}
+            point.update({
+                "available": True,
+                "throughput_rps": data["throughput_rps"],
+                "latency_p50_ms": data["latency_p50_ms"],
+                "latency_p95_ms": data["latency_p95_ms"],
+                "latency_p99_ms": data["latency_p99_ms"],
+                "error_rate": data["error_rate"],
+                "run_id": model_info.get("run_id") or "local",
+                "model_type": model_info.get("model_type"),
             })
-            
-        df = pd.DataFrame(records)
-        # 只過濾掉沒有 F1 分數的記錄，不管是否有模型文件
-        df = df.dropna(subset=['f1'])
-        if not df.empty:
-            df = df.sort_values(by='f1', ascending=False).reset_index(drop=True)
-            df['f1'] = df['f1'].map(lambda x: f'{x:.4f}')
-            df['precision'] = df['precision'].map(lambda x: f'{x:.4f}')
-            df['recall'] = df['recall'].map(lambda x: f'{x:.4f}')
-            df['auc'] = df['auc'].map(lambda x: f'{x:.4f}')
-        
-        return df
+        except Exception as e:
+            # 無回應的點保留為空值，圖表上會顯示為斷點
+            print(f"API metrics 查詢失敗: {e}")
+        points.append(point)
+        return list(points)
+
+
+@st.fragment(run_every=METRICS_POLL_SECONDS)
+def serving_performance_panel():
+    """API 吞吐量、延遲、錯誤率與服務中模型的即時圖表 (只重新執行此區塊)。"""
+    points = poll_serving_metrics()
+    latest = points[-1]
+    if not latest["available"]:
+        st.warning(f"無法取得 API 服務指標 ({API_METRICS_URL})。")
+    if not any(point["available"] for point in points):
+        return
+
+    df = pd.DataFrame(points).set_index("time")
+    current = df[df["available"]].iloc[-1]
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("吞吐量 (req/s)", f"{current['throughput_rps']:.1f}")
+    with col2:
+        p99 = current['latency_p99_ms']
+        st.metric("p99 延遲 (ms)", "-" if pd.isna(p99) else f"{p99:.1f}")
+    with col3:
+        st.metric("錯誤率", f"{current['error_rate']:.2%}")
+    with col4:
+        st.metric("服務中模型", f"{current['run_id'][:8]}", help=f"{current['model_type']} / run_id {current['run_id']}")
 
+    chart_col1, chart_col2 = st.columns(2)
+    with chart_col1:
+        st.caption("延遲 p50 / p95 / p99 (ms)")
+        st.line_chart(df[["latency_p50_ms", "latency_p95_ms", "latency_p99_ms"]])
+    with chart_col2:
+        st.caption("吞吐量 (req/s) 與錯誤率")
+        st.line_chart(df[["throughput_rps"]])
+        st.line_chart(df[["error_rate"]])
+
+    # 模型切換事件：run_id 與前一個可用取樣點不同
+    served = df[df["available"]]
+    swaps = served[served["run_id"] != served["run_id"].shift()]
+    if len(swaps) > 1:
+        st.caption("模型切換紀錄 (切換後的延遲變化可對照上方圖表)")
+        st.dataframe(swaps[["run_id", "model_type"]].iloc[1:], use_container_width=True)
+
+
+# --- 核心函式 4: 批次 CSV 評分 ---
+def score_chunk(chunk_index, chunk):
+    """將一個 chunk 送到 /predict/batch，回傳 (chunk_index, 加上預測欄位的 chunk, 錯誤訊息)。"""
+    try:
+        payload = {"transactions": chunk[FEATURE_COLUMNS].to_dict(orient="records")}
+        response = get_http_session().post(API_BATCH_URL, json=payload, timeout=60)
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return chunk_index, chunk.assign(fraud_probability=result["fraud_probability"],
+                                         is_fraud=result["is_fraud"]), None
     except Exception as e:
-        print(f"MLflow API 調用失敗: {e}")
-        return pd.DataFrame()
+        return chunk_index, chunk.assign(fraud_probability=float("nan"), is_fraud=pd.NA), str(e)
+
+
+def remove_batch_result(path):
+    """刪除批次評分結果檔 (不存在時忽略)。"""
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def cleanup_batch_results(results_dir, ttl_seconds):
+    """刪除 results_dir 中超過 ttl_seconds 未修改的結果檔；Streamlit 沒有 session 結束的回呼，以此回收。"""
+    if not os.path.isdir(results_dir):
+        return
+    cutoff = time_module.time() - ttl_seconds
+    for name in os.listdir(results_dir):
+        path = os.path.join(results_dir, name)
+        try:
+            if name.startswith("scored_") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def score_csv_file(uploaded_file, output_path, on_progress):
+    """分塊讀取上傳的 CSV，以有限並行度送到 API 評分，完成的 chunk 立即附加寫入 output_path。
+
+    同時最多 BATCH_CONCURRENCY 個 chunk 在處理中；結果寫入磁碟後即釋放，
+    完成順序可能與輸入不同，輸出以 row_number 欄位保留原始列號。
+    """
+    reader = pd.read_csv(uploaded_file, chunksize=BATCH_CHUNK_ROWS)
+    stats = {"rows": 0, "fraud": 0, "failed_rows": 0, "errors": []}
+    header_written = False
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor, open(output_path, "w", newline="") as output:
+        pending = set()
+        chunk_index = 0
+        exhausted = False
+        while pending or not exhausted:
+            # 維持最多 BATCH_CONCURRENCY 個進行中的 chunk，避免一次讀入整個檔案
+            while not exhausted and len(pending) < BATCH_CONCURRENCY:
+                chunk = next(reader, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                chunk.columns = [col.lower() for col in chunk.columns]
+                missing = [col for col in FEATURE_COLUMNS if col not in chunk.columns]
+                if missing:
+                    raise ValueError(f"CSV 缺少欄位: {missing}")
+                # read_csv 分塊的 index 延續整個檔案的列號
+                chunk.insert(0, "row_number", chunk.index)
+                pending.add(executor.submit(score_chunk, chunk_index, chunk))
+                chunk_index += 1
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, scored, error = future.result()
+                scored.to_csv(output, header=not header_written, index=False)
+                header_written = True
+                stats["rows"] += len(scored)
+                if error:
+                    stats["failed_rows"] += len(scored)
+                    stats["errors"].append(error)
+                else:
+                    stats["fraud"] += int(scored["is_fraud"].sum())
+                on_progress(stats)
+    return stats
 
 
 # --- 介面呈現 (主邏輯) ---
@@ -156,6 +437,11 @@ else:
     st.info("無法載入 MLflow 數據，請確認服務已運行且模型已訓練。")
 
 
+st.markdown("---")
+
+st.header("🩺 API 服務效能")
+serving_performance_panel()
+
 st.markdown("---")
 
 # --- 2. 實時預測區 ---
@@ -234,4 +520,60 @@ if submitted:
             if 'response' in locals():
                 st.json(response.json())
         except:
-            pass
\ No newline at end of file
+            pass
+st.markdown("---")
+
+# --- 3. 批次 CSV 評分區 ---
+st.header("📂 批次 CSV 評分")
+st.caption(f"上傳含 Time、Amount、V1~V28 欄位的 CSV，每 {BATCH_CHUNK_ROWS} 筆一批送到 API，"
+           f"最多 {BATCH_CONCURRENCY} 批同時處理；結果直接寫入伺服器端暫存檔，完成後可下載。")
+
+uploaded_csv = st.file_uploader("選擇 CSV 檔案", type=["csv"])
+
+if uploaded_csv is not None and st.button("開始批次評分"):
+    # 以換行數估計總筆數 (扣除標頭)，只用於進度條
+    total_rows = max(sum(block.count(b"\n") for block in iter(lambda: uploaded_csv.read(1 << 20), b"")) - 1, 1)
+    uploaded_csv.seek(0)
+
+    # 刪除這個 session 上一次的結果，以及其他已結束 session 留下的過期結果
+    remove_batch_result(st.session_state.pop("batch_result_path", None))
+    st.session_state.pop("batch_result_stats", None)
+    st.session_state.pop("batch_result_name", None)
+    cleanup_batch_results(BATCH_RESULTS_DIR, BATCH_RESULTS_TTL_SECONDS)
+
+    # 伺服器端檔名由 mkstemp 產生，不使用客戶端提供的檔名 (可能含 ../ 或特殊字元)
+    os.makedirs(BATCH_RESULTS_DIR, exist_ok=True)
+    fd, output_path = tempfile.mkstemp(dir=BATCH_RESULTS_DIR, prefix="scored_", suffix=".csv")
+    os.close(fd)
+
+    progress_bar = st.progress(0.0, text="評分中...")
+    col1, col2, col3 = st.columns(3)
+    rows_metric, fraud_metric, failed_metric = col1.empty(), col2.empty(), col3.empty()
+
+    def show_batch_progress(stats):
+        progress_bar.progress(min(stats["rows"] / total_rows, 1.0),
+                              text=f"評分中... {stats['rows']:,} / ~{total_rows:,} 筆")
+        rows_metric.metric("已評分筆數", f"{stats['rows']:,}")
+        fraud_metric.metric("詐欺筆數", f"{stats['fraud']:,}")
+        failed_metric.metric("失敗筆數", f"{stats['failed_rows']:,}")
+
+    try:
+        batch_stats = score_csv_file(uploaded_csv, output_path, show_batch_progress)
+        progress_bar.progress(1.0, text="評分完成")
+        # session_state 只保存結果檔路徑，不保存評分結果本身
+        st.session_state["batch_result_path"] = output_path
+        st.session_state["batch_result_name"] = f"scored_{os.path.basename(uploaded_csv.name)}"
+        st.session_state["batch_result_stats"] = {k: v for k, v in batch_stats.items() if k != "errors"}
+        if batch_stats["errors"]:
+            st.warning(f"⚠️ {len(batch_stats['errors'])} 批評分失敗 (結果中以空值表示)，第一個錯誤: {batch_stats['errors'][0]}")
+    except ValueError as e:
+        remove_batch_result(output_path)
+        st.error(str(e))
+
+batch_result_path = st.session_state.get("batch_result_path")
+if batch_result_path and os.path.exists(batch_result_path):
+    batch_result_stats = st.session_state.get("batch_result_stats", {})
+    st.success(f"✅ 共評分 {batch_result_stats.get('rows', 0):,} 筆，其中 {batch_result_stats.get('fraud', 0):,} 筆判斷為詐欺")
+    with open(batch_result_path, "rb") as result_file:
+        st.download_button("下載評分結果", data=result_file, file_name=st.session_state.get("batch_result_name", "scored.csv"),
+                           mime="text/csv")
@@ -0,0 +1,245 @@
+# src/dashboard/pages/score_explorer.py
+"""
+評分瀏覽頁：查詢 Postgres transaction_scores 中的批次評分結果
+
+篩選、排序、彙總 (每小時 / 金額區間的筆數與詐欺率) 與分頁全部在 SQL 端完成，
+頁面只取回一頁資料與彙總結果；分頁使用 keyset (排序欄位, transaction_id)，
+翻到第幾頁都只需走索引讀取 PAGE_SIZE 筆，不受表大小影響。
+查詢結果依篩選條件快取 EXPLORER_CACHE_SECONDS 秒。
+"""
+import math
+import os
+import time as time_module
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import create_engine, text
+
+# --- 資料庫設定 ---
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'fraud_db')
+DB_USER = os.getenv('DB_USER', 'user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_PORT = os.getenv('DB_PORT', '5432')
+DATABASE_URL = os.getenv(
+    'DATABASE_URL', f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+SCORES_TABLE_NAME = 'transaction_scores'
+
+# --- 瀏覽頁設定 ---
+EXPLORER_PAGE_SIZE = int(os.getenv('EXPLORER_PAGE_SIZE', '100'))
+EXPLORER_CACHE_SECONDS = int(os.getenv('EXPLORER_CACHE_SECONDS', '60'))
+# 預設時間窗 (小時)，避免第一次開啟就彙總整張表
+EXPLORER_DEFAULT_WINDOW_HOURS = int(os.getenv('EXPLORER_DEFAULT_WINDOW_HOURS', '24'))
+# 單一查詢的時間上限，避免過寬的篩選拖垮資料庫
+EXPLORER_STATEMENT_TIMEOUT_MS = int(os.getenv('EXPLORER_STATEMENT_TIMEOUT_MS', '5000'))
+# 金額區間邊界，最後一個區間為 >= 最後一個邊界
+AMOUNT_BUCKET_EDGES = [0, 10, 50, 100, 250, 500, 1000, 5000]
+SORT_COLUMNS = {"時間": "time", "詐欺機率": "fraud_probability"}
+
+st.set_page_config(page_title="評分瀏覽", layout="wide")
+
+
+@st.cache_resource
+def get_engine():
+    """瀏覽頁共用的連線池。"""
+    return create_engine(
+        DATABASE_URL,
+        pool_size=5,
+        pool_pre_ping=True,
+        connect_args={"options": f"-c statement_timeout={EXPLORER_STATEMENT_TIMEOUT_MS}"},
+    )
+
+
+def run_query(sql, params):
+    with get_engine().connect() as connection:
+        return pd.read_sql(text(sql), connection, params=params)
+
+
+@st.cache_data(ttl=EXPLORER_CACHE_SECONDS)
+def get_run_ids():
+    """列出已評分的模型 run；以遞迴 CTE 沿主鍵索引跳躍掃描，不需掃過整張表。"""
+    df = run_query(f"""
+        WITH RECURSIVE runs AS (
+            SELECT MIN(run_id) AS run_id FROM {SCORES_TABLE_NAME}
+            UNION ALL
+            SELECT (SELECT MIN(run_id) FROM {SCORES_TABLE_NAME} WHERE run_id > runs.run_id)
+            FROM runs WHERE runs.run_id IS NOT NULL
+        )
+        SELECT run_id FROM runs WHERE run_id IS NOT NULL
+    """, {})
+    return df["run_id"].tolist()
+
+
+@st.cache_data(ttl=EXPLORER_CACHE_SECONDS)
+def get_time_bounds(run_id):
+    """回傳該 run 的 (最小 time, 最大 time)，走 (run_id, time) 索引。"""
+    df = run_query(
+        f"SELECT MIN(time) AS time_min, MAX(time) AS time_max FROM {SCORES_TABLE_NAME} WHERE run_id = :run_id",
+        {"run_id": run_id}
+    )
+    return float(df.at[0, "time_min"]), float(df.at[0, "time_max"])
+
+
+def build_filter_sql(filters):
+    """將篩選條件轉成 WHERE 子句與參數；filters 為可雜湊的 tuple 以便作為快取鍵。"""
+    run_id, time_start, time_end, amount_min, amount_max, prob_min, prob_max, fraud_only = filters
+    clauses = [
+        "run_id = :run_id",
+        "time >= :time_start", "time < :time_end",
+        "fraud_probability >= :prob_min", "fraud_probability <= :prob_max",
+    ]
+    params = {"run_id": run_id, "time_start": time_start, "time_end": time_end,
+              "prob_min": prob_min, "prob_max": prob_max}
+    if amount_min is not None:
+        clauses.append("amount >= :amount_min")
+        params["amount_min"] = amount_min
+    if amount_max is not None:
+        clauses.append("amount <= :amount_max")
+        params["amount_max"] = amount_max
+    if fraud_only:
+        clauses.append("is_fraud = 1")
+    return " AND ".join(clauses), params
+
+
+def amount_bucket_label(bucket):
+    if pd.isna(bucket):
+        return "未知"
+    bucket = int(bucket)
+    if bucket >= len(AMOUNT_BUCKET_EDGES):
+        return f"≥{AMOUNT_BUCKET_EDGES[-1]}"
+    return f"{AMOUNT_BUCKET_EDGES[bucket - 1]}–{AMOUNT_BUCKET_EDGES[bucket]}"
+
+
+@st.cache_data(ttl=EXPLORER_CACHE_SECONDS)
+def get_summaries(filters):
+    """回傳 (每小時彙總, 金額區間彙總)：筆數、詐欺筆數與詐欺率。
+
+    兩種彙總以 GROUPING SETS 在同一次掃描中完成，成本取決於時間窗內的筆數而非整張表。
+    """
+    where, params = build_filter_sql(filters)
+    params["edges"] = [float(edge) for edge in AMOUNT_BUCKET_EDGES]
+    df = run_query(f"""
+        SELECT FLOOR(time / 3600)::int AS hour,
+               WIDTH_BUCKET(amount, CAST(:edges AS DOUBLE PRECISION[])) AS bucket,
+               GROUPING(FLOOR(time / 3600)::int) AS by_amount,
+               COUNT(*) AS transactions, SUM(is_fraud) AS fraud, AVG(fraud_probability) AS avg_probability
+        FROM {SCORES_TABLE_NAME}
+        WHERE {where}
+        GROUP BY GROUPING SETS ((FLOOR(time / 3600)::int), (WIDTH_BUCKET(amount, CAST(:edges AS DOUBLE PRECISION[]))))
+    """, params)
+    df["fraud_rate"] = df["fraud"] / df["transactions"]
+
+    hourly = df[df["by_amount"] == 0].sort_values("hour")
+    hourly = hourly.astype({"hour": int}).set_index("hour")[["transactions", "fraud", "fraud_rate", "avg_probability"]]
+    by_amount = df[df["by_amount"] == 1].sort_values("bucket", na_position="last")
+    by_amount = by_amount.assign(amount_range=by_amount["bucket"].map(amount_bucket_label))
+    return hourly, by_amount[["amount_range", "transactions", "fraud", "fraud_rate"]]
+
+
+@st.cache_data(ttl=EXPLORER_CACHE_SECONDS)
+def get_page(filters, sort_column, descending, cursor):
+    """以 keyset 分頁取回一頁資料；cursor 為上一頁最後一列的 (排序欄位值, transaction_id)，None 表示第一頁。
+
+    多取一筆以判斷是否還有下一頁。
+    """
+    where, params = build_filter_sql(filters)
+    direction = "DESC" if descending else "ASC"
+    if cursor is not None:
+        where += f" AND ({sort_column}, transaction_id) {'<' if descending else '>'} (:cursor_value, :cursor_id)"
+        params.update({"cursor_value": cursor[0], "cursor_id": cursor[1]})
+    params["limit"] = EXPLORER_PAGE_SIZE + 1
+    df = run_query(f"""
+        SELECT transaction_id, time, amount, fraud_probability, is_fraud, threshold, scored_at
+        FROM {SCORES_TABLE_NAME}
+        WHERE {where}
+        ORDER BY {sort_column} {direction}, transaction_id {direction}
+        LIMIT :limit
+    """, params)
+    has_next = len(df) > EXPLORER_PAGE_SIZE
+    return df.head(EXPLORER_PAGE_SIZE), has_next
+
+
+# --- 介面呈現 ---
+
+st.title("🔎 批次評分瀏覽")
+
+try:
+    run_ids = get_run_ids()
+except Exception as e:
+    st.error(f"無法連線到評分資料庫 ({DB_HOST}/{DB_NAME}): {e}")
+    st.stop()
+
+if not run_ids:
+    st.info(f"{SCORES_TABLE_NAME} 尚無評分資料，請先執行批次評分。")
+    st.stop()
+
+with st.sidebar:
+    st.header("篩選條件")
+    run_id = st.selectbox("模型 run", run_ids)
+    time_min, time_max = get_time_bounds(run_id)
+    hour_min, hour_max = math.floor(time_min / 3600), math.floor(time_max / 3600) + 1
+    hour_range = st.slider(
+        "時間窗 (小時)", min_value=hour_min, max_value=hour_max,
+        value=(max(hour_min, hour_max - EXPLORER_DEFAULT_WINDOW_HOURS), hour_max)
+    )
+    col1, col2 = st.columns(2)
+    amount_min = col1.number_input("最低金額", min_value=0.0, value=None, step=10.0)
+    amount_max = col2.number_input("最高金額", min_value=0.0, value=None, step=10.0)
+    prob_range = st.slider("詐欺機率區間", 0.0, 1.0, (0.0, 1.0), step=0.01)
+    fraud_only = st.checkbox("只顯示判定為詐欺")
+    sort_label = st.selectbox("排序", list(SORT_COLUMNS))
+    descending = st.toggle("由大到小", value=True)
+
+filters = (
+    run_id, float(hour_range[0] * 3600), float(hour_range[1] * 3600),
+    amount_min, amount_max, float(prob_range[0]), float(prob_range[1]), fraud_only,
+)
+sort_column = SORT_COLUMNS[sort_label]
+
+# 篩選或排序變更時回到第一頁；cursors 保存已瀏覽各頁的起始游標，供上一頁使用
+page_key = (filters, sort_column, descending)
+if st.session_state.get("explorer_page_key") != page_key:
+    st.session_state["explorer_page_key"] = page_key
+    st.session_state["explorer_cursors"] = [None]
+
+query_start = time_module.perf_counter()
+try:
+    hourly, by_amount = get_summaries(filters)
+    cursors = st.session_state["explorer_cursors"]
+    page, has_next = get_page(filters, sort_column, descending, cursors[-1])
+except Exception as e:
+    st.error(f"查詢失敗 (可能超過 {EXPLORER_STATEMENT_TIMEOUT_MS} ms 上限，請縮小時間窗): {e}")
+    st.stop()
+query_ms = (time_module.perf_counter() - query_start) * 1000
+
+total = int(hourly["transactions"].sum()) if not hourly.empty else 0
+fraud = int(hourly["fraud"].sum()) if not hourly.empty else 0
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("符合筆數", f"{total:,}")
+col2.metric("詐欺筆數", f"{fraud:,}")
+col3.metric("詐欺率", f"{fraud / total:.3%}" if total else "-")
+col4.metric("查詢耗時", f"{query_ms:.0f} ms")
+
+st.subheader("每小時交易量與詐欺率")
+if hourly.empty:
+    st.info("沒有符合條件的評分。")
+else:
+    col1, col2 = st.columns(2)
+    col1.bar_chart(hourly[["transactions"]])
+    col2.line_chart(hourly[["fraud_rate"]])
+
+    st.subheader("金額區間")
+    st.dataframe(by_amount, use_container_width=True, hide_index=True)
+
+st.subheader(f"交易明細 (第 {len(cursors)} 頁，每頁 {EXPLORER_PAGE_SIZE} 筆)")
+st.dataframe(page, use_container_width=True, hide_index=True)
+
+col1, col2, _ = st.columns([1, 1, 6])
+if col1.button("⬅️ 上一頁", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+if col2.button("下一頁 ➡️", disabled=not has_next):
+    last = page.iloc[-1]
+    cursors.append((float(last[sort_column]), int(last["transaction_id"])))
+    st.rerun()
@@ -0,0 +1,160 @@
+# src/etl/backfill.py
+"""
+分區平行回填 (backfill)
+
+修正資料或評分邏輯後，只重算指定時間範圍：將範圍切成固定寬度 (預設一天) 的分區，
+每個分區在自己的資料庫交易中重載 raw_transactions 並重新評分 transaction_scores，
+範圍外的資料完全不受影響。每個階段內最多 parallelism 個分區同時執行，
+因此回填 N 天約等於 (N / parallelism) 天的單日執行時間。
+
+回填分兩個階段：先重載所有分區，全部完成後才開始評分。速度特徵會讀取前 max(windows) 秒的交易作為參考流，
+分區開頭的參考流落在前一個分區內；若重載與評分在分區之間交錯，邊界附近的評分會依執行順序採用
+相鄰分區修正前或修正後的資料，結果不固定。
+
+feature_transactions 是 raw_transactions 上的視圖，重載後自動反映，不需另外重算。
+"""
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import create_engine
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from etl.db_load import read_time_range, reload_time_range, DATABASE_URL, RAW_DATA_PATH
+from etl.batch_scoring import (
+    delete_scores, ensure_scores_table, find_serving_run_id, load_scoring_model, run_batch_scoring
+)
+
+BACKFILL_PARALLELISM = int(os.getenv('BACKFILL_PARALLELISM', '4'))
+# 分區寬度 (秒)，time 欄位以秒為單位
+BACKFILL_PARTITION_SECONDS = float(os.getenv('BACKFILL_PARTITION_SECONDS', '86400'))
+
+
+def plan_backfill_partitions(time_start, time_end, partition_seconds=BACKFILL_PARTITION_SECONDS):
+    """將 [time_start, time_end) 依固定寬度切成互不重疊的分區 (最後一個分區可能較短)。"""
+    if time_end <= time_start:
+        raise ValueError(f"回填範圍無效: [{time_start}, {time_end})")
+    if partition_seconds <= 0:
+        raise ValueError(f"分區寬度必須大於 0，收到: {partition_seconds}")
+
+    n_partitions = math.ceil((time_end - time_start) / partition_seconds)
+    return [
+        {
+            "time_start": float(time_start + i * partition_seconds),
+            "time_end": float(min(time_start + (i + 1) * partition_seconds, time_end)),
+        }
+        for i in range(n_partitions)
+    ]
+
+
+def _slice_time_range(df, time_start, time_end):
+    if df is None:
+        return None
+    return df[(df['time'] >= time_start) & (df['time'] < time_end)]
+
+
+def backfill_partition(time_start, time_end, model_run_id=None, database_url=None, tracking_uri=None,
+                       data_path=RAW_DATA_PATH, reload_raw=True, rescore=True, scoring_model=None, df_range=None):
+    """回填單一分區：重載該時間範圍的原始交易，刪除並重算同一模型的評分，回傳統計。
+
+    df_range 為已讀取的該分區原始資料 (本機回填時由 run_backfill 一次讀取後切分)。
+    同時回填多個分區時，請先以 rescore=False 重載所有分區，再以 reload_raw=False 評分 (見模組說明)。
+    """
+    database_url = database_url or DATABASE_URL
+    start = time.perf_counter()
+    result = {"time_start": time_start, "time_end": time_end, "reloaded_rows": 0, "scored_rows": 0}
+
+    if reload_raw:
+        result["reloaded_rows"] = reload_time_range(time_start, time_end, database_url, data_path, df_range)
+
+    if rescore:
+        if scoring_model is None:
+            scoring_model = load_scoring_model(model_run_id or find_serving_run_id(tracking_uri), tracking_uri)
+        engine = create_engine(database_url)
+        ensure_scores_table(engine)
+        deleted = delete_scores(engine, scoring_model.run_id, time_start, time_end)
+        print(f"已刪除 time [{time_start:.0f}, {time_end:.0f}) 的 {deleted} 筆舊評分")
+        result["scored_rows"] = run_batch_scoring(
+            time_start, time_end, database_url=database_url, scoring_model=scoring_model
+        )
+
+    result["wall_seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_backfill(time_start, time_end, parallelism=BACKFILL_PARALLELISM, partition_seconds=BACKFILL_PARTITION_SECONDS,
+                 model_run_id=None, database_url=None, tracking_uri=None, data_path=RAW_DATA_PATH,
+                 reload_raw=True, rescore=True):
+    """在本機平行回填整個範圍：先重載所有分區，再評分所有分區 (每個階段最多 parallelism 個分區同時執行)。
+
+    模型只載入一次、CSV 只解析一次，各分區共用；CSV 解析會持有 GIL，每個分區各自讀取會抵銷平行效果。
+    """
+    partitions = plan_backfill_partitions(time_start, time_end, partition_seconds)
+    df_all = read_time_range(data_path, time_start, time_end) if reload_raw else None
+    scoring_model = None
+    if rescore:
+        scoring_model = load_scoring_model(model_run_id or find_serving_run_id(tracking_uri), tracking_uri)
+
+    print(f"🔁 回填 time [{time_start:.0f}, {time_end:.0f})：{len(partitions)} 個分區，平行度 {parallelism}")
+    start = time.perf_counter()
+    results = {
+        p["time_start"]: {**p, "reloaded_rows": 0, "scored_rows": 0, "wall_seconds": 0.0} for p in partitions
+    }
+    # 兩階段：所有分區重載完成後才開始評分，分區開頭的速度特徵才會一律讀到重載後的前一個分區
+    phases = []
+    if reload_raw:
+        phases.append({"reload_raw": True, "rescore": False})
+    if rescore:
+        phases.append({"reload_raw": False, "rescore": True})
+    # 本機以執行緒平行 (資料庫 I/O 期間會釋放 GIL)；Airflow 上每個分區是獨立行程的映射任務，不受 GIL 限制
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        for phase in phases:
+            futures = [
+                executor.submit(
+                    backfill_partition, p["time_start"], p["time_end"],
+                    database_url=database_url, tracking_uri=tracking_uri, data_path=data_path,
+                    scoring_model=scoring_model, **phase,
+                    df_range=_slice_time_range(df_all, p["time_start"], p["time_end"]) if phase["reload_raw"] else None
+                )
+                for p in partitions
+            ]
+            for future in as_completed(futures):
+                partial = future.result()
+                merged = results[partial["time_start"]]
+                for key in ("reloaded_rows", "scored_rows", "wall_seconds"):
+                    merged[key] += partial[key]
+
+    wall_seconds = time.perf_counter() - start
+    results = sorted(results.values(), key=lambda r: r["time_start"])
+    serial_seconds = sum(r["wall_seconds"] for r in results)
+    print(f"✅ 回填完成：重載 {sum(r['reloaded_rows'] for r in results)} 筆、評分 {sum(r['scored_rows'] for r in results)} 筆，"
+          f"耗時 {wall_seconds:.1f} 秒 (各分區耗時合計 {serial_seconds:.1f} 秒)")
+    return results
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="分區平行回填 raw_transactions 與 transaction_scores")
+    parser.add_argument("--time-start", type=float, required=True, help="回填起始 time (含)")
+    parser.add_argument("--time-end", type=float, required=True, help="回填結束 time (不含)")
+    parser.add_argument("--parallelism", type=int, default=BACKFILL_PARALLELISM, help="同時處理的分區數")
+    parser.add_argument("--partition-seconds", type=float, default=BACKFILL_PARTITION_SECONDS, help="分區寬度 (秒)")
+    parser.add_argument("--model-run-id", help="重算評分使用的模型 run (預設為最新的 selected_for_serving)")
+    parser.add_argument("--skip-reload", action="store_true", help="不重載原始交易，只重算評分")
+    parser.add_argument("--skip-rescore", action="store_true", help="只重載原始交易，不重算評分")
+    args = parser.parse_args()
+
+    run_backfill(
+        args.time_start, args.time_end,
+        parallelism=args.parallelism,
+        partition_seconds=args.partition_seconds,
+        model_run_id=args.model_run_id,
+        reload_raw=not args.skip_reload,
+        rescore=not args.skip_rescore
+    )
+
+
+if __name__ == "__main__":
+    main()
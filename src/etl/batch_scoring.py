@@ -0,0 +1,310 @@
+# src/etl/batch_scoring.py
+"""
+批次評分：以選定的服務模型為 raw_transactions 中的交易評分並寫回 Postgres
+
+- 每個任務只載入一次模型 (優先使用精簡服務格式)，以大批次向量化推論
+- 結果以 COPY 批量寫入 transaction_scores，並記錄模型 run_id 與決策門檻
+- 依 transaction_id 水位 (watermark) 續跑：每個批次寫入後立即 commit，
+  任務中斷重跑時只會處理水位之後尚未評分的交易
+- 依 time 切分成互不重疊的區間，可由 Airflow 映射任務平行評分
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from models.serving_artifact import load_serving_artifact
+from models.velocity_features import add_velocity_features, parse_velocity_windows
+
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'fraud_db')
+DB_USER = os.getenv('DB_USER', 'user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_PORT = '5432'
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+MLFLOW_TRACKING_URI = os.getenv('MLFLOW_TRACKING_URI', 'http://localhost:5000')
+
+RAW_TABLE_NAME = 'raw_transactions'
+SCORES_TABLE_NAME = 'transaction_scores'
+EXPERIMENT_NAME = "Fraud Detection Baseline"
+SERVING_ARTIFACT_PATH = "serving"
+# 與訓練端 transform_data.DECISION_THRESHOLD 一致；精簡服務格式會在 manifest 中帶自己的門檻
+DEFAULT_THRESHOLD = 0.5
+
+SCORING_CHUNK_SIZE = int(os.getenv('SCORING_CHUNK_SIZE', '50000'))
+SCORING_PARTITIONS = int(os.getenv('SCORING_PARTITIONS', '4'))
+
+SCORE_COLUMNS = ["transaction_id", "time", "amount", "fraud_probability", "is_fraud", "run_id", "threshold"]
+
+CREATE_SCORES_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SCORES_TABLE_NAME} (
+    transaction_id BIGINT NOT NULL,
+    time DOUBLE PRECISION NOT NULL,
+    amount DOUBLE PRECISION,
+    fraud_probability DOUBLE PRECISION NOT NULL,
+    is_fraud SMALLINT NOT NULL,
+    run_id TEXT NOT NULL,
+    threshold DOUBLE PRECISION NOT NULL,
+    scored_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_id, transaction_id)
+);
+-- 依 run 與時間範圍查詢；transaction_id 讓同一時間的列有固定順序 (也是評分瀏覽頁依時間 keyset 分頁的索引)
+CREATE INDEX IF NOT EXISTS idx_{SCORES_TABLE_NAME}_run_time_id ON {SCORES_TABLE_NAME} (run_id, time, transaction_id);
+-- 評分瀏覽頁依機率排序時的 keyset 分頁
+CREATE INDEX IF NOT EXISTS idx_{SCORES_TABLE_NAME}_run_prob_id ON {SCORES_TABLE_NAME} (run_id, fraud_probability, transaction_id);
+"""
+
+
+class ScoringModel:
+    """批次評分用的模型包裝：predict_proba 接收 DataFrame 回傳一維詐欺機率。"""
+
+    def __init__(self, run_id, predict_fn, threshold, serving_path, feature_order=()):
+        self.run_id = run_id
+        self.threshold = threshold
+        self.serving_path = serving_path
+        # 模型使用的速度特徵視窗 (未使用時為空)，評分前需先以回溯區間計算
+        self.velocity_windows = parse_velocity_windows(feature_order)
+        self._predict_fn = predict_fn
+
+    def predict_proba(self, df):
+        return self._predict_fn(df)
+
+
+def find_serving_run_id(tracking_uri=None):
+    """回傳最新一次標記為 selected_for_serving 的訓練 run_id。"""
+    import mlflow
+
+    mlflow.set_tracking_uri(tracking_uri or MLFLOW_TRACKING_URI)
+    client = mlflow.tracking.MlflowClient()
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    if experiment is None:
+        raise RuntimeError(f"找不到 MLflow 實驗: {EXPERIMENT_NAME}")
+    runs = client.search_runs(
+        experiment_ids=[experiment.experiment_id],
+        filter_string="tags.selected_for_serving = 'true'",
+        order_by=["attributes.start_time DESC"],
+        max_results=1
+    )
+    if not runs:
+        raise RuntimeError("沒有標記為 selected_for_serving 的模型，請先執行訓練與模型選擇")
+    return runs[0].info.run_id
+
+
+def load_scoring_model(run_id, tracking_uri=None):
+    """載入 run 的模型：優先使用精簡服務格式，沒有時退回 MLflow sklearn 模型。"""
+    import mlflow
+
+    mlflow.set_tracking_uri(tracking_uri or MLFLOW_TRACKING_URI)
+    run = mlflow.tracking.MlflowClient().get_run(run_id)
+
+    if run.data.tags.get('serving_artifact_version'):
+        local_path = mlflow.artifacts.download_artifacts(
+            run_id=run_id,
+            artifact_path=SERVING_ARTIFACT_PATH,
+            dst_path=tempfile.mkdtemp(prefix="batch_scoring_")
+        )
+        compact_model = load_serving_artifact(local_path, run_id=run_id)
+        return ScoringModel(
+            run_id,
+            lambda df: compact_model.predict_proba(compact_model.vectorize(df)),
+            compact_model.threshold,
+            "compact",
+            compact_model.feature_order
+        )
+
+    import mlflow.sklearn
+    model = mlflow.sklearn.load_model(f"runs:/{run_id}/model")
+    feature_order = list(getattr(model, 'feature_names_in_', []))
+    return ScoringModel(
+        run_id,
+        lambda df: model.predict_proba(df[feature_order] if feature_order else df)[:, 1],
+        DEFAULT_THRESHOLD,
+        "native",
+        feature_order
+    )
+
+
+def ensure_scores_table(engine):
+    """建立 transaction_scores 表 (已存在則略過)。"""
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_SCORES_TABLE_SQL))
+
+
+def get_time_bounds(engine):
+    """回傳 raw_transactions 的 (最小 time, 最大 time)；沒有資料時回傳 (None, None)。"""
+    with engine.connect() as connection:
+        row = connection.execute(text(f"SELECT MIN(time), MAX(time) FROM {RAW_TABLE_NAME}")).fetchone()
+    return row[0], row[1]
+
+
+def split_time_range(time_start, time_end, n_partitions):
+    """將 [time_start, time_end) 均分為 n_partitions 個互不重疊的區間。"""
+    if time_end <= time_start:
+        return []
+    n_partitions = max(1, int(n_partitions))
+    step = (time_end - time_start) / n_partitions
+    edges = [time_start + step * i for i in range(n_partitions)] + [time_end]
+    return [{"time_start": float(edges[i]), "time_end": float(edges[i + 1])} for i in range(n_partitions)]
+
+
+def plan_scoring_partitions(database_url=None, n_partitions=SCORING_PARTITIONS):
+    """依 raw_transactions 的 time 範圍規劃評分區間 (最後一個區間包含最大 time)。"""
+    engine = create_engine(database_url or DATABASE_URL)
+    min_time, max_time = get_time_bounds(engine)
+    if min_time is None:
+        return []
+    # 區間為左閉右開，將上界推到最大 time 之後，確保最後一筆交易被涵蓋
+    return split_time_range(float(min_time), float(max_time) + 1, n_partitions)
+
+
+def get_watermark(connection, run_id, time_start, time_end):
+    """回傳該模型在時間區間內已評分的最大 transaction_id (尚未評分則為 -1)。"""
+    watermark = connection.execute(
+        text(f"""
+            SELECT MAX(transaction_id) FROM {SCORES_TABLE_NAME}
+            WHERE run_id = :run_id AND time >= :time_start AND time < :time_end
+        """),
+        {"run_id": run_id, "time_start": time_start, "time_end": time_end}
+    ).scalar()
+    return -1 if watermark is None else int(watermark)
+
+
+def copy_scores(engine, scores):
+    """以 COPY 批量寫入評分結果並 commit (一個批次一個交易，確保水位與資料一致)。"""
+    buffer = io.StringIO()
+    scores[SCORE_COLUMNS].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {SCORES_TABLE_NAME} ({', '.join(SCORE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def delete_scores(engine, run_id, time_start, time_end):
+    """刪除該模型在時間區間內的評分 (回填重算時使用)，回傳刪除筆數。"""
+    with engine.begin() as connection:
+        result = connection.execute(
+            text(f"""
+                DELETE FROM {SCORES_TABLE_NAME}
+                WHERE run_id = :run_id AND time >= :time_start AND time < :time_end
+            """),
+            {"run_id": run_id, "time_start": time_start, "time_end": time_end}
+        )
+    return result.rowcount
+
+
+def add_chunk_velocity_features(connection, chunk, windows):
+    """為一個評分批次計算速度特徵：讀取 (最早 time - 最大視窗, 最晚 time) 內的所有交易作為參考流，
+    分塊與分區邊界的結果與訓練時對完整資料的計算一致。"""
+    reference = pd.read_sql(
+        text(f"SELECT time, amount FROM {RAW_TABLE_NAME} WHERE time > :time_start AND time < :time_end"),
+        connection,
+        params={"time_start": float(chunk["time"].min()) - max(windows), "time_end": float(chunk["time"].max())}
+    )
+    return add_velocity_features(chunk, windows, reference=reference)
+
+
+def score_partition(engine, scoring_model, time_start, time_end, chunk_size=SCORING_CHUNK_SIZE):
+    """為 [time_start, time_end) 中水位之後的交易評分，回傳本次寫入筆數。"""
+    with engine.connect() as connection:
+        watermark = get_watermark(connection, scoring_model.run_id, time_start, time_end)
+    if watermark >= 0:
+        print(f"↪️  區間 [{time_start:.0f}, {time_end:.0f}) 從 transaction_id > {watermark} 續跑")
+
+    query = text(f"""
+        SELECT * FROM {RAW_TABLE_NAME}
+        WHERE time >= :time_start AND time < :time_end AND transaction_id > :watermark
+        ORDER BY transaction_id
+        LIMIT :chunk_size
+    """)
+
+    total = 0
+    while True:
+        start = time.perf_counter()
+        with engine.connect() as connection:
+            chunk = pd.read_sql(query, connection, params={
+                "time_start": time_start, "time_end": time_end,
+                "watermark": watermark, "chunk_size": chunk_size,
+            })
+            if not chunk.empty and scoring_model.velocity_windows:
+                chunk = add_chunk_velocity_features(connection, chunk, scoring_model.velocity_windows)
+        if chunk.empty:
+            break
+
+        proba = scoring_model.predict_proba(chunk)
+        scores = pd.DataFrame({
+            "transaction_id": chunk["transaction_id"].to_numpy(),
+            "time": chunk["time"].to_numpy(),
+            "amount": chunk["amount"].to_numpy(),
+            "fraud_probability": proba,
+            "is_fraud": (proba > scoring_model.threshold).astype(int),
+            "run_id": scoring_model.run_id,
+            "threshold": scoring_model.threshold,
+        })
+        copy_scores(engine, scores)
+
+        watermark = int(chunk["transaction_id"].iloc[-1])
+        total += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"   已評分 {len(chunk)} 筆 (累計 {total}，{len(chunk) / max(elapsed, 1e-9):.0f} rows/s)")
+
+        if len(chunk) < chunk_size:
+            break
+    return total
+
+
+def run_batch_scoring(time_start=None, time_end=None, model_run_id=None, database_url=None, tracking_uri=None,
+                      chunk_size=SCORING_CHUNK_SIZE, scoring_model=None):
+    """載入服務模型一次，為指定時間區間 (預設全部) 的交易評分並寫入 transaction_scores。
+
+    傳入已載入的 scoring_model 時不再重新載入 (回填在同一行程內處理多個區間時共用)。
+    """
+    engine = create_engine(database_url or DATABASE_URL)
+    ensure_scores_table(engine)
+
+    if scoring_model is None:
+        model_run_id = model_run_id or find_serving_run_id(tracking_uri)
+        scoring_model = load_scoring_model(model_run_id, tracking_uri)
+    model_run_id = scoring_model.run_id
+    print(f"🤖 使用模型 run {model_run_id} ({scoring_model.serving_path})，門檻 {scoring_model.threshold}")
+
+    if time_start is None or time_end is None:
+        min_time, max_time = get_time_bounds(engine)
+        if min_time is None:
+            print("raw_transactions 沒有資料，略過評分")
+            return 0
+        time_start = float(min_time) if time_start is None else time_start
+        time_end = float(max_time) + 1 if time_end is None else time_end
+
+    start = time.perf_counter()
+    total = score_partition(engine, scoring_model, time_start, time_end, chunk_size)
+    print(f"✅ 區間 [{time_start:.0f}, {time_end:.0f}) 共評分 {total} 筆，耗時 {time.perf_counter() - start:.1f} 秒")
+    return total
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="以服務模型批次評分 raw_transactions")
+    parser.add_argument("--time-start", type=float, help="起始 time (含)")
+    parser.add_argument("--time-end", type=float, help="結束 time (不含)")
+    parser.add_argument("--model-run-id", help="指定模型 run (預設為最新的 selected_for_serving)")
+    parser.add_argument("--chunk-size", type=int, default=SCORING_CHUNK_SIZE, help="每批評分筆數")
+    args = parser.parse_args()
+
+    run_batch_scoring(args.time_start, args.time_end, args.model_run_id, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
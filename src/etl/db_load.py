@@ -1,7 +1,12 @@
 # src/etl/db_load.py
+import io
 import pandas as pd
 from sqlalchemy import create_engine, text
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from etl.telemetry import record_task
 
 # --- 資料庫連線參數 ---
 # 從環境變數讀取，提供本地預設值
@@ -18,13 +23,19 @@ DATABASE_URL = f"{DB_TYPE}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAM
 RAW_DATA_PATH = os.getenv('DATA_PATH', '/opt/airflow/data/creditcard.csv')  # Airflow 容器路徑
 RAW_TABLE_NAME = 'raw_transactions'
 FEATURE_VIEW_NAME = 'feature_transactions' 
+# 區間重載時分批讀取 CSV 的列數
+RELOAD_CHUNK_ROWS = int(os.getenv('RELOAD_CHUNK_ROWS', '100000'))
 
-def connect_and_load_data():
-    """連線到 Postgres 並將原始 CSV 載入到 raw_transactions 表中。"""
-    try:
+def load_raw_data(database_url=DATABASE_URL, data_path=RAW_DATA_PATH, pipeline_run_id=None):
+    """將原始 CSV 載入到 raw_transactions 表並創建特徵視圖，回傳寫入筆數；失敗時拋出例外。
+
+    可由 Airflow PythonOperator 在行程內直接呼叫，database_url 由 Connection 提供。
+    執行時間、筆數與讀取 bytes 記錄到 pipeline_runs (task=load_raw_data)。
+    """
+    with record_task("load_raw_data", database_url, pipeline_run_id) as telemetry:
         # 建立連線引擎
-        engine = create_engine(DATABASE_URL)
-        print(f"成功連線到資料庫：{DB_NAME}")
+        engine = create_engine(database_url)
+        print(f"成功連線到資料庫：{engine.url.database}")
 
         with engine.connect() as connection:
             # 使用 IF EXISTS 確保即使 VIEW 不存在也不會報錯
@@ -35,24 +46,96 @@ def connect_and_load_data():
             print(f"已清理舊的 {FEATURE_VIEW_NAME} 視圖依賴。")
 
         # 1. 載入 CSV 數據
-        print(f"正在載入原始數據：{RAW_DATA_PATH}")
-        df_raw = pd.read_csv(RAW_DATA_PATH)
-        
+        print(f"正在載入原始數據：{data_path}")
+        telemetry["bytes_read"] = os.path.getsize(data_path)
+        df_raw = pd.read_csv(data_path)
+
         # 為了 SQL 方便，將欄位名稱轉為小寫
         df_raw.columns = [col.lower() for col in df_raw.columns]
+        # 以 CSV 列號作為 transaction_id：重新載入同一份資料時保持不變，供批次評分結果對應
+        df_raw.index.name = 'transaction_id'
 
         # 2. 寫入資料庫
         print(f"正在將 {len(df_raw)} 筆數據寫入 {RAW_TABLE_NAME} 表...")
-        
+
         # 使用 if_exists='replace' 每次執行時都重新創建表
-        df_raw.to_sql(RAW_TABLE_NAME, engine, if_exists='replace', index=False)
+        df_raw.to_sql(RAW_TABLE_NAME, engine, if_exists='replace', index=True)
+        create_raw_indexes(engine)
+        telemetry["rows_processed"] = len(df_raw)
 
         print(f"資料成功寫入 {RAW_TABLE_NAME} 表。")
-        
+
         # 3. 創建特徵視圖
         print(f"正在創建 {FEATURE_VIEW_NAME} 視圖...")
         create_feature_view(engine)
-        
+    return len(df_raw)
+
+
+def create_raw_indexes(engine):
+    """建立 transaction_id 主鍵與 time 索引，讓批次評分能依水位與時間區間讀取。"""
+    with engine.begin() as connection:
+        connection.execute(text(f"ALTER TABLE {RAW_TABLE_NAME} ADD PRIMARY KEY (transaction_id);"))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{RAW_TABLE_NAME}_time ON {RAW_TABLE_NAME} (time);"))
+
+
+def read_time_range(data_path, time_start, time_end, chunksize=RELOAD_CHUNK_ROWS):
+    """分批讀取 CSV，只保留 time 介於 [time_start, time_end) 的列 (index 為 transaction_id)。"""
+    parts = []
+    offset = 0
+    for chunk in pd.read_csv(data_path, chunksize=chunksize):
+        chunk.columns = [col.lower() for col in chunk.columns]
+        # 與完整載入相同，以 CSV 列號作為 transaction_id
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk), name='transaction_id')
+        offset += len(chunk)
+        in_range = chunk[(chunk['time'] >= time_start) & (chunk['time'] < time_end)]
+        if len(in_range):
+            parts.append(in_range)
+    if not parts:
+        return None
+    return pd.concat(parts)
+
+
+def reload_time_range(time_start, time_end, database_url=DATABASE_URL, data_path=RAW_DATA_PATH, df_range=None):
+    """只重新載入 time 介於 [time_start, time_end) 的交易，回傳寫入筆數。
+
+    在同一個資料庫交易中刪除舊資料並以 COPY 寫入，其他時間區間完全不受影響，可與其他區間平行執行。
+    已事先讀取的 df_range (read_time_range 的結果) 可直接傳入，避免每個分區重複解析 CSV。
+    """
+    if df_range is None:
+        df_range = read_time_range(data_path, time_start, time_end)
+    elif df_range.empty:
+        df_range = None
+
+    engine = create_engine(database_url)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {RAW_TABLE_NAME} WHERE time >= %s AND time < %s",
+                (time_start, time_end)
+            )
+            if df_range is not None:
+                buffer = io.StringIO()
+                df_range.to_csv(buffer, header=False)
+                buffer.seek(0)
+                columns = ", ".join([df_range.index.name] + list(df_range.columns))
+                cursor.copy_expert(f"COPY {RAW_TABLE_NAME} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    rows = 0 if df_range is None else len(df_range)
+    print(f"已重新載入 time [{time_start:.0f}, {time_end:.0f}) 共 {rows} 筆交易")
+    return rows
+
+
+def connect_and_load_data():
+    """連線到 Postgres 並將原始 CSV 載入到 raw_transactions 表中。"""
+    try:
+        load_raw_data()
     except Exception as e:
         print(f"資料庫連線或載入失敗，錯誤訊息：{e}")
         # 如果在本機執行失敗，可以嘗試將 DB_HOST 改為 'localhost'
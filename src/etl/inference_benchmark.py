@@ -0,0 +1,80 @@
+# src/etl/inference_benchmark.py
+"""
+推論延遲基準測試與延遲感知的模型選擇
+
+每個模型訓練完後，用 held-out 測試集量測單筆與批次 (batch-of-N) 推論的
+p50/p99 延遲與吞吐量，結果寫入 MLflow；選擇模型時可設定延遲 SLO，
+在符合 SLO 的模型中挑 F1 最高者。
+"""
+import os
+import time
+
+import numpy as np
+
+BENCH_BATCH_SIZE = int(os.getenv('INFERENCE_BENCH_BATCH_SIZE', '256'))
+BENCH_SINGLE_ROWS = int(os.getenv('INFERENCE_BENCH_SINGLE_ROWS', '200'))
+BENCH_BATCHES = int(os.getenv('INFERENCE_BENCH_BATCHES', '20'))
+BENCH_WARMUP = 5
+
+# 單筆推論 p99 延遲上限 (毫秒)，未設定則只依 F1 選擇
+LATENCY_SLO_MS = float(os.getenv('LATENCY_SLO_MS')) if os.getenv('LATENCY_SLO_MS') else None
+LATENCY_SLO_METRIC = 'latency_single_p99_ms'
+
+
+def _time_calls(predict_fn, inputs):
+    latencies = np.empty(len(inputs))
+    for i, X in enumerate(inputs):
+        start = time.perf_counter()
+        predict_fn(X)
+        latencies[i] = time.perf_counter() - start
+    return latencies * 1000
+
+
+def benchmark_inference(predict_fn, X, batch_size=BENCH_BATCH_SIZE, n_single=BENCH_SINGLE_ROWS,
+                        n_batches=BENCH_BATCHES, warmup=BENCH_WARMUP):
+    """量測 predict_fn 的單筆與批次延遲 (ms) 及吞吐量 (rows/s)；batch_size 一併回傳以便記錄。
+
+    predict_fn 接收與 X 相同型別的 2D 切片 (DataFrame 或 ndarray)。
+    """
+    n_rows = len(X)
+    take = (lambda start, stop: X.iloc[start:stop]) if hasattr(X, 'iloc') else (lambda start, stop: X[start:stop])
+
+    n_single = min(n_single, n_rows)
+    batch_size = min(batch_size, n_rows)
+    n_batches = max(1, min(n_batches, n_rows // batch_size))
+
+    # 預熱：排除第一次呼叫的延遲初始化成本
+    for i in range(min(warmup, n_rows)):
+        predict_fn(take(i, i + 1))
+    predict_fn(take(0, batch_size))
+
+    single = _time_calls(predict_fn, [take(i, i + 1) for i in range(n_single)])
+    batch = _time_calls(predict_fn, [take(i * batch_size, (i + 1) * batch_size) for i in range(n_batches)])
+
+    return {
+        "latency_single_p50_ms": float(np.percentile(single, 50)),
+        "latency_single_p99_ms": float(np.percentile(single, 99)),
+        "throughput_single_rps": float(1000 * len(single) / single.sum()),
+        "latency_batch_p50_ms": float(np.percentile(batch, 50)),
+        "latency_batch_p99_ms": float(np.percentile(batch, 99)),
+        "throughput_batch_rps": float(1000 * batch_size * len(batch) / batch.sum()),
+        "bench_batch_size": batch_size,
+    }
+
+
+def select_within_slo(candidates, slo_ms=LATENCY_SLO_MS, metric=LATENCY_SLO_METRIC):
+    """從候選模型 (含 f1_score 與延遲指標的 dict) 中挑出符合 SLO 且 F1 最高者。
+
+    回傳 (winner, reason)；沒有模型符合 SLO 時退回 F1 最高者並在 reason 中註明。
+    """
+    if not candidates:
+        return None, "沒有可選擇的模型"
+
+    by_f1 = sorted(candidates, key=lambda c: c["f1_score"], reverse=True)
+    if slo_ms is None:
+        return by_f1[0], "f1_score 最高"
+
+    within = [c for c in by_f1 if c.get(metric) is not None and c[metric] <= slo_ms]
+    if within:
+        return within[0], f"{metric} <= {slo_ms}ms 中 f1_score 最高"
+    return by_f1[0], f"沒有模型符合 {metric} <= {slo_ms}ms，退回 f1_score 最高"
@@ -0,0 +1,213 @@
+# src/etl/mlflow_logger.py
+"""
+批次、非同步的 MLflow 記錄層
+
+- params / tags / metrics 先緩衝在記憶體，flush 時以 log_batch 一次送出，
+  取代每個呼叫各自一次 HTTP 往返。
+- 模型 artifact 在背景執行緒序列化並上傳，主執行緒可以直接開始訓練下一個模型。
+- close() 會送出所有緩衝並等待上傳完成，並明確列出失敗的項目；
+  同時註冊 atexit，確保 DAG 任務結束前一定會 flush；仍開著的 run 會在 close() 中同步結束。
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+
+# log_batch 單次請求的上限 (MLflow REST API 限制)
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+
+UPLOAD_WORKERS = int(os.getenv('MLFLOW_UPLOAD_WORKERS', '1'))
+
+
+class AsyncMlflowLogger:
+    """緩衝 MLflow 記錄並在背景上傳模型 artifact。"""
+
+    def __init__(self, experiment_id, max_workers=UPLOAD_WORKERS):
+        self.experiment_id = experiment_id
+        self.client = MlflowClient()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mlflow-upload")
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._pending = []
+        self._run_uploads = {}
+        self._open_runs = set()
+        self._failures = []
+        self._closed = False
+        atexit.register(self.close)
+
+    # --- Run 生命週期 ---
+
+    def start_run(self, run_name, tags=None):
+        """建立 run 並回傳 run_id；run 會在該 run 的所有上傳完成後才標記為結束。"""
+        run = self.client.create_run(self.experiment_id, run_name=run_name, tags=tags or {})
+        with self._lock:
+            self._open_runs.add(run.info.run_id)
+        return run.info.run_id
+
+    def end_run(self, run_id):
+        """送出緩衝並在背景等待該 run 的上傳完成後結束 run；任何上傳失敗則標記為 FAILED。"""
+        self.flush(run_id)
+        with self._lock:
+            self._open_runs.discard(run_id)
+            uploads = self._run_uploads.pop(run_id, [])
+        self._submit(f"{run_id}: end_run", self._finish_run, run_id, uploads)
+
+    def _finish_run(self, run_id, uploads):
+        status = "FINISHED"
+        for future in uploads:
+            if future.exception() is not None:
+                status = "FAILED"
+        self.client.set_terminated(run_id, status=status)
+
+    # --- 緩衝記錄 ---
+
+    def _buffer(self, run_id):
+        return self._buffers.setdefault(run_id, {"params": {}, "tags": {}, "metrics": {}})
+
+    def log_params(self, run_id, params):
+        with self._lock:
+            self._buffer(run_id)["params"].update({k: str(v) for k, v in params.items()})
+
+    def set_tags(self, run_id, tags):
+        with self._lock:
+            self._buffer(run_id)["tags"].update({k: str(v) for k, v in tags.items()})
+
+    def log_metrics(self, run_id, metrics):
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._buffer(run_id)["metrics"].update({k: (float(v), timestamp) for k, v in metrics.items()})
+
+    def flush(self, run_id=None):
+        """將緩衝的 params/tags/metrics 以 log_batch 送出 (同步)。"""
+        with self._lock:
+            run_ids = [run_id] if run_id is not None else list(self._buffers)
+            batches = {rid: self._buffers.pop(rid) for rid in run_ids if rid in self._buffers}
+
+        for rid, buffer in batches.items():
+            metrics = [Metric(k, v, ts, 0) for k, (v, ts) in buffer["metrics"].items()]
+            params = [Param(k, v) for k, v in buffer["params"].items()]
+            tags = [RunTag(k, v) for k, v in buffer["tags"].items()]
+            try:
+                # params 與 tags 上限較小，第一批以外只帶 metrics
+                while metrics or params or tags:
+                    self.client.log_batch(
+                        rid,
+                        metrics=metrics[:MAX_METRICS_PER_BATCH],
+                        params=params[:MAX_PARAMS_PER_BATCH],
+                        tags=tags[:MAX_TAGS_PER_BATCH],
+                    )
+                    metrics = metrics[MAX_METRICS_PER_BATCH:]
+                    params = params[MAX_PARAMS_PER_BATCH:]
+                    tags = tags[MAX_TAGS_PER_BATCH:]
+            except Exception as e:
+                self._record_failure(f"{rid}: log_batch", e)
+
+    # --- 背景上傳 ---
+
+    def _submit(self, description, fn, *args):
+        def task():
+            try:
+                return fn(*args)
+            except Exception as e:
+                self._record_failure(description, e)
+                raise
+
+        future = self._executor.submit(task)
+        with self._lock:
+            self._pending.append((description, future))
+        return future
+
+    def log_model_async(self, run_id, model, artifact_path="model", flavor="sklearn"):
+        """在背景執行緒序列化並上傳模型，上傳耗時記錄為 profile_model_logging_wall_seconds。"""
+        def upload():
+            import importlib
+            flavor_module = importlib.import_module(f"mlflow.{flavor}")
+
+            start = time.perf_counter()
+            local_dir = tempfile.mkdtemp(prefix="mlflow_model_")
+            try:
+                model_dir = os.path.join(local_dir, artifact_path)
+                flavor_module.save_model(model, model_dir)
+                self.client.log_artifacts(run_id, model_dir, artifact_path)
+            finally:
+                shutil.rmtree(local_dir, ignore_errors=True)
+            self.client.log_metric(run_id, "profile_model_logging_wall_seconds", time.perf_counter() - start)
+
+        return self._track(run_id, self._submit(f"{run_id}: log_model({artifact_path})", upload))
+
+    def log_artifacts_async(self, run_id, local_dir, artifact_path=None, cleanup=False):
+        """在背景上傳本地目錄；cleanup=True 時上傳後刪除該目錄。"""
+        def upload():
+            try:
+                self.client.log_artifacts(run_id, local_dir, artifact_path)
+            finally:
+                if cleanup:
+                    shutil.rmtree(local_dir, ignore_errors=True)
+
+        return self._track(run_id, self._submit(f"{run_id}: log_artifacts({artifact_path})", upload))
+
+    def log_text_async(self, run_id, text, artifact_file):
+        return self._track(run_id, self._submit(
+            f"{run_id}: log_text({artifact_file})", self.client.log_text, run_id, text, artifact_file
+        ))
+
+    def _track(self, run_id, future):
+        with self._lock:
+            self._run_uploads.setdefault(run_id, []).append(future)
+        return future
+
+    def _record_failure(self, description, error):
+        with self._lock:
+            self._failures.append((description, error))
+        print(f"🔥 MLflow 背景記錄失敗 [{description}]: {error}")
+        print(traceback.format_exc())
+
+    # --- 結束 ---
+
+    def close(self):
+        """送出所有緩衝、等待背景上傳完成，並回傳失敗清單 [(描述, 例外)]。"""
+        if self._closed:
+            return list(self._failures)
+
+        self.flush()
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            print(f"⏳ 等待 {len(pending)} 個 MLflow 背景上傳完成...")
+        for _, future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass  # 已在 _record_failure 中記錄
+
+        # 仍開著的 run 直接在這裡結束：從 atexit 呼叫時 concurrent.futures 已先關閉，
+        # 這時再 submit 到 executor 會拋出 RuntimeError
+        with self._lock:
+            open_runs = list(self._open_runs)
+            self._open_runs.clear()
+        for run_id in open_runs:
+            with self._lock:
+                uploads = self._run_uploads.pop(run_id, [])
+            try:
+                self._finish_run(run_id, uploads)
+            except Exception as e:
+                self._record_failure(f"{run_id}: end_run", e)
+        self._executor.shutdown(wait=True)
+        self._closed = True
+
+        if self._failures:
+            print(f"🔥 共 {len(self._failures)} 個 MLflow 記錄/上傳失敗：")
+            for description, error in self._failures:
+                print(f"   - {description}: {error}")
+        else:
+            print("✅ 所有 MLflow 記錄與模型上傳已完成")
+        return list(self._failures)
@@ -0,0 +1,83 @@
+# src/etl/model_configs.py
+"""
+模型配置清單
+
+模型類別以 import 路徑字串記錄，只在真正訓練該模型時才載入，
+讓 Airflow 列出配置或只訓練 LogisticRegression 的任務不需要 import xgboost/lightgbm/TensorFlow。
+"""
+import importlib
+
+MODEL_CONFIGS = [
+    {
+        "name": "01_Logistic_Regression_Baseline",
+        "class": "sklearn.linear_model.LogisticRegression",
+        "params": {"solver": 'liblinear', "random_state": 42, "class_weight": 'balanced'},
+        "tags": {"data_source": "Postgres-VIEW", "model_type": "LogisticRegression"},
+        "type": "sklearn"
+    },
+    {
+        "name": "02_XGBoost_Optimized",
+        "class": "xgboost.XGBClassifier",
+        "params": {
+            'n_estimators': 100,
+            'learning_rate': 0.1,
+            'scale_pos_weight': 50,
+            'random_state': 42,
+            'use_label_encoder': False,
+            'eval_metric': 'logloss'
+        },
+        "tags": {"data_source": "Postgres-VIEW", "model_type": "XGBoost"},
+        "type": "sklearn"
+    },
+    {
+        "name": "03_LightGBM_Optimized",
+        "class": "lightgbm.LGBMClassifier",
+        "params": {
+            'n_estimators': 200,
+            'learning_rate': 0.05,
+            'scale_pos_weight': 40,
+            'random_state': 42
+        },
+        "tags": {"data_source": "Postgres-VIEW", "model_type": "LightGBM"},
+        "type": "sklearn"
+    },
+    {
+        "name": "04_TensorFlow_DNN",
+        "class": None,  # TensorFlow 使用自訂訓練函式 (models.tensorflow_model.train_tensorflow_model)
+        "params": {
+            'epochs': 50,
+            'batch_size': 256,
+            'learning_rate': 0.001,
+            'early_stopping_patience': 10
+        },
+        "tags": {"data_source": "Postgres-VIEW", "model_type": "TensorFlow"},
+        "type": "tensorflow"
+    }
+]
+
+
+def get_model_config(name):
+    """依名稱取得模型配置。"""
+    for config in MODEL_CONFIGS:
+        if config["name"] == name:
+            return config
+    raise KeyError(f"找不到模型配置: {name}，可用配置: {get_model_config_names()}")
+
+
+def get_model_config_names():
+    """回傳所有模型配置名稱 (供 Airflow 動態任務映射使用)。"""
+    return [config["name"] for config in MODEL_CONFIGS]
+
+
+def resolve_model_class(config):
+    """將配置中的 import 路徑載入為模型類別 (已是類別則直接回傳)。"""
+    model_class = config["class"]
+    if not isinstance(model_class, str):
+        return model_class
+    module_name, class_name = model_class.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def resolve_model_configs(configs):
+    """回傳 class 已載入的配置副本，供需要直接實例化模型的流程 (交叉驗證、採樣報告) 使用。"""
+    return [{**config, "class": resolve_model_class(config)} for config in configs]
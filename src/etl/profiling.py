@@ -0,0 +1,127 @@
+# src/etl/profiling.py
+"""
+訓練流程資源分析 (Profiling)
+
+記錄每個階段 (資料載入、訓練、評估、模型上傳) 的 wall time、CPU time、
+峰值記憶體 (RSS) 與每秒處理筆數，並轉成可直接寫入 MLflow 的 metrics。
+"""
+import cProfile
+import io
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# 設為 1 時，對每個階段額外收集 cProfile 並可上傳為 MLflow artifact
+PROFILE_CPU = os.getenv('TRAINING_PROFILE_CPU', '0') == '1'
+PROFILE_TOP_N = int(os.getenv('TRAINING_PROFILE_TOP_N', '40'))
+
+
+# 每次重設 VmHWM 前的峰值，讓外層量測 (整個管道任務) 不會因內層階段重設而遺失峰值
+_peak_before_reset_mb = 0.0
+
+
+def _reset_peak_rss():
+    """重設 Linux 的 VmHWM，讓下一次讀取的峰值只反映當前階段；不支援時回傳 False。"""
+    global _peak_before_reset_mb
+    _peak_before_reset_mb = max(_peak_before_reset_mb, _peak_rss_mb())
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    """讀取行程峰值 RSS (MB)，優先使用 /proc 的 VmHWM，否則退回 getrusage。"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 單位為 bytes，Linux 為 KB
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def start_peak_rss_window():
+    """開始量測一段期間 (例如整個 Airflow 任務) 的峰值 RSS，期間內的階段重設不影響結果。"""
+    global _peak_before_reset_mb
+    supported = _reset_peak_rss()
+    _peak_before_reset_mb = 0.0
+    return supported
+
+
+def peak_rss_in_window_mb():
+    """回傳 start_peak_rss_window 之後的峰值 RSS (MB)。"""
+    return max(_peak_before_reset_mb, _peak_rss_mb())
+
+
+class TrainingProfiler:
+    """收集訓練流程各階段的資源使用量。"""
+
+    def __init__(self, profile_cpu=PROFILE_CPU):
+        self.profile_cpu = profile_cpu
+        self.stages = {}
+        self.cpu_profiles = {}
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """量測一個階段；可在 with 區塊內透過回傳的 dict 設定 rows。"""
+        record = {"rows": rows}
+        per_stage_peak = _reset_peak_rss()
+        profiler = cProfile.Profile() if self.profile_cpu else None
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+            record.update({
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "peak_rss_mb": _peak_rss_mb(),
+                "peak_is_per_stage": per_stage_peak,
+            })
+            if record["rows"]:
+                record["rows_per_second"] = record["rows"] / max(wall, 1e-9)
+            self.stages[name] = record
+
+            if profiler:
+                buffer = io.StringIO()
+                pstats.Stats(profiler, stream=buffer).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+                self.cpu_profiles[name] = buffer.getvalue()
+
+            print(f"⏱️  {name}: wall={wall:.2f}s cpu={cpu:.2f}s peak_rss={record['peak_rss_mb']:.0f}MB"
+                  + (f" rows/s={record['rows_per_second']:.0f}" if record["rows"] else ""))
+
+    def metrics(self, stages=None):
+        """將各階段結果轉為 MLflow metrics，例如 profile_fit_wall_seconds。"""
+        metrics = {}
+        for name, record in self.stages.items():
+            if stages is not None and name not in stages:
+                continue
+            for key in ("wall_seconds", "cpu_seconds", "peak_rss_mb", "rows_per_second"):
+                if key in record:
+                    metrics[f"profile_{name}_{key}"] = record[key]
+        return metrics
+
+    def log_to_mlflow(self, logger, run_id, stages=None):
+        """透過 AsyncMlflowLogger 記錄 metrics 與 (若啟用) CPU profile 文字檔。"""
+        logger.log_metrics(run_id, self.metrics(stages))
+        for name, text in self.cpu_profiles.items():
+            if stages is not None and name not in stages:
+                continue
+            logger.log_text_async(run_id, text, f"profile/{name}_cpu_profile.txt")
@@ -0,0 +1,96 @@
+# src/etl/sampling.py
+"""
+負類別下採樣 (Negative Downsampling)
+
+信用卡資料極度不平衡 (詐欺約 0.17%)，大部分訓練時間都花在正常交易上。
+這裡保留所有正類別，以比率 r 抽樣負類別，並給被保留的負類別 1/r 的重要性權重，
+讓加權後的損失函數與使用完整資料時一致，機率輸出不會因採樣而偏移。
+
+模型使用 class_weight='balanced' 時，sklearn 會以 fit 收到的 (下採樣後) y 重新計算類別權重，
+再乘上 1/r 的重要性權重，負類別總權重會變成正類別的 1/r 倍。訓練前以 original_class_weight
+改用原始 y 的筆數計算明確的類別權重，下採樣與完整資料的訓練才會一致。
+"""
+import time
+
+import numpy as np
+from sklearn.metrics import roc_auc_score, f1_score, precision_score, recall_score
+
+
+def downsample_negatives(X, y, rate, random_state=42):
+    """保留所有正類別，以比率 rate 抽樣負類別，回傳 (X, y, sample_weight)。"""
+    if not 0 < rate <= 1:
+        raise ValueError(f"負類別採樣率必須介於 (0, 1]，收到: {rate}")
+
+    y_values = np.asarray(y)
+    if rate == 1:
+        return X, y, np.ones(len(y_values))
+
+    pos_idx = np.flatnonzero(y_values == 1)
+    neg_idx = np.flatnonzero(y_values == 0)
+    n_keep = max(1, int(round(len(neg_idx) * rate)))
+
+    rng = np.random.default_rng(random_state)
+    kept_neg = rng.choice(neg_idx, size=n_keep, replace=False)
+    # 依原始順序排列，避免改變資料的時間順序
+    keep_idx = np.sort(np.concatenate([pos_idx, kept_neg]))
+
+    # 以實際保留比例的倒數作為權重，而非名目 rate，確保負類別總權重與原始筆數相同
+    neg_weight = len(neg_idx) / n_keep
+    sample_weight = np.where(y_values[keep_idx] == 1, 1.0, neg_weight)
+
+    if hasattr(X, 'iloc'):
+        return X.iloc[keep_idx], y.iloc[keep_idx], sample_weight
+    return X[keep_idx], y_values[keep_idx], sample_weight
+
+
+def original_class_weight(params, y):
+    """class_weight='balanced' 時改以原始 (下採樣前) y 的類別筆數計算明確的類別權重，回傳新的 params。"""
+    if params.get('class_weight') != 'balanced':
+        return params
+    classes, counts = np.unique(np.asarray(y), return_counts=True)
+    # 與 sklearn 'balanced' 相同的公式：n_samples / (n_classes * 類別筆數)
+    weights = len(np.asarray(y)) / (len(classes) * counts)
+    return {**params, 'class_weight': {int(c): float(w) for c, w in zip(classes, weights)}}
+
+
+def evaluate_sampling_rates(model_class, params, rates, X_train, X_test, y_train, y_test, threshold=0.5):
+    """對單一模型比較不同採樣率的訓練時間與評估指標，回傳每個採樣率的結果列表。
+
+    第一列永遠是 rate=1.0 (完整資料) 的基準，其餘各列的 speedup 與 delta_* 皆相對於基準計算。
+    """
+    results = []
+    baseline = None
+    params = original_class_weight(params, y_train)
+
+    for rate in [1.0] + [r for r in rates if r != 1.0]:
+        X_fit, y_fit, sample_weight = downsample_negatives(X_train, y_train, rate)
+
+        model = model_class(**params)
+        start = time.perf_counter()
+        model.fit(X_fit, y_fit, sample_weight=sample_weight)
+        fit_seconds = time.perf_counter() - start
+
+        y_proba = model.predict_proba(X_test)[:, 1]
+        y_pred = (y_proba > threshold).astype(int)
+
+        row = {
+            "rate": rate,
+            "train_rows": len(y_fit),
+            "fit_seconds": fit_seconds,
+            "roc_auc_score": roc_auc_score(y_test, y_proba),
+            "f1_score": f1_score(y_test, y_pred),
+            "precision_score": precision_score(y_test, y_pred, zero_division=0),
+            "recall_score": recall_score(y_test, y_pred),
+            # 平均預測機率與實際詐欺比例的比值，接近 1 表示機率仍維持校準
+            "mean_proba_ratio": float(y_proba.mean() / max(np.mean(y_test), 1e-12)),
+        }
+
+        if baseline is None:
+            baseline = row
+        row["speedup"] = baseline["fit_seconds"] / max(fit_seconds, 1e-9)
+        for metric in ("roc_auc_score", "f1_score", "precision_score", "recall_score"):
+            row[f"delta_{metric}"] = row[metric] - baseline[metric]
+
+        results.append(row)
+
+    return results
@@ -0,0 +1,153 @@
+# src/etl/task_overhead.py
+"""
+Airflow 任務啟動開銷量測
+
+比較每個任務在開始實際工作前花費的時間：
+- subprocess：舊的 BashOperator 做法，每個任務啟動新的 Python 直譯器執行 python -m etl.db_load /
+  python -m etl.transform_data，舊版 transform_data 在模組層級 import 所有模型框架 (xgboost/lightgbm/TensorFlow)。
+  這裡實際啟動新直譯器並以 __main__ 執行 transform_data 的 CLI (--list-models 在開始訓練前結束)，
+  先 import 舊版會載入的框架；db_load 的 __main__ 會直接載入資料，因此只 import 模組
+- in_process：PythonOperator 做法，在已存在的任務行程內 import 任務模組，只載入該任務需要的框架
+
+in_process 在獨立子行程中量測 import 本身 (不含直譯器啟動)，以免受本行程已載入的模組影響；
+實際的 Airflow worker 已載入 pandas/sqlalchemy，因此這裡的數字是上限。
+未安裝的框架 (例如 TensorFlow 或不存在的 models.tensorflow_model) 不計入 subprocess 的 import，
+需要它的模型配置則略過並列出。
+
+用法: python -m etl.task_overhead [--repeat N] [--json]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from etl.model_configs import MODEL_CONFIGS
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# 舊版 transform_data 在模組層級 import 的模型框架
+EAGER_FRAMEWORK_MODULES = ("xgboost", "lightgbm", "models.tensorflow_model")
+
+
+def _importable(module_name):
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except ImportError:
+        return False
+
+
+def _bash_operator_code(module, cli_args=None, eager_modules=()):
+    """舊 BashOperator 任務在新直譯器中執行的程式：先載入舊版的框架 import，再執行 python -m module。
+
+    cli_args 為 None 時只 import 模組 (其 __main__ 會直接開始實際工作)。
+    """
+    lines = [f"import {name}" for name in eager_modules if _importable(name)]
+    if cli_args is None:
+        lines.append(f"import {module}")
+    else:
+        lines += [
+            "import runpy, sys",
+            f"sys.argv = [{module!r}] + {list(cli_args)!r}",
+            f"runpy.run_module({module!r}, run_name='__main__', alter_sys=True)",
+        ]
+    return "\n".join(lines)
+
+
+def _lazy_imports(config):
+    """in_process 模式下某個訓練任務實際需要的 import。"""
+    if config.get("type") == "tensorflow":
+        return "import etl.transform_data; import models.tensorflow_model"
+    return (
+        "import etl.transform_data as t; "
+        f"t.resolve_model_class(t.get_model_config({config['name']!r}))"
+    )
+
+
+def _run(code):
+    env = {**os.environ, "PYTHONPATH": SRC_PATH + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC_PATH, env=env,
+                            capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        last_line = (result.stderr.strip().splitlines() or [""])[-1]
+        if last_line.startswith(("ModuleNotFoundError", "ImportError")):
+            raise ImportError(last_line)
+        raise RuntimeError(f"量測失敗: {code}\n{result.stderr.strip()}")
+    return wall_ms, result.stdout
+
+
+def measure_subprocess(code, repeat):
+    """啟動新直譯器執行 code 的完整耗時 (ms)。"""
+    return statistics.median(_run(code)[0] for _ in range(repeat))
+
+
+def measure_in_process(code, repeat):
+    """在已啟動的直譯器內執行 code 的耗時 (ms)，不含直譯器啟動。"""
+    timed = (
+        "import time; _start = time.perf_counter()\n"
+        f"{code}\n"
+        "print('__elapsed_ms__', (time.perf_counter() - _start) * 1000)"
+    )
+    samples = []
+    for _ in range(repeat):
+        _, stdout = _run(timed)
+        samples.append(float(stdout.rsplit('__elapsed_ms__', 1)[1]))
+    return statistics.median(samples)
+
+
+def measure_task_overhead(repeat=3):
+    """回傳每個 DAG 任務的 subprocess / in_process 啟動開銷 (ms)。"""
+    missing = [name for name in EAGER_FRAMEWORK_MODULES if not _importable(name)]
+    if missing:
+        print(f"⚠️  未安裝 {', '.join(missing)}：不計入 subprocess 的 import，需要的模型配置略過")
+    training_before = _bash_operator_code("etl.transform_data", ["--list-models"], EAGER_FRAMEWORK_MODULES)
+    tasks = [("load_new_data", _bash_operator_code("etl.db_load"), "import etl.db_load")]
+    tasks += [
+        (f"perform_model_training[{config['name']}]", training_before, _lazy_imports(config))
+        for config in MODEL_CONFIGS
+    ]
+
+    results = []
+    for task, before_code, after_code in tasks:
+        print(f"⏱️  量測 {task} ...")
+        try:
+            after = measure_in_process(after_code, repeat)
+        except ImportError as e:
+            print(f"   略過 {task}: {e}")
+            continue
+        before = measure_subprocess(before_code, repeat)
+        results.append({
+            "task": task,
+            "subprocess_ms": before,
+            "in_process_ms": after,
+            "saved_ms": before - after,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 Airflow 任務的直譯器啟動與 import 開銷")
+    parser.add_argument("--repeat", type=int, default=3, help="每種方式重複次數 (取中位數)")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    args = parser.parse_args()
+
+    results = measure_task_overhead(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"\n{'task':<56} {'subprocess(ms)':>15} {'in_process(ms)':>15} {'saved(ms)':>10}")
+    for row in results:
+        print(f"{row['task']:<56} {row['subprocess_ms']:>15.0f} {row['in_process_ms']:>15.0f} {row['saved_ms']:>10.0f}")
+    total = sum(row["saved_ms"] for row in results)
+    print(f"\n每次 DAG 執行共節省約 {total / 1000:.1f} 秒的任務啟動時間")
+
+
+if __name__ == "__main__":
+    main()
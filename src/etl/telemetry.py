@@ -0,0 +1,185 @@
+# src/etl/telemetry.py
+"""
+管道執行遙測 (pipeline_runs)
+
+db_load、特徵視圖建立與 transform_data 的每次任務執行都寫入一列：
+開始/結束時間、耗時、處理筆數、讀取 bytes、峰值記憶體與狀態。
+DAG 變慢時可直接查詢哪個階段退步，並以 regression_report 找出
+耗時超過過去 N 次成功執行中位數 X% 的階段。
+
+遙測寫入失敗只會印出警告，不會讓任務本身失敗。
+
+用法: python -m etl.telemetry [--threshold-pct 20] [--window 7]
+"""
+import os
+import sys
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from etl.profiling import start_peak_rss_window, peak_rss_in_window_mb
+
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME', 'fraud_db')
+DB_USER = os.getenv('DB_USER', 'user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_PORT = '5432'
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+PIPELINE_RUNS_TABLE = 'pipeline_runs'
+# 設為 0 可停用遙測寫入 (例如本機測試沒有資料庫時)
+TELEMETRY_ENABLED = os.getenv('PIPELINE_TELEMETRY', '1') == '1'
+REGRESSION_THRESHOLD_PCT = float(os.getenv('TELEMETRY_REGRESSION_PCT', '20'))
+REGRESSION_WINDOW = int(os.getenv('TELEMETRY_REGRESSION_WINDOW', '7'))
+
+CREATE_PIPELINE_RUNS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {PIPELINE_RUNS_TABLE} (
+    id BIGSERIAL PRIMARY KEY,
+    pipeline_run_id TEXT,
+    task TEXT NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    ended_at TIMESTAMPTZ NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    rows_processed BIGINT,
+    bytes_read BIGINT,
+    peak_rss_mb DOUBLE PRECISION,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_{PIPELINE_RUNS_TABLE}_task_started ON {PIPELINE_RUNS_TABLE} (task, started_at);
+"""
+
+# 每個階段最新一次成功執行，與其之前 :window 次成功執行的耗時中位數比較
+REGRESSION_SQL = f"""
+SELECT latest.task, latest.pipeline_run_id, latest.started_at, latest.duration_seconds,
+       baseline.median_seconds, baseline.n_runs
+FROM (
+    SELECT DISTINCT ON (task) task, pipeline_run_id, started_at, duration_seconds
+    FROM {PIPELINE_RUNS_TABLE}
+    WHERE status = 'success'
+    ORDER BY task, started_at DESC
+) latest
+CROSS JOIN LATERAL (
+    SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY previous.duration_seconds) AS median_seconds,
+           COUNT(*) AS n_runs
+    FROM (
+        SELECT duration_seconds FROM {PIPELINE_RUNS_TABLE}
+        WHERE task = latest.task AND status = 'success' AND started_at < latest.started_at
+        ORDER BY started_at DESC
+        LIMIT :window
+    ) previous
+) baseline
+ORDER BY latest.task
+"""
+
+
+def ensure_pipeline_runs_table(engine):
+    """建立 pipeline_runs 表 (已存在則略過)。"""
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_PIPELINE_RUNS_SQL))
+
+
+def write_task_run(database_url, record):
+    """寫入一筆任務遙測；失敗只印出警告。"""
+    try:
+        engine = create_engine(database_url)
+        ensure_pipeline_runs_table(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                text(f"""
+                    INSERT INTO {PIPELINE_RUNS_TABLE}
+                        (pipeline_run_id, task, started_at, ended_at, duration_seconds,
+                         rows_processed, bytes_read, peak_rss_mb, status, error)
+                    VALUES (:pipeline_run_id, :task, :started_at, :ended_at, :duration_seconds,
+                            :rows_processed, :bytes_read, :peak_rss_mb, :status, :error)
+                """),
+                record
+            )
+    except Exception as e:
+        print(f"⚠️  遙測寫入失敗 ({record['task']}): {e}")
+
+
+@contextmanager
+def record_task(task, database_url=None, pipeline_run_id=None):
+    """記錄一次任務執行；在 with 區塊內透過回傳的 dict 設定 rows_processed 與 bytes_read。
+
+    例外會照常拋出，並以 status='failed' 記錄。
+    """
+    record = {"rows_processed": None, "bytes_read": None}
+    if not TELEMETRY_ENABLED:
+        yield record
+        return
+
+    start_peak_rss_window()
+    started_at = datetime.now(timezone.utc)
+    status, error = "success", None
+    try:
+        yield record
+    except BaseException as e:
+        status, error = "failed", "".join(traceback.format_exception_only(type(e), e)).strip()
+        raise
+    finally:
+        ended_at = datetime.now(timezone.utc)
+        record.update({
+            "pipeline_run_id": pipeline_run_id or os.getenv('PIPELINE_RUN_ID'),
+            "task": task,
+            "started_at": started_at,
+            "ended_at": ended_at,
+            "duration_seconds": (ended_at - started_at).total_seconds(),
+            "peak_rss_mb": peak_rss_in_window_mb(),
+            "status": status,
+            "error": error,
+        })
+        for key in ("rows_processed", "bytes_read"):
+            if record[key] is not None:
+                record[key] = int(record[key])
+        print(f"📊 {task}: {status}, {record['duration_seconds']:.1f}s, rows={record['rows_processed']}, "
+              f"bytes={record['bytes_read']}, peak_rss={record['peak_rss_mb']:.0f}MB")
+        write_task_run(database_url or DATABASE_URL, record)
+
+
+def regression_report(database_url=None, threshold_pct=REGRESSION_THRESHOLD_PCT, window=REGRESSION_WINDOW):
+    """回傳每個階段最新一次成功執行與過去 window 次成功執行耗時中位數的比較 (DataFrame)。
+
+    regressed 欄位標記耗時比中位數多出 threshold_pct% 以上的階段；沒有歷史資料的階段不會被標記。
+    """
+    engine = create_engine(database_url or DATABASE_URL)
+    with engine.connect() as connection:
+        report = pd.read_sql(text(REGRESSION_SQL), connection, params={"window": window})
+    report["change_pct"] = (report["duration_seconds"] / report["median_seconds"] - 1) * 100
+    report["regressed"] = report["change_pct"].fillna(0) > threshold_pct
+    return report
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="列出耗時相對過去中位數退步的管道階段")
+    parser.add_argument("--threshold-pct", type=float, default=REGRESSION_THRESHOLD_PCT,
+                        help="耗時超過中位數多少百分比視為退步")
+    parser.add_argument("--window", type=int, default=REGRESSION_WINDOW, help="比較的過去成功執行次數")
+    args = parser.parse_args()
+
+    report = regression_report(threshold_pct=args.threshold_pct, window=args.window)
+    if report.empty:
+        print("pipeline_runs 尚無成功的任務紀錄")
+        return
+
+    print(f"{'task':<48} {'latest(s)':>10} {'median(s)':>10} {'change':>9} {'n':>3}")
+    for row in report.itertuples():
+        median = f"{row.median_seconds:>10.1f}" if pd.notna(row.median_seconds) else f"{'-':>10}"
+        change = f"{row.change_pct:>+8.1f}%" if pd.notna(row.change_pct) else f"{'-':>9}"
+        flag = "  ⚠️ 退步" if row.regressed else ""
+        print(f"{row.task:<48} {row.duration_seconds:>10.1f} {median} {change} {row.n_runs:>3}{flag}")
+
+    regressed = report[report["regressed"]]
+    if len(regressed):
+        print(f"\n🔥 {len(regressed)} 個階段耗時超過過去 {args.window} 次中位數 {args.threshold_pct:.0f}% 以上")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,31 @@
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score, f1_score, precision_score, recall_score
 from sqlalchemy import create_engine
 import joblib
+import json
 import os
+import shutil
+import tempfile
 import mlflow
 import mlflow.sklearn
-from xgboost import XGBClassifier
-from lightgbm import LGBMClassifier
 
-# 導入 TensorFlow 模型模組
+# xgboost/lightgbm/TensorFlow 只在訓練對應模型時才載入 (見 etl.model_configs)
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from models.tensorflow_model import train_tensorflow_model
+from models.serving_artifact import export_serving_artifact, load_serving_artifact, UnsupportedModelError, FORMAT_VERSION
+from models.velocity_features import add_velocity_features, VELOCITY_WINDOWS
+from models.drift import build_reference_profile, save_reference_profile
+from models.keras_serving import CompiledKerasModel
+from etl.sampling import downsample_negatives, evaluate_sampling_rates, original_class_weight
+from etl.profiling import TrainingProfiler
+from etl.mlflow_logger import AsyncMlflowLogger
+from etl.cross_validation import cross_validate_configs
+from etl.inference_benchmark import benchmark_inference, select_within_slo, LATENCY_SLO_MS
+from etl.telemetry import record_task
+from etl.model_configs import (
+    MODEL_CONFIGS, get_model_config, get_model_config_names, resolve_model_class, resolve_model_configs
+)
 
 # --- 設定路徑與參數 ---
 # 儲存最終模型的本地路徑
@@ -43,9 +55,26 @@ DB_PORT = '5432'
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 FEATURE_VIEW_NAME = 'feature_transactions'
 
+# 負類別下採樣率 (1.0 = 不採樣)，可在模型配置中以 "neg_sampling_rate" 個別覆寫
+NEG_SAMPLING_RATE = float(os.getenv('NEG_SAMPLING_RATE', '1.0'))
+EXPERIMENT_NAME = "Fraud Detection Baseline"
+# 決策門檻：評估與服務 (serving artifact) 共用
+DECISION_THRESHOLD = 0.5
+# 精簡服務格式在 MLflow run 中的 artifact 路徑 (與 "model" 並列)
+SERVING_ARTIFACT_PATH = "serving"
+# 輸入漂移監控的參考分佈 (API 的 /drift 以此比較線上輸入)
+DRIFT_ARTIFACT_PATH = "drift"
+# 訓練時的特徵順序 (含速度特徵)；API 以完整 MLflow 模型服務時依此組成輸入
+FEATURE_ORDER_ARTIFACT = "feature_order.json"
+SAMPLING_REPORT_EXPERIMENT = "Fraud Detection Sampling Report"
+CROSS_VALIDATION_EXPERIMENT = "Fraud Detection Cross Validation"
+CV_N_JOBS = int(os.getenv('CV_N_JOBS', '-1'))
+# 是否加入時間窗速度特徵 (前 N 秒的交易筆數與金額總和)；API 依模型的 feature_order 自動計算相同特徵
+# (精簡服務格式的 manifest 與完整 MLflow 模型旁的 feature_order.json 都記錄了 feature_order)
+USE_VELOCITY_FEATURES = os.getenv('VELOCITY_FEATURES', '1') == '1'
 
-def load_data(engine):
-    """從 PostgreSQL feature_transactions 視圖載入數據並分割。"""
+def load_features(engine):
+    """從 PostgreSQL feature_transactions 視圖載入完整的特徵與標籤 (不分割)。"""
     
     print(f"--- 1. 從資料庫載入特徵：{FEATURE_VIEW_NAME} ---")
     
@@ -54,29 +83,116 @@ def load_data(engine):
     
     print(f"成功載入 {len(df)} 筆特徵數據。")
 
+    if USE_VELOCITY_FEATURES:
+        # 在分割前以完整的交易流計算，每筆的視窗都包含所有更早的交易
+        df = add_velocity_features(df)
+        print(f"已加入速度特徵 (視窗 {', '.join(f'{w}s' for w in VELOCITY_WINDOWS)})")
+
     X = df.drop('class', axis=1)
     y = df['class']
+    return X, y
+
+
+def load_data(engine):
+    """從 PostgreSQL feature_transactions 視圖載入數據並分割。"""
+    
+    X, y = load_features(engine)
 
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
     )
     return X_train, X_test, y_train, y_test
 
-def train_model_and_log_mlflow(model_class, run_name, params, tags, X_train, X_test, y_train, y_test):
-    """訓練單一模型、評估並將結果記錄到 MLflow。"""
+def export_serving_model(logger, run_id, model, feature_order, model_type=None):
+    """匯出精簡服務格式並在背景上傳到同一個 run 的 serving/ 目錄，回傳載入後的 CompactModel；
+    不支援的模型只印出提示並回傳 None。
+
+    訓練直接使用 feature_transactions 的原始欄位，因此不帶 scaler (恆等轉換)。
+    """
+    export_dir = tempfile.mkdtemp(prefix="serving_artifact_")
+    try:
+        export_serving_artifact(
+            model, export_dir,
+            feature_order=feature_order,
+            threshold=DECISION_THRESHOLD,
+            model_type=model_type
+        )
+    except UnsupportedModelError as e:
+        shutil.rmtree(export_dir, ignore_errors=True)
+        print(f"⚠️  無法匯出精簡服務格式，API 將使用 MLflow 模型: {e}")
+        return None
+
+    # 在排入上傳 (上傳後會刪除目錄) 之前先讀入記憶體，供推論基準測試使用
+    compact_model = load_serving_artifact(export_dir, run_id=run_id, mmap=False)
+    logger.set_tags(run_id, {"serving_artifact_version": FORMAT_VERSION})
+    logger.log_artifacts_async(run_id, export_dir, SERVING_ARTIFACT_PATH, cleanup=True)
+    return compact_model
+
+
+def export_feature_order(logger, run_id, feature_order):
+    """在背景上傳訓練時的特徵順序，API 載入完整 MLflow 模型 (非精簡服務格式) 時依此組成輸入與速度特徵。"""
+    logger.log_text_async(run_id, json.dumps(list(feature_order)), FEATURE_ORDER_ARTIFACT)
+
+
+def export_drift_reference(logger, run_id, X_reference):
+    """以 X_reference 建立各特徵的分箱參考分佈，在背景上傳到同一個 run 的 drift/ 目錄。
+
+    呼叫端傳入測試集：下採樣只作用在訓練集，測試集保有原始流量的分佈。
+    """
+    export_dir = tempfile.mkdtemp(prefix="drift_reference_")
+    save_reference_profile(build_reference_profile(X_reference), export_dir)
+    logger.log_artifacts_async(run_id, export_dir, DRIFT_ARTIFACT_PATH, cleanup=True)
+
+
+def benchmark_serving_path(logger, run_id, model, compact_model, X_test):
+    """以 API 實際會使用的推論路徑量測延遲與吞吐量，並記錄到 MLflow。"""
+    if compact_model is not None:
+        serving_path = "compact"
+        predict_fn = lambda X: compact_model.predict_proba(compact_model.vectorize(X))
+    elif hasattr(model, 'predict_proba'):
+        serving_path = "native"
+        predict_fn = lambda X: model.predict_proba(X)[:, 1]
+    else:
+        # Keras 模型：與 API 相同，使用固定簽章的編譯推論路徑
+        serving_path = "keras_compiled"
+        compiled_model = CompiledKerasModel(model)
+        predict_fn = lambda X: compiled_model.predict_proba(X.values)
+
+    bench = benchmark_inference(predict_fn, X_test)
+    logger.log_metrics(run_id, bench)
+    logger.set_tags(run_id, {"serving_path": serving_path})
+    print(f"   推論延遲 ({serving_path}): 單筆 p50={bench['latency_single_p50_ms']:.2f}ms "
+          f"p99={bench['latency_single_p99_ms']:.2f}ms, 批次吞吐量={bench['throughput_batch_rps']:.0f} rows/s")
+    return bench
+
+
+def train_model_and_log_mlflow(model_class, run_name, params, tags, X_train, X_test, y_train, y_test,
+                               sample_weight=None, neg_sampling_rate=1.0, profiler=None, logger=None):
+    """訓練單一模型、評估並將結果記錄到 MLflow，回傳 (f1, model, 含 run_id 與延遲指標的摘要)。
+
+    params/tags/metrics 由 logger 緩衝後批次送出，模型 artifact 在背景上傳，
+    函式返回時上傳可能仍在進行，由呼叫端在流程結束前呼叫 logger.close()。
+    """
     
-    with mlflow.start_run(run_name=run_name) as run:
-        print(f"\n--- 訓練: {run_name} ---")
+    if profiler is None:
+        profiler = TrainingProfiler()
+    owns_logger = logger is None
+    if owns_logger:
+        logger = AsyncMlflowLogger(mlflow.set_experiment(EXPERIMENT_NAME).experiment_id)
 
-        # 記錄參數和標籤
-        mlflow.log_params(params)
-        mlflow.set_tags(tags) 
-        
-        # 訓練模型
-        model = model_class(**params) 
-        model.fit(X_train, y_train)
-        
-        # 評估模型
+    print(f"\n--- 訓練: {run_name} ---")
+    run_id = logger.start_run(run_name, tags=tags)
+
+    # 記錄參數和標籤
+    logger.log_params(run_id, {**params, "neg_sampling_rate": neg_sampling_rate})
+    
+    # 訓練模型 (下採樣時以 sample_weight 補償被移除的負類別)
+    model = model_class(**params) 
+    with profiler.stage("fit", rows=len(X_train)):
+        model.fit(X_train, y_train, sample_weight=sample_weight)
+    
+    # 評估模型
+    with profiler.stage("evaluate", rows=len(X_test)):
         y_proba = model.predict_proba(X_test)[:, 1]
         y_pred = (y_proba > 0.5).astype(int) 
         
@@ -86,24 +202,84 @@ def train_model_and_log_mlflow(model_class, run_name, params, tags, X_train, X_t
             "precision_score": precision_score(y_test, y_pred),
             "recall_score": recall_score(y_test, y_pred)
         }
-        mlflow.log_metrics(metrics)
+    logger.log_metrics(run_id, metrics)
 
-        print(f"   AUC: {metrics['roc_auc_score']:.4f}, F1: {metrics['f1_score']:.4f}, Precision: {metrics['precision_score']:.4f}")
+    print(f"   AUC: {metrics['roc_auc_score']:.4f}, F1: {metrics['f1_score']:.4f}, Precision: {metrics['precision_score']:.4f}")
 
-        # ✅ 儲存模型到 MLflow Artifacts（測試連接）
-        try:
-            # 先測試基本連接
-            client = mlflow.tracking.MlflowClient()
-            print(f"MLflow 客戶端連接成功")
-            
-            # 使用最簡單的方法記錄模型
-            mlflow.sklearn.log_model(model, "model")
-            print(f"成功記錄 {tags.get('model_type', 'Unknown')} 模型到 MLflow")
-        except Exception as e:
-            print(f"模型記錄失敗: {e}")
-            print(f"跳過模型記錄，但訓練指標已保存")
-        
-        return metrics['f1_score'], model
+    # ✅ 儲存模型到 MLflow Artifacts（背景上傳，失敗會在 logger.close() 時列出並將 run 標記為 FAILED）
+    logger.log_model_async(run_id, model, "model")
+    export_feature_order(logger, run_id, X_train.columns)
+    print(f"已排入背景上傳 {tags.get('model_type', 'Unknown')} 模型到 MLflow")
+    compact_model = export_serving_model(logger, run_id, model, list(X_train.columns), tags.get('model_type'))
+    export_drift_reference(logger, run_id, X_test)
+
+    # 推論基準測試 (單筆與批次延遲、吞吐量)，供延遲感知的模型選擇使用
+    bench = benchmark_serving_path(logger, run_id, model, compact_model, X_test)
+
+    # 記錄本次 run 的資源使用量 (data_load 為所有模型共用的載入階段；模型上傳耗時由背景工作記錄)
+    profiler.log_to_mlflow(logger, run_id, stages=["data_load", "fit", "evaluate"])
+    logger.end_run(run_id)
+
+    if owns_logger:
+        logger.close()
+    
+    return metrics['f1_score'], model, {"run_id": run_id, "f1_score": metrics['f1_score'], **bench}
+
+
+def train_config(config, X_train, X_test, y_train, y_test, profiler, logger, extra_tags=None):
+    """依模型配置訓練一個模型，回傳 (f1, model, 候選摘要)；訓練失敗時拋出例外由呼叫端決定如何處理。"""
+    tags = {**config["tags"], **(extra_tags or {})}
+
+    # 根據模型類型選擇訓練方式
+    if config.get("type") == "tensorflow":
+        # TensorFlow 模型使用專用訓練函式 (內部以 class weight 處理不平衡，不套用下採樣)
+        # 訓練函式內部自行管理 MLflow run，這裡只能量測整體的訓練 + 評估 + 上傳時間
+        from models.tensorflow_model import train_tensorflow_model
+        with profiler.stage("tensorflow_total", rows=len(X_train)):
+            current_f1, current_model = train_tensorflow_model(
+                X_train=X_train, 
+                X_test=X_test, 
+                y_train=y_train, 
+                y_test=y_test,
+                run_name=config["name"],
+                tags=tags,
+                **config["params"]
+            )
+        summary = {"f1_score": current_f1}
+        last_run = mlflow.last_active_run()
+        if last_run is not None:
+            tf_run_id = last_run.info.run_id
+            profiler.log_to_mlflow(logger, tf_run_id, stages=["data_load", "tensorflow_total"])
+            export_feature_order(logger, tf_run_id, X_train.columns)
+            compact_model = export_serving_model(logger, tf_run_id, current_model,
+                                                 list(X_train.columns), config["tags"].get("model_type"))
+            export_drift_reference(logger, tf_run_id, X_test)
+            bench = benchmark_serving_path(logger, tf_run_id, current_model, compact_model, X_test)
+            summary.update({"run_id": tf_run_id, **bench})
+            # 訓練函式已先以 FINISHED 結束 run；交由 logger 在背景上傳完成後重新標記，任何上傳失敗則為 FAILED
+            logger.end_run(tf_run_id)
+    else:
+        # sklearn/XGBoost/LightGBM 模型使用原有函式
+        # 負類別下採樣：只影響訓練集，測試集維持原始分佈以確保評估公平
+        rate = config.get("neg_sampling_rate", NEG_SAMPLING_RATE)
+        X_fit, y_fit, sample_weight = downsample_negatives(X_train, y_train, rate)
+        if rate < 1:
+            print(f"負類別下採樣 r={rate}: 訓練筆數 {len(y_train)} -> {len(y_fit)}")
+
+        current_f1, current_model, summary = train_model_and_log_mlflow(
+            model_class=resolve_model_class(config),
+            run_name=config["name"],
+            # class_weight='balanced' 以下採樣前的 y_train 計算，避免與 1/r 權重重複補償
+            params=original_class_weight(config["params"], y_train),
+            tags=tags,
+            X_train=X_fit, X_test=X_test, y_train=y_fit, y_test=y_test,
+            sample_weight=sample_weight,
+            neg_sampling_rate=rate,
+            profiler=profiler,
+            logger=logger
+        )
+
+    return current_f1, current_model, {"name": config["name"], **summary}
 
 
 def run_etl_and_train_pipeline():
@@ -113,7 +289,8 @@ def run_etl_and_train_pipeline():
 
     print(f"設定 MLflow Tracking URI: {MLFLOW_TRACKING_URI}")
     mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-    mlflow.set_experiment("Fraud Detection Baseline") 
+    experiment = mlflow.set_experiment(EXPERIMENT_NAME) 
+    logger = AsyncMlflowLogger(experiment.experiment_id)
     try:
         os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
         print(f"📁 模型儲存目錄已準備：{os.path.dirname(MODEL_PATH)}")
@@ -129,89 +306,30 @@ def run_etl_and_train_pipeline():
         connection.close()
 
         # 1. 載入和分割數據
-        X_train, X_test, y_train, y_test = load_data(engine)
+        profiler = TrainingProfiler()
+        with profiler.stage("data_load") as stage:
+            X_train, X_test, y_train, y_test = load_data(engine)
+            stage["rows"] = len(X_train) + len(X_test)
 
         best_f1_score = -1
         best_model = None
         best_model_name = ""
-
-        # 2. 模型配置清單
-        model_configs = [
-            {
-                "name": "01_Logistic_Regression_Baseline",
-                "class": LogisticRegression,
-                "params": {"solver": 'liblinear', "random_state": 42, "class_weight": 'balanced'},
-                "tags": {"data_source": "Postgres-VIEW", "model_type": "LogisticRegression"},
-                "type": "sklearn"
-            },
-            {
-                "name": "02_XGBoost_Optimized",
-                "class": XGBClassifier,
-                "params": {
-                    'n_estimators': 100, 
-                    'learning_rate': 0.1, 
-                    'scale_pos_weight': 50,
-                    'random_state': 42,
-                    'use_label_encoder': False,
-                    'eval_metric': 'logloss'
-                },
-                "tags": {"data_source": "Postgres-VIEW", "model_type": "XGBoost"},
-                "type": "sklearn"
-            },
-            {
-                "name": "03_LightGBM_Optimized",
-                "class": LGBMClassifier, 
-                "params": {
-                    'n_estimators': 200, 
-                    'learning_rate': 0.05, 
-                    'scale_pos_weight': 40, 
-                    'random_state': 42
-                },
-                "tags": {"data_source": "Postgres-VIEW", "model_type": "LightGBM"},
-                "type": "sklearn"
-            },
-            {
-                "name": "04_TensorFlow_DNN",
-                "class": None,  # TensorFlow 使用自訂訓練函式
-                "params": {
-                    'epochs': 50,
-                    'batch_size': 256,
-                    'learning_rate': 0.001,
-                    'early_stopping_patience': 10
-                },
-                "tags": {"data_source": "Postgres-VIEW", "model_type": "TensorFlow"},
-                "type": "tensorflow"
-            }
-        ]
+        candidates = []
 
         # 3. 迭代訓練所有模型
-        for config in model_configs:
-            # 根據模型類型選擇訓練方式
-            if config.get("type") == "tensorflow":
-                # TensorFlow 模型使用專用訓練函式
-                try:
-                    current_f1, current_model = train_tensorflow_model(
-                        X_train=X_train, 
-                        X_test=X_test, 
-                        y_train=y_train, 
-                        y_test=y_test,
-                        run_name=config["name"],
-                        tags=config["tags"],
-                        **config["params"]
-                    )
-                except Exception as tf_error:
-                    print(f"⚠️  TensorFlow 模型訓練失敗: {tf_error}")
-                    print("繼續訓練其他模型...")
-                    continue
-            else:
-                # sklearn/XGBoost/LightGBM 模型使用原有函式
-                current_f1, current_model = train_model_and_log_mlflow(
-                    model_class=config["class"],
-                    run_name=config["name"],
-                    params=config["params"],
-                    tags=config["tags"],
-                    X_train=X_train, X_test=X_test, y_train=y_train, y_test=y_test
+        for config in MODEL_CONFIGS:
+            try:
+                current_f1, current_model, summary = train_config(
+                    config, X_train, X_test, y_train, y_test, profiler, logger
                 )
+            except Exception as model_error:
+                if config.get("type") != "tensorflow":
+                    raise
+                print(f"⚠️  TensorFlow 模型訓練失敗: {model_error}")
+                print("繼續訓練其他模型...")
+                continue
+            if "run_id" in summary:
+                candidates.append(summary)
             
             # 4. 選擇並儲存最佳模型
             if current_f1 > best_f1_score:
@@ -220,6 +338,12 @@ def run_etl_and_train_pipeline():
                 best_model_name = config["name"]
                 print(f"-> 新的最佳模型: {best_model_name} (F1={best_f1_score:.4f})")
 
+        # 5. 延遲感知的服務模型選擇：在符合 LATENCY_SLO_MS 的模型中挑 F1 最高者，
+        #    並標記 selected_for_serving，API 會優先載入這個 run
+        selected, reason = select_within_slo(candidates, LATENCY_SLO_MS)
+        if selected is not None:
+            mark_selected_for_serving(logger, selected, reason)
+
         if best_model:
             # 這裡我們不再需要儲存到本地，因為 API 將會從 MLflow 載入模型
             # joblib.dump(best_model, MODEL_PATH) 
@@ -231,11 +355,215 @@ def run_etl_and_train_pipeline():
         print(f"\n🔥 訓練流程失敗。錯誤訊息: {e}")
         print(traceback.format_exc())
         print("請確認 MLflow Server (mlflow_server) 和 PostgreSQL (postgres_db) 容器正在運行。")
+    finally:
+        # 確保所有緩衝的記錄與背景模型上傳在任務結束前完成
+        upload_failures = logger.close()
+        if upload_failures:
+            print(f"⚠️  {len(upload_failures)} 個 MLflow 記錄/上傳失敗，模型上傳失敗的 run 已標記為 FAILED")
+
+
+def mark_selected_for_serving(logger, selected, reason):
+    """將選中的 run 標記為 selected_for_serving，API 會優先載入最新的標記 run。"""
+    logger.set_tags(selected["run_id"], {"selected_for_serving": "true", "selection_reason": reason})
+    logger.flush(selected["run_id"])
+    p99 = selected.get('latency_single_p99_ms')
+    print(f"\n🚀 服務模型: {selected['name']} (F1={selected['f1_score']:.4f}, "
+          f"單筆 p99={p99 if p99 is None else f'{p99:.2f}'}ms) — {reason}")
+
+
+def run_single_model(name, pipeline_run_id=None, database_url=None, tracking_uri=None):
+    """只訓練一個模型配置 (Airflow 動態映射任務)；任何錯誤都會拋出，讓該任務失敗並可單獨重試。
+
+    run 會標記 pipeline_run_id，供 select_serving_model 在同一次管道執行的結果中挑選。
+    database_url/tracking_uri 未指定時使用環境變數設定，Airflow 可直接傳入 Connection 的 URI 在行程內呼叫。
+    """
+    config = get_model_config(name)
+    pipeline_run_id = pipeline_run_id or os.getenv('PIPELINE_RUN_ID')
+    tracking_uri = tracking_uri or MLFLOW_TRACKING_URI
+
+    print(f"設定 MLflow Tracking URI: {tracking_uri}")
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(EXPERIMENT_NAME)
+    logger = AsyncMlflowLogger(experiment.experiment_id)
+    database_url = database_url or DATABASE_URL
+    # 遙測涵蓋資料載入、訓練與等待上傳完成，上傳失敗也會記錄為 failed
+    with record_task(f"train_model:{name}", database_url, pipeline_run_id) as telemetry:
+        try:
+            engine = create_engine(database_url)
+            profiler = TrainingProfiler()
+            with profiler.stage("data_load") as stage:
+                X_train, X_test, y_train, y_test = load_data(engine)
+                stage["rows"] = len(X_train) + len(X_test)
+            telemetry["rows_processed"] = len(X_train) + len(X_test)
+            # 以載入後 DataFrame 的大小近似從資料庫讀取的資料量
+            telemetry["bytes_read"] = (X_train.memory_usage(deep=True).sum() + X_test.memory_usage(deep=True).sum()
+                                       + y_train.memory_usage(deep=True) + y_test.memory_usage(deep=True))
+
+            extra_tags = {"pipeline_run_id": pipeline_run_id} if pipeline_run_id else None
+            current_f1, _, summary = train_config(config, X_train, X_test, y_train, y_test, profiler, logger, extra_tags)
+            print(f"✅ {name} 訓練完成 (F1={current_f1:.4f})")
+        finally:
+            upload_failures = logger.close()
+            if upload_failures:
+                raise RuntimeError(f"{name}: {len(upload_failures)} 個 MLflow 記錄/上傳失敗")
+    return summary
+
+
+def select_serving_model(pipeline_run_id=None, slo_ms=LATENCY_SLO_MS, tracking_uri=None):
+    """從 MLflow 讀取同一次管道執行中成功的訓練 run，依延遲 SLO 與 F1 選出服務模型並標記。"""
+    pipeline_run_id = pipeline_run_id or os.getenv('PIPELINE_RUN_ID')
+    if not pipeline_run_id:
+        raise ValueError("需要 pipeline_run_id (或環境變數 PIPELINE_RUN_ID) 才能選擇模型")
+    tracking_uri = tracking_uri or MLFLOW_TRACKING_URI
+
+    print(f"設定 MLflow Tracking URI: {tracking_uri}")
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment(EXPERIMENT_NAME)
+
+    client = mlflow.tracking.MlflowClient()
+    runs = client.search_runs(
+        experiment_ids=[experiment.experiment_id],
+        filter_string=f"tags.pipeline_run_id = '{pipeline_run_id}' and attributes.status = 'FINISHED'",
+        order_by=["metrics.f1_score DESC"],
+    )
+    candidates = [
+        {
+            "run_id": run.info.run_id,
+            "name": run.info.run_name,
+            "f1_score": run.data.metrics["f1_score"],
+            "latency_single_p99_ms": run.data.metrics.get("latency_single_p99_ms"),
+        }
+        for run in runs
+        if "f1_score" in run.data.metrics
+    ]
+    if not candidates:
+        raise RuntimeError(f"管道執行 {pipeline_run_id} 沒有任何成功的訓練 run")
+
+    for candidate in candidates:
+        print(f"   {candidate['name']}: F1={candidate['f1_score']:.4f}, p99={candidate['latency_single_p99_ms']}")
+
+    selected, reason = select_within_slo(candidates, slo_ms)
+    logger = AsyncMlflowLogger(experiment.experiment_id)
+    try:
+        mark_selected_for_serving(logger, selected, reason)
+    finally:
+        logger.close()
+    return selected
+
+
+def run_sampling_report(rates):
+    """比較各模型在不同負類別採樣率下的訓練加速與指標變化，結果記錄到獨立的 MLflow 實驗。"""
+
+    print(f"設定 MLflow Tracking URI: {MLFLOW_TRACKING_URI}")
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    # 使用獨立實驗，避免報告 run 被 API 或 Dashboard 當成可部署的模型
+    mlflow.set_experiment(SAMPLING_REPORT_EXPERIMENT)
+
+    engine = create_engine(DATABASE_URL)
+    X_train, X_test, y_train, y_test = load_data(engine)
+
+    for config in MODEL_CONFIGS:
+        if config.get("type") == "tensorflow":
+            print(f"跳過 {config['name']}：TensorFlow 模型不支援 sample_weight 下採樣比較")
+            continue
+
+        print(f"\n--- 採樣率比較: {config['name']} ---")
+        results = evaluate_sampling_rates(
+            resolve_model_class(config), config["params"], rates,
+            X_train, X_test, y_train, y_test
+        )
+
+        print(f"{'rate':>6} {'rows':>8} {'fit(s)':>8} {'speedup':>8} {'dAUC':>8} {'dF1':>8} {'dPrec':>8} {'dRecall':>8}")
+        for row in results:
+            print(f"{row['rate']:>6.3f} {row['train_rows']:>8d} {row['fit_seconds']:>8.2f} {row['speedup']:>7.2f}x "
+                  f"{row['delta_roc_auc_score']:>+8.4f} {row['delta_f1_score']:>+8.4f} "
+                  f"{row['delta_precision_score']:>+8.4f} {row['delta_recall_score']:>+8.4f}")
+
+            with mlflow.start_run(run_name=f"{config['name']}_r{row['rate']}"):
+                mlflow.log_params({"neg_sampling_rate": row["rate"], "train_rows": row["train_rows"]})
+                mlflow.set_tags({**config["tags"], "purpose": "sampling_report"})
+                mlflow.log_metrics({k: v for k, v in row.items() if k not in ("rate", "train_rows")})
+
+
+def run_cross_validation(n_splits, n_jobs=CV_N_JOBS):
+    """對所有 sklearn 類模型配置平行執行 stratified k-fold，將各指標的平均與標準差記錄到 MLflow。"""
+
+    print(f"設定 MLflow Tracking URI: {MLFLOW_TRACKING_URI}")
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    # 使用獨立實驗：CV run 沒有可部署的模型，不應被 API 選中
+    experiment = mlflow.set_experiment(CROSS_VALIDATION_EXPERIMENT)
+    logger = AsyncMlflowLogger(experiment.experiment_id)
+
+    try:
+        engine = create_engine(DATABASE_URL)
+        X, y = load_features(engine)
+
+        # TensorFlow 模型訓練成本高且已自行使用多執行緒，不納入平行交叉驗證
+        configs = resolve_model_configs([config for config in MODEL_CONFIGS if config.get("type") != "tensorflow"])
+        summary = cross_validate_configs(
+            configs, X, y,
+            n_splits=n_splits,
+            n_jobs=n_jobs,
+            threshold=DECISION_THRESHOLD,
+            default_sampling_rate=NEG_SAMPLING_RATE
+        )
+
+        print(f"\n{'model':<36} {'F1 mean±std':>16} {'AUC mean±std':>16} {'fit(s)':>8}")
+        for config in configs:
+            result = summary[config["name"]]
+            print(f"{config['name']:<36} {result['f1_score_mean']:>8.4f}±{result['f1_score_std']:<7.4f} "
+                  f"{result['roc_auc_score_mean']:>8.4f}±{result['roc_auc_score_std']:<7.4f} "
+                  f"{result['fit_seconds_mean']:>8.2f}")
+
+            run_id = logger.start_run(f"{config['name']}_cv{n_splits}",
+                                      tags={**config["tags"], "purpose": "cross_validation"})
+            logger.log_params(run_id, {**config["params"], "cv_folds": n_splits,
+                                       "neg_sampling_rate": config.get("neg_sampling_rate", NEG_SAMPLING_RATE)})
+            logger.log_metrics(run_id, {
+                f"cv_{key}": value
+                for key, value in result.items()
+                if key.endswith(("_mean", "_std"))
+            })
+            logger.log_metrics(run_id, {"cv_wall_seconds": result["wall_seconds"]})
+            logger.end_run(run_id)
+    finally:
+        logger.close()
+
 
 def main():
     """主執行函式 - 供 Airflow DAG 呼叫"""
+    import argparse
+    parser = argparse.ArgumentParser(description="詐欺偵測模型訓練")
+    parser.add_argument(
+        "--sampling-report", metavar="RATES",
+        help="以逗號分隔的負類別採樣率 (例如 0.5,0.1,0.05)，只輸出各模型的加速與指標比較，不訓練正式模型"
+    )
+    parser.add_argument(
+        "--cv-folds", type=int, metavar="K",
+        help="以 stratified K-fold 平行評估所有模型配置 (平均/標準差記錄到 MLflow)，不訓練正式模型"
+    )
+    parser.add_argument("--cv-jobs", type=int, default=CV_N_JOBS, help="交叉驗證的平行行程數 (-1 = 全部核心)")
+    parser.add_argument("--model", metavar="NAME", help="只訓練指定名稱的模型配置 (失敗時以非零狀態結束)")
+    parser.add_argument("--select", action="store_true",
+                        help="從 PIPELINE_RUN_ID 對應的訓練 run 中選出服務模型並標記 selected_for_serving")
+    parser.add_argument("--list-models", action="store_true", help="列出所有模型配置名稱")
+    args = parser.parse_args()
+
+    if args.list_models:
+        print("\n".join(get_model_config_names()))
+        return
+
     try:
-        run_etl_and_train_pipeline()
+        if args.sampling_report:
+            run_sampling_report([float(r) for r in args.sampling_report.split(",")])
+        elif args.cv_folds:
+            run_cross_validation(args.cv_folds, args.cv_jobs)
+        elif args.model:
+            run_single_model(args.model)
+        elif args.select:
+            select_serving_model()
+        else:
+            run_etl_and_train_pipeline()
         # 明確指定成功退出，即使 MLflow API 有問題
         print("🎯 主函數執行完成，強制返回成功狀態")
         import sys
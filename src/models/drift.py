@@ -0,0 +1,178 @@
+# src/models/drift.py
+"""
+輸入分佈漂移監控 (Drift Monitoring)
+
+訓練時 (transform_data) 以保留的測試集各特徵的分位數切出固定分箱，記錄每箱的筆數作為參考分佈，
+與模型一起存到 run 的 drift/ 目錄 (刻意不用訓練集：下採樣會扭曲訓練集的分佈，測試集保有原始流量的分佈)；API 以同一組分箱持續累計線上輸入的直方圖，
+定期與參考分佈比較並計算：
+
+- PSI (Population Stability Index)：sum((p - q) * ln(p / q))，> 0.2 通常視為顯著漂移
+- KS：以分箱累積分佈近似的 Kolmogorov-Smirnov 統計量 (各分箱邊界上 CDF 差的最大值)
+
+線上狀態只有 [特徵數 × 分箱數] 的計數矩陣，記憶體固定；每次更新是一次向量化的分箱比較。
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+DRIFT_REFERENCE_FILE = 'drift_reference.json'
+DRIFT_FORMAT_VERSION = 1
+# time 隨時間單調遞增，必然「漂移」，不列入監控
+DRIFT_FEATURES = ['amount'] + [f'v{i}' for i in range(1, 29)]
+DRIFT_BINS = int(os.getenv('DRIFT_BINS', '20'))
+DRIFT_WINDOW_SECONDS = float(os.getenv('DRIFT_WINDOW_SECONDS', '300'))
+# 視窗內筆數太少時 PSI 不穩定，延後到累積足夠筆數再計算
+DRIFT_MIN_ROWS = int(os.getenv('DRIFT_MIN_ROWS', '500'))
+DRIFT_PSI_THRESHOLD = float(os.getenv('DRIFT_PSI_THRESHOLD', '0.2'))
+# 空箱的比例下限，避免 ln(0)
+_EPSILON = 1e-4
+
+
+def _bin_index(X, edges):
+    """X: (n, 特徵數)，edges: (特徵數, 分箱數 - 1)，回傳每個值所在的分箱 (值 <= 第一個邊界為第 0 箱)。"""
+    return (X[:, :, None] > edges[None, :, :]).sum(axis=2)
+
+
+def _padded_edges(edges_by_feature, n_bins):
+    """各特徵去除重複後的邊界數可能不同，以 +inf 補齊成同樣長度 (多出的分箱永遠是空的)。"""
+    edges = np.full((len(edges_by_feature), n_bins - 1), np.inf)
+    for i, feature_edges in enumerate(edges_by_feature):
+        edges[i, :len(feature_edges)] = feature_edges
+    return edges
+
+
+def _count_bins(X, edges, n_bins):
+    n_features = edges.shape[0]
+    flat = _bin_index(X, edges) + np.arange(n_features) * n_bins
+    return np.bincount(flat.ravel(), minlength=n_features * n_bins).reshape(n_features, n_bins)
+
+
+def build_reference_profile(df, features=DRIFT_FEATURES, n_bins=DRIFT_BINS):
+    """以訓練資料建立參考分佈：每個特徵依分位數切成 n_bins 箱並記錄每箱筆數。"""
+    features = [f for f in features if f in df.columns]
+    X = df[features].to_numpy(dtype=np.float64)
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    edges_by_feature = [np.unique(np.quantile(X[:, i], quantiles)) for i in range(len(features))]
+    edges = _padded_edges(edges_by_feature, n_bins)
+    counts = _count_bins(X, edges, n_bins)
+    return {
+        "version": DRIFT_FORMAT_VERSION,
+        "n_bins": n_bins,
+        "rows": len(X),
+        "features": {
+            name: {"edges": edges_by_feature[i].tolist(), "counts": counts[i].tolist()}
+            for i, name in enumerate(features)
+        },
+    }
+
+
+def save_reference_profile(profile, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, DRIFT_REFERENCE_FILE), 'w') as f:
+        json.dump(profile, f)
+
+
+def load_reference_profile(path):
+    """讀取 drift/ 目錄 (或 JSON 檔本身) 中的參考分佈。"""
+    if os.path.isdir(path):
+        path = os.path.join(path, DRIFT_REFERENCE_FILE)
+    with open(path) as f:
+        profile = json.load(f)
+    if profile.get("version") != DRIFT_FORMAT_VERSION:
+        raise ValueError(f"不支援的漂移參考格式版本: {profile.get('version')}")
+    return profile
+
+
+def drift_scores(counts, reference_counts):
+    """逐特徵計算 PSI 與分箱 KS；counts 與 reference_counts 皆為 (特徵數, 分箱數)。"""
+    p = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    q = reference_counts / np.maximum(reference_counts.sum(axis=1, keepdims=True), 1)
+    ks = np.abs(np.cumsum(p, axis=1) - np.cumsum(q, axis=1)).max(axis=1)
+    p, q = np.maximum(p, _EPSILON), np.maximum(q, _EPSILON)
+    psi = ((p - q) * np.log(p / q)).sum(axis=1)
+    return psi, ks
+
+
+class DriftMonitor:
+    """API 用的串流直方圖：以參考分佈的分箱累計線上輸入，每 window_seconds 秒結算一次漂移分數。
+
+    結算採用滾動視窗 (tumbling window)：視窗結束且筆數足夠時計算 PSI/KS 並清空計數；
+    另保留啟動以來的累計直方圖。執行緒安全。
+    """
+
+    def __init__(self, profile, run_id=None, window_seconds=DRIFT_WINDOW_SECONDS, min_rows=DRIFT_MIN_ROWS,
+                 psi_threshold=DRIFT_PSI_THRESHOLD):
+        self.run_id = run_id
+        self.features = list(profile["features"])
+        self.n_bins = profile["n_bins"]
+        self.window_seconds = window_seconds
+        self.min_rows = min_rows
+        self.psi_threshold = psi_threshold
+        self._edges = _padded_edges([profile["features"][f]["edges"] for f in self.features], self.n_bins)
+        self._reference = np.asarray([profile["features"][f]["counts"] for f in self.features], dtype=np.float64)
+        self._window_counts = np.zeros((len(self.features), self.n_bins), dtype=np.int64)
+        self._total_counts = np.zeros_like(self._window_counts)
+        self._window_started = time.time()
+        self._last_window = None
+        self._lock = threading.Lock()
+
+    def update(self, records):
+        """累計一批輸入 (dict 列表)；視窗到期時順便結算。"""
+        X = np.array([[record[name] for name in self.features] for record in records], dtype=np.float64)
+        counts = _count_bins(X, self._edges, self.n_bins)
+        with self._lock:
+            self._window_counts += counts
+            self._total_counts += counts
+            if time.time() - self._window_started >= self.window_seconds:
+                self._close_window()
+
+    def _close_window(self):
+        rows = int(self._window_counts[0].sum())
+        now = time.time()
+        if rows >= self.min_rows:
+            psi, ks = drift_scores(self._window_counts, self._reference)
+            self._last_window = {"started_at": self._window_started, "ended_at": now, "rows": rows,
+                                 "psi": psi, "ks": ks}
+            self._window_counts[:] = 0
+            self._window_started = now
+        # 筆數不足時延長目前視窗，直到累積 min_rows 筆
+
+    def _summarize(self, psi, ks):
+        order = np.argsort(-psi)
+        return {
+            "max_psi": float(psi.max()),
+            "max_ks": float(ks.max()),
+            "drifted_features": [self.features[i] for i in order if psi[i] > self.psi_threshold],
+            "features": {self.features[i]: {"psi": float(psi[i]), "ks": float(ks[i])} for i in order},
+        }
+
+    def snapshot(self):
+        """回傳最近一個完整視窗與啟動以來累計的 PSI/KS (依 PSI 由高到低排列)。"""
+        with self._lock:
+            if time.time() - self._window_started >= self.window_seconds:
+                self._close_window()
+            last_window = self._last_window
+            total_counts = self._total_counts.copy()
+            window_rows = int(self._window_counts[0].sum())
+
+        result = {
+            "reference_run_id": self.run_id,
+            "psi_threshold": self.psi_threshold,
+            "window_seconds": self.window_seconds,
+            "current_window_rows": window_rows,
+            "last_window": None,
+            "since_start": None,
+        }
+        if last_window is not None:
+            result["last_window"] = {
+                "started_at": last_window["started_at"], "ended_at": last_window["ended_at"],
+                "rows": last_window["rows"], **self._summarize(last_window["psi"], last_window["ks"]),
+            }
+        total_rows = int(total_counts[0].sum())
+        if total_rows:
+            psi, ks = drift_scores(total_counts, self._reference)
+            result["since_start"] = {"rows": total_rows, **self._summarize(psi, ks)}
+        return result
@@ -0,0 +1,334 @@
+# src/models/serving_artifact.py
+"""
+精簡服務用模型格式 (Serving Artifact)
+
+訓練時 (transform_data) 將模型匯出成一個目錄：
+    manifest.json   版本、模型種類、特徵順序、決策門檻、scaler 參數
+    *.npy           模型權重 (純 numpy 陣列)
+
+API 啟動時以 np.load(mmap_mode='r') 讀取，不需要反序列化 sklearn pickle、
+pyfunc wrapper 或 Keras SavedModel，也不需要安裝 xgboost/lightgbm/tensorflow。
+
+支援的模型種類：
+- linear:        LogisticRegression (coef + intercept)
+- tree_ensemble: XGBoost / LightGBM，所有樹攤平成同一組節點表
+- mlp:           Keras Dense / BatchNormalization 組成的前饋網路
+"""
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# LightGBM 的缺失值型別
+_MISSING_NONE, _MISSING_ZERO, _MISSING_NAN = 0, 1, 2
+_LGBM_ZERO_THRESHOLD = 1e-35
+
+
+class UnsupportedModelError(ValueError):
+    """模型種類無法匯出成精簡格式。"""
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+# --- 匯出 ---
+
+def _export_linear(model):
+    return {"kind": "linear"}, {
+        "coef": np.asarray(model.coef_, dtype=np.float64).ravel(),
+        "intercept": np.asarray(model.intercept_, dtype=np.float64).ravel(),
+    }
+
+
+def _export_xgboost(model):
+    """將 XGBoost 的 JSON 模型攤平成節點表；葉節點的值存在 split_conditions。"""
+    booster = model.get_booster()
+    learner = json.loads(bytes(booster.save_raw(raw_format='json')))['learner']
+    trees = learner['gradient_booster']['model']['trees']
+
+    features, thresholds, lefts, rights, default_left, values, roots = [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        left = np.asarray(tree['left_children'], dtype=np.int64)
+        right = np.asarray(tree['right_children'], dtype=np.int64)
+        # JSON 以最短表示法輸出 float32，需先還原成 float32 才能與 XGBoost 的比較結果一致
+        cond = np.asarray(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+        is_leaf = left == -1
+
+        features.append(np.where(is_leaf, -1, np.asarray(tree['split_indices'], dtype=np.int64)))
+        thresholds.append(np.where(is_leaf, 0.0, cond))
+        values.append(np.where(is_leaf, cond, 0.0))
+        lefts.append(np.where(is_leaf, -1, left + offset))
+        rights.append(np.where(is_leaf, -1, right + offset))
+        default_left.append(np.asarray(tree['default_left'], dtype=bool))
+        roots.append(offset)
+        offset += len(left)
+
+    # base_score 可能是 "5E-1" 或 "[5E-1]" (新版 XGBoost 支援多輸出)
+    base_score = float(str(learner['learner_model_param']['base_score']).strip('[]').split(',')[0])
+    manifest = {
+        "kind": "tree_ensemble",
+        "split_rule": "lt",          # XGBoost: x < threshold 走左邊
+        "input_dtype": "float32",    # XGBoost 以 float32 比較
+        "base_margin": float(np.log(base_score / (1 - base_score))),
+        "sigmoid_scale": 1.0,
+        "max_depth": _tree_depth(np.concatenate(lefts), np.concatenate(rights), roots),
+    }
+    return manifest, {
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts).astype(np.int32),
+        "right": np.concatenate(rights).astype(np.int32),
+        "default_left": np.concatenate(default_left),
+        "missing_type": np.full(offset, _MISSING_NAN, dtype=np.int8),
+        "value": np.concatenate(values),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+
+
+def _export_lightgbm(model):
+    """將 LightGBM dump_model() 的巢狀樹結構攤平成節點表。"""
+    dump = model.booster_.dump_model()
+    missing_codes = {"None": _MISSING_NONE, "Zero": _MISSING_ZERO, "NaN": _MISSING_NAN}
+
+    nodes = {"feature": [], "threshold": [], "left": [], "right": [], "default_left": [],
+             "missing_type": [], "value": []}
+    roots = []
+
+    def add(node):
+        index = len(nodes["feature"])
+        for column in nodes.values():
+            column.append(None)
+        if 'leaf_value' in node:
+            nodes["feature"][index] = -1
+            nodes["threshold"][index] = 0.0
+            nodes["left"][index] = nodes["right"][index] = -1
+            nodes["default_left"][index] = False
+            nodes["missing_type"][index] = _MISSING_NONE
+            nodes["value"][index] = node['leaf_value']
+            return index
+        if node.get('decision_type', '<=') != '<=':
+            raise UnsupportedModelError(f"不支援的 LightGBM 分割型別: {node.get('decision_type')}")
+        nodes["feature"][index] = node['split_feature']
+        nodes["threshold"][index] = node['threshold']
+        nodes["default_left"][index] = bool(node.get('default_left', True))
+        nodes["missing_type"][index] = missing_codes.get(node.get('missing_type', 'None'), _MISSING_NONE)
+        nodes["value"][index] = 0.0
+        nodes["left"][index] = add(node['left_child'])
+        nodes["right"][index] = add(node['right_child'])
+        return index
+
+    for tree in dump['tree_info']:
+        roots.append(add(tree['tree_structure']))
+
+    # objective 例如 "binary sigmoid:1"
+    sigmoid_scale = 1.0
+    for token in str(dump.get('objective', '')).split():
+        if token.startswith('sigmoid:'):
+            sigmoid_scale = float(token.split(':', 1)[1])
+
+    arrays = {
+        "feature": np.asarray(nodes["feature"], dtype=np.int32),
+        "threshold": np.asarray(nodes["threshold"], dtype=np.float64),
+        "left": np.asarray(nodes["left"], dtype=np.int32),
+        "right": np.asarray(nodes["right"], dtype=np.int32),
+        "default_left": np.asarray(nodes["default_left"], dtype=bool),
+        "missing_type": np.asarray(nodes["missing_type"], dtype=np.int8),
+        "value": np.asarray(nodes["value"], dtype=np.float64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    manifest = {
+        "kind": "tree_ensemble",
+        "split_rule": "le",          # LightGBM: x <= threshold 走左邊
+        "input_dtype": "float64",
+        "base_margin": 0.0,          # 初始分數已併入第一棵樹的葉節點
+        "sigmoid_scale": sigmoid_scale,
+        "max_depth": _tree_depth(arrays["left"], arrays["right"], roots),
+    }
+    return manifest, arrays
+
+
+def _tree_depth(left, right, roots):
+    """計算所有樹中最深的路徑長度 (走訪時的最大迴圈次數)。"""
+    depth = 0
+    frontier = np.asarray(roots, dtype=np.int64)
+    while frontier.size:
+        children = np.concatenate([left[frontier], right[frontier]])
+        frontier = children[children >= 0]
+        if frontier.size:
+            depth += 1
+    return depth
+
+
+def _export_keras(model):
+    """將 Dense / BatchNormalization 層轉成逐層的仿射轉換；Dropout 在推論時為恆等映射。"""
+    layers_meta, arrays = [], {}
+    for layer in model.layers:
+        layer_type = type(layer).__name__
+        if layer_type in ('InputLayer', 'Dropout'):
+            continue
+        index = len(layers_meta)
+        if layer_type == 'Dense':
+            kernel, bias = layer.get_weights()
+            activation = layer.get_config().get('activation', 'linear')
+            if activation not in ('linear', 'relu', 'sigmoid', 'tanh'):
+                raise UnsupportedModelError(f"不支援的激活函數: {activation}")
+            arrays[f"layer{index}_kernel"] = kernel.astype(np.float32)
+            arrays[f"layer{index}_bias"] = bias.astype(np.float32)
+            layers_meta.append({"type": "dense", "activation": activation})
+        elif layer_type == 'BatchNormalization':
+            gamma, beta, mean, var = layer.get_weights()
+            scale = gamma / np.sqrt(var + layer.epsilon)
+            arrays[f"layer{index}_scale"] = scale.astype(np.float32)
+            arrays[f"layer{index}_shift"] = (beta - mean * scale).astype(np.float32)
+            layers_meta.append({"type": "affine"})
+        else:
+            raise UnsupportedModelError(f"不支援的 Keras 層: {layer_type}")
+    return {"kind": "mlp", "layers": layers_meta, "input_dtype": "float32"}, arrays
+
+
+def export_serving_artifact(model, output_dir, feature_order, threshold=0.5, model_type=None,
+                            scaler=None, scaler_columns=None):
+    """將模型匯出成精簡服務格式，回傳輸出目錄。
+
+    scaler 為訓練時套用在 scaler_columns 上的 StandardScaler；訓練若直接使用原始特徵則為 None。
+    無法匯出的模型會拋出 UnsupportedModelError。
+    """
+    class_name = type(model).__name__
+    if class_name == 'LogisticRegression':
+        manifest, arrays = _export_linear(model)
+    elif class_name == 'XGBClassifier':
+        manifest, arrays = _export_xgboost(model)
+    elif class_name == 'LGBMClassifier':
+        manifest, arrays = _export_lightgbm(model)
+    elif hasattr(model, 'layers'):
+        manifest, arrays = _export_keras(model)
+    else:
+        raise UnsupportedModelError(f"不支援匯出的模型類別: {class_name}")
+
+    manifest.update({
+        "format_version": FORMAT_VERSION,
+        "model_type": model_type or class_name,
+        "feature_order": list(feature_order),
+        "threshold": float(threshold),
+        "scaler": {
+            "columns": list(scaler_columns or []),
+            "mean": [float(v) for v in scaler.mean_] if scaler is not None else [],
+            "scale": [float(v) for v in scaler.scale_] if scaler is not None else [],
+        },
+        "arrays": sorted(arrays),
+    })
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return output_dir
+
+
+# --- 載入與推論 ---
+
+class CompactModel:
+    """以 memory-map 載入的精簡模型，輸入為依 feature_order 排列的原始特徵矩陣。"""
+
+    def __init__(self, manifest, arrays, run_id=None):
+        self.manifest = manifest
+        self.arrays = arrays
+        self.run_id = run_id
+        self.kind = manifest["kind"]
+        self.model_type = manifest["model_type"]
+        self.feature_order = manifest["feature_order"]
+        self.threshold = manifest["threshold"]
+
+        scaler = manifest.get("scaler") or {}
+        self._scale_index = np.asarray([self.feature_order.index(c) for c in scaler.get("columns", [])], dtype=np.int64)
+        self._scale_mean = np.asarray(scaler.get("mean", []), dtype=np.float64)
+        self._scale_std = np.asarray(scaler.get("scale", []), dtype=np.float64)
+
+    def vectorize(self, records):
+        """將 dict 列表或 DataFrame 依 feature_order 轉成特徵矩陣並套用 scaler。"""
+        if hasattr(records, 'columns'):
+            X = records[self.feature_order].to_numpy(dtype=np.float64, copy=True)
+        else:
+            X = np.array([[record[name] for name in self.feature_order] for record in records], dtype=np.float64)
+        if self._scale_index.size:
+            X[:, self._scale_index] = (X[:, self._scale_index] - self._scale_mean) / self._scale_std
+        return X
+
+    def predict_proba(self, X):
+        """回傳每一列為詐欺的機率 (一維陣列)。"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if self.kind == "linear":
+            return _sigmoid(X @ self.arrays["coef"] + self.arrays["intercept"][0])
+        if self.kind == "tree_ensemble":
+            return self._predict_trees(X)
+        return self._predict_mlp(X)
+
+    def predict(self, X):
+        return (self.predict_proba(X) > self.threshold).astype(int)
+
+    def _predict_trees(self, X):
+        a, m = self.arrays, self.manifest
+        if m["input_dtype"] == "float32":
+            X = X.astype(np.float32).astype(np.float64)
+
+        n_rows = X.shape[0]
+        rows = np.arange(n_rows)[:, None]
+        node = np.broadcast_to(np.asarray(a["roots"], dtype=np.int64), (n_rows, len(a["roots"]))).copy()
+
+        for _ in range(m["max_depth"]):
+            feature = a["feature"][node]
+            internal = feature >= 0
+            if not internal.any():
+                break
+            x = X[rows, np.where(internal, feature, 0)]
+            threshold = a["threshold"][node]
+            missing_type = a["missing_type"][node]
+
+            is_nan = np.isnan(x)
+            x = np.where(is_nan & (missing_type == _MISSING_NONE), 0.0, x)
+            missing = (is_nan & (missing_type != _MISSING_NONE)) | (
+                (missing_type == _MISSING_ZERO) & (np.abs(x) <= _LGBM_ZERO_THRESHOLD)
+            )
+            go_left = (x < threshold) if m["split_rule"] == "lt" else (x <= threshold)
+            go_left = np.where(missing, a["default_left"][node], go_left)
+
+            child = np.where(go_left, a["left"][node], a["right"][node])
+            node = np.where(internal, child, node)
+
+        margin = a["value"][node].sum(axis=1) + m["base_margin"]
+        return _sigmoid(m["sigmoid_scale"] * margin)
+
+    def _predict_mlp(self, X):
+        h = X.astype(np.float32)
+        for index, layer in enumerate(self.manifest["layers"]):
+            if layer["type"] == "affine":
+                h = h * self.arrays[f"layer{index}_scale"] + self.arrays[f"layer{index}_shift"]
+                continue
+            h = h @ self.arrays[f"layer{index}_kernel"] + self.arrays[f"layer{index}_bias"]
+            if layer["activation"] == "relu":
+                h = np.maximum(h, 0)
+            elif layer["activation"] == "sigmoid":
+                h = _sigmoid(h)
+            elif layer["activation"] == "tanh":
+                h = np.tanh(h)
+        return h.reshape(len(h), -1)[:, -1].astype(np.float64)
+
+
+def load_serving_artifact(path, run_id=None, mmap=True):
+    """讀取精簡服務格式；權重以 memory-map 方式開啟，啟動時間與模型大小無關。"""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"不支援的 serving artifact 版本: {manifest.get('format_version')}")
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in manifest["arrays"]}
+    return CompactModel(manifest, arrays, run_id=run_id)
@@ -0,0 +1,195 @@
+# src/models/velocity_features.py
+"""
+時間窗速度特徵 (Velocity Features)
+
+每筆交易加上「前 W 秒內」的交易筆數與金額總和 (tx_count_{W}s / amount_sum_{W}s)，
+W 由 VELOCITY_WINDOWS 設定。訓練與服務共用同一個定義：
+
+    前 W 秒 = time 落在 (t - W, t) 的交易，不含與本筆同時間 (含本筆) 的交易
+
+排除同時間的交易讓結果與同一秒內交易的先後順序無關，資料庫讀出的順序不同也不會改變特徵。
+金額以整數分 (cents) 累加，批次的 cumsum 相減與線上的逐筆加減得到完全相同的數值。
+
+- add_velocity_features: 訓練 / 批次評分用，對依 time 排序的資料一次向量化計算
+- OnlineVelocityFeatures: API 用，每個視窗一個環形緩衝區，每筆事件攤銷 O(1) 更新
+
+線上狀態假設事件依 time 非遞減到達；較早的遲到事件視為與目前時間同時 (計入 late_events)。
+設定 max_lateness 時，落後目前時間超過該秒數的事件 (歷史資料、時鐘錯誤) 不更新狀態，只回傳目前的特徵
+(計入 stale_events)，避免一筆舊事件改變之後所有事件的特徵。
+
+用法: python -m models.velocity_features [--csv data/creditcard.csv] [--events N]
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+VELOCITY_WINDOWS = tuple(int(w) for w in os.getenv('VELOCITY_WINDOWS', '60,600,3600').split(','))
+
+
+def velocity_feature_names(windows=VELOCITY_WINDOWS):
+    """回傳特徵欄位名稱 (依視窗排列，每個視窗先 count 後 amount_sum)。"""
+    return [name for w in windows for name in (f"tx_count_{w}s", f"amount_sum_{w}s")]
+
+
+def parse_velocity_windows(feature_order):
+    """從模型的特徵順序找出需要的視窗；模型不使用速度特徵時回傳空 tuple。"""
+    windows = []
+    for name in feature_order:
+        if name.startswith("tx_count_") and name.endswith("s"):
+            windows.append(int(name[len("tx_count_"):-1]))
+    return tuple(windows)
+
+
+def _to_cents(amounts):
+    return np.rint(np.asarray(amounts, dtype=np.float64) * 100).astype(np.int64)
+
+
+def add_velocity_features(df, windows=VELOCITY_WINDOWS, reference=None):
+    """回傳加上速度特徵的 DataFrame (列順序不變)。
+
+    reference 為計算視窗時使用的交易流 (需有 time、amount 欄位)，預設為 df 本身；
+    批次評分時傳入包含回溯區間的完整交易，讓分塊邊界的特徵與整體計算一致。
+    """
+    reference = df if reference is None else reference
+    ref_time = reference['time'].to_numpy(dtype=np.float64)
+    order = np.argsort(ref_time, kind='stable')
+    ref_time = ref_time[order]
+    # cumsum 前補 0：區間 [lo, hi) 的總和 = cents_cumsum[hi] - cents_cumsum[lo]
+    cents_cumsum = np.concatenate([[0], np.cumsum(_to_cents(reference['amount'].to_numpy())[order])])
+
+    query_time = df['time'].to_numpy(dtype=np.float64)
+    hi = np.searchsorted(ref_time, query_time, side='left')
+    features = {}
+    for w in windows:
+        lo = np.searchsorted(ref_time, query_time - w, side='right')
+        features[f"tx_count_{w}s"] = hi - lo
+        features[f"amount_sum_{w}s"] = (cents_cumsum[hi] - cents_cumsum[lo]) / 100.0
+    return df.assign(**features)
+
+
+class OnlineVelocityFeatures:
+    """API 線上評分用的速度特徵狀態 (執行緒安全)。
+
+    每個視窗以 deque 保存視窗內的 (time, cents) 與金額總和；新事件到達時從左側淘汰過期事件，
+    同時間的事件先暫存，等時間前進後才放入視窗，與 add_velocity_features 的定義一致。
+    """
+
+    def __init__(self, windows=VELOCITY_WINDOWS, max_lateness=None):
+        self.windows = tuple(windows)
+        self.max_lateness = max_lateness
+        self.events_total = 0
+        self.late_events = 0
+        self.stale_events = 0
+        self._buffers = [deque() for _ in self.windows]
+        self._sums = [0] * len(self.windows)
+        self._current_time = None
+        self._pending = []  # 與 _current_time 同時間、尚未放入視窗的金額 (cents)
+        self._current_features = None
+        self._lock = threading.Lock()
+
+    def update(self, time_value, amount):
+        """加入一筆事件並回傳該筆的速度特徵 dict。"""
+        cents = round(amount * 100)
+        with self._lock:
+            self.events_total += 1
+            if self._current_time is not None and time_value <= self._current_time:
+                if self.is_stale(time_value):
+                    self.stale_events += 1
+                    return dict(self._current_features)
+                if time_value < self._current_time:
+                    self.late_events += 1
+                self._pending.append(cents)
+                return dict(self._current_features)
+
+            # 時間前進：先把上一個時間點的事件放入視窗，再淘汰 time <= t - W 的事件
+            for i, w in enumerate(self.windows):
+                buffer = self._buffers[i]
+                for pending_cents in self._pending:
+                    buffer.append((self._current_time, pending_cents))
+                    self._sums[i] += pending_cents
+                cutoff = time_value - w
+                while buffer and buffer[0][0] <= cutoff:
+                    self._sums[i] -= buffer.popleft()[1]
+
+            self._current_time = time_value
+            self._pending = [cents]
+            self._current_features = {}
+            for i, w in enumerate(self.windows):
+                self._current_features[f"tx_count_{w}s"] = len(self._buffers[i])
+                self._current_features[f"amount_sum_{w}s"] = self._sums[i] / 100.0
+            return dict(self._current_features)
+
+    def is_stale(self, time_value):
+        """事件是否落後目前時間超過 max_lateness (未設定 max_lateness 時一律為 False)。"""
+        current_time = self._current_time
+        return (self.max_lateness is not None and current_time is not None
+                and current_time - time_value > self.max_lateness)
+
+    def enrich(self, records):
+        """依序更新多筆交易 (dict 列表，需有 time、amount)，回傳加上速度特徵的新 dict 列表。"""
+        return [{**record, **self.update(record['time'], record['amount'])} for record in records]
+
+
+def benchmark_online(times, amounts, windows=VELOCITY_WINDOWS):
+    """量測線上更新的吞吐量與單筆延遲，回傳 (特徵 DataFrame, 統計 dict)。"""
+    state = OnlineVelocityFeatures(windows)
+    rows = []
+    latencies = np.empty(len(times))
+    start = time.perf_counter()
+    for i, (t, amount) in enumerate(zip(times.tolist(), amounts.tolist())):
+        event_start = time.perf_counter()
+        rows.append(state.update(t, amount))
+        latencies[i] = time.perf_counter() - event_start
+    wall_seconds = time.perf_counter() - start
+
+    stats = {
+        "events": len(times),
+        "events_per_second": len(times) / max(wall_seconds, 1e-9),
+        "update_p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "update_p99_us": float(np.percentile(latencies, 99) * 1e6),
+        "late_events": state.late_events,
+    }
+    return pd.DataFrame(rows), stats
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="比對批次與線上速度特徵並量測線上更新吞吐量")
+    parser.add_argument("--csv", help="交易 CSV (需有 Time、Amount 欄位)；未指定則使用合成資料")
+    parser.add_argument("--events", type=int, default=200_000, help="合成資料的事件數")
+    args = parser.parse_args()
+
+    if args.csv:
+        df = pd.read_csv(args.csv, usecols=lambda c: c.lower() in ("time", "amount"))
+        df.columns = [c.lower() for c in df.columns]
+    else:
+        rng = np.random.default_rng(42)
+        # 約每秒 2 筆，time 取整數秒以產生大量同時間事件
+        df = pd.DataFrame({
+            "time": np.floor(np.cumsum(rng.exponential(0.5, args.events))),
+            "amount": np.round(rng.lognormal(3, 1.5, args.events), 2),
+        })
+    df = df.sort_values("time", kind="stable").reset_index(drop=True)
+
+    start = time.perf_counter()
+    batch = add_velocity_features(df)
+    batch_seconds = time.perf_counter() - start
+    online, stats = benchmark_online(df["time"].to_numpy(), df["amount"].to_numpy())
+
+    names = velocity_feature_names()
+    mismatched = int((batch[names].to_numpy() != online[names].to_numpy()).any(axis=1).sum())
+    print(f"批次計算: {len(df)} 筆 {batch_seconds * 1000:.0f} ms ({len(df) / max(batch_seconds, 1e-9):,.0f} rows/s)")
+    print(f"線上更新: {stats['events_per_second']:,.0f} events/s, "
+          f"p50={stats['update_p50_us']:.1f}µs p99={stats['update_p99_us']:.1f}µs")
+    if mismatched:
+        print(f"🔥 批次與線上特徵有 {mismatched} 筆不一致")
+        raise SystemExit(1)
+    print(f"✅ 批次與線上特徵完全一致 ({', '.join(names)})")
+
+
+if __name__ == "__main__":
+    main()